@@ -0,0 +1,359 @@
+import time
+import numpy as np
+from helper import distance_matrix, grid_positions
+from heuristic import route_volume, savings_routes
+from packing import ExtremePointPacker
+from solution import Solution
+
+# Status codes of a Solution found by the search, equal to the Gurobi codes so they compare with MIP solutions
+ITERATION_LIMIT = 7
+TIME_LIMIT = 9
+
+class ALNS():
+    '''
+    Adaptive large neighbourhood search over the routes of the 3L-CVRP, without Gurobi. Every iteration removes
+    customers with one of the destroy operators and reinserts them with one of the repair operators, a route is only
+    changed into one the extreme-point packer can load and that fits the vehicle volume (constraint 8). Operators are
+    chosen by adaptive weights and new solutions are accepted by simulated annealing. Solutions using more routes
+    than vehicles are allowed while searching at a penalty per extra route. A time_limit of None runs the given
+    number of iterations only.
+    '''
+    # Removal and insertion operators, the scores of an operator pair for a new best, an improving and an accepted
+    # solution, and how fast the weights follow the scores
+    DESTROY = ("random_removal", "worst_removal", "related_removal")
+    REPAIR = ("greedy_insertion", "regret_insertion")
+    SCORES = (33, 9, 13)
+    REACTION = 0.1
+    SEGMENT = 100
+
+    def __init__(self, nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma, time_limit=10,
+                 iterations=None, seed=None):
+        self.nodes = nodes
+        self.depot = nodes[0]
+        self.vehicles = vehicles
+        self.dimensions = dimensions
+        self.boxes = boxes
+        self.demand = demand
+        self.maximum_reach = maximum_reach
+        self.p = p
+        self.sigma = sigma
+        self.links = links if isinstance(links, dict) else \
+            {(i, j): {"distance": links[k, l]} for k, i in enumerate(nodes) for l, j in enumerate(nodes)}
+        if time_limit is None and iterations is None:
+            raise ValueError("ALNS needs a time_limit or a number of iterations to stop")
+        self.time_limit = time_limit
+        self.iterations = iterations
+        self.rng = np.random.default_rng(seed)
+
+        self.distance = distance_matrix(nodes, links)
+        self.index = {k: idx for idx, k in enumerate(nodes)}
+        self.capacity = dimensions["length"] * dimensions["width"] * dimensions["height"]
+        self.packer = ExtremePointPacker(boxes, dimensions, grid_positions(dimensions, boxes, demand), p, sigma)
+
+        # Volume and packer slab length of every customer, a route exceeding the vehicle volume or length in either
+        # is rejected without packing it
+        self.volume = {k: route_volume([k], demand, boxes) for k in nodes[1:]}
+        self.slab = {k: self.packer.slab(k, demand) for k in nodes[1:]}
+
+        # Placements of every route the packer was asked to load, None when it could not
+        self.loadings = {}
+
+        # Penalty of a route above the number of vehicles, more than any route can cost
+        finite = self.distance[np.isfinite(self.distance) & ~np.eye(len(nodes), dtype=bool)]
+        self.penalty = 2 * len(nodes) * finite.max()
+
+        self.weights = {"destroy": np.ones(len(self.DESTROY)), "repair": np.ones(len(self.REPAIR))}
+        self.best = None
+        self.best_cost = np.inf
+        self.status = None
+        self.iteration_count = 0
+        self.history = []
+
+    def load(self, route):
+        '''
+        Placements of a route as (x, y, z, i, k) tuples, or None when it cannot be loaded
+        '''
+        route = tuple(route)
+        if route not in self.loadings:
+            self.loadings[route] = self.packer.pack(list(route), self.demand) if self.fits(route) else None
+        return self.loadings[route]
+
+    def fits(self, route):
+        '''
+        Checks whether the customers of a route stay within the vehicle volume and slab length
+        '''
+        return sum(self.volume[k] for k in route) <= self.capacity and \
+            sum(self.slab[k] for k in route) <= self.dimensions["length"]
+
+    def route_cost(self, route):
+        '''
+        Distance of a route from and back to the depot
+        '''
+        stops = [0] + [self.index[k] for k in route] + [0]
+        return self.distance[stops[:-1], stops[1:]].sum()
+
+    def cost(self, routes):
+        '''
+        Total distance of a solution plus the penalty of the routes above the number of vehicles
+        '''
+        return sum(self.route_cost(route) for route in routes) + \
+            self.penalty * max(0, len(routes) - len(self.vehicles))
+
+    def initial(self):
+        '''
+        Savings routes, or one route per customer when the savings heuristic needs more vehicles than available.
+        Returns None when a customer cannot be loaded on an empty vehicle.
+        '''
+        routes = savings_routes(self.nodes, self.links, len(self.vehicles), self.demand, self.boxes, self.dimensions,
+                                self.packer)
+        if routes is not None:
+            for route, placements in routes:
+                self.loadings[tuple(route)] = placements
+            return [list(route) for route, _ in routes]
+
+        routes = [[k] for k in self.nodes[1:]]
+        if any(self.load(route) is None for route in routes):
+            return None
+        return routes
+
+    def removal_count(self):
+        '''
+        Number of customers removed by a destroy operator, between 1 and 40% of the customers
+        '''
+        customers = len(self.nodes) - 1
+        return int(self.rng.integers(1, max(2, int(0.4 * customers)) + 1))
+
+    def random_removal(self, routes, count):
+        '''
+        Removes count customers chosen at random
+        '''
+        served = [k for route in routes for k in route]
+        return [served[idx] for idx in self.rng.choice(len(served), size=min(count, len(served)), replace=False)]
+
+    def worst_removal(self, routes, count):
+        '''
+        Removes the count customers whose removal saves the most distance, with some randomisation
+        '''
+        savings = []
+        for route in routes:
+            stops = [0] + [self.index[k] for k in route] + [0]
+            saved = self.distance[stops[:-2], stops[1:-1]] + self.distance[stops[1:-1], stops[2:]] - \
+                self.distance[stops[:-2], stops[2:]]
+            savings.extend(zip(saved, route))
+        savings.sort(key=lambda saving: -saving[0])
+
+        # Randomised rank selection favouring large savings, a power 3 of a uniform draw as by Ropke and Pisinger
+        removed = []
+        while len(removed) < min(count, len(savings)):
+            pick = int(len(savings) * self.rng.random() ** 3)
+            removed.append(savings.pop(pick)[1])
+        return removed
+
+    def related_removal(self, routes, count):
+        '''
+        Removes a random customer and the count - 1 customers closest to it
+        '''
+        served = [k for route in routes for k in route]
+        seed = served[self.rng.integers(len(served))]
+        closeness = self.distance[self.index[seed], [self.index[k] for k in served]] + \
+            self.distance[[self.index[k] for k in served], self.index[seed]]
+        return [served[idx] for idx in np.argsort(closeness)[:min(count, len(served))]]
+
+    def insertions(self, routes, k):
+        '''
+        Every insertion of customer k that fits the vehicle as (added distance, route, position), cheapest first.
+        A new route is the insertion at route len(routes), charged the penalty when all vehicles are in use.
+        '''
+        idx = self.index[k]
+        options = []
+        for r, route in enumerate(routes):
+            if not self.fits(route + [k]):
+                continue
+            stops = [0] + [self.index[l] for l in route] + [0]
+            added = self.distance[stops[:-1], idx] + self.distance[idx, stops[1:]] - \
+                self.distance[stops[:-1], stops[1:]]
+            options.extend((added[position], r, position) for position in range(len(added)))
+
+        new = self.distance[0, idx] + self.distance[idx, 0]
+        if len(routes) >= len(self.vehicles):
+            new += self.penalty
+        options.append((new, len(routes), 0))
+        options.sort()
+        return options
+
+    def cheapest_insertion(self, routes, k):
+        '''
+        Cheapest insertion of customer k whose route the packer can load as (added distance, route, position), or None
+        '''
+        for added, r, position in self.insertions(routes, k):
+            if not np.isfinite(added):
+                break
+            route = routes[r][:position] + [k] + routes[r][position:] if r < len(routes) else [k]
+            if self.load(route) is not None:
+                return added, r, position
+        return None
+
+    def route_insertion(self, route, k):
+        '''
+        Least added distance of inserting customer k anywhere into one route, infinite when the route would exceed the
+        vehicle volume or length. The loading is not checked.
+        '''
+        if not self.fits(route + [k]):
+            return np.inf
+        idx = self.index[k]
+        stops = [0] + [self.index[l] for l in route] + [0]
+        return (self.distance[stops[:-1], idx] + self.distance[idx, stops[1:]] - self.distance[stops[:-1], stops[1:]]).min()
+
+    def insert(self, routes, k, r, position):
+        '''
+        Inserts customer k into route r at position, r equal to len(routes) opens a new route
+        '''
+        if r == len(routes):
+            routes.append([k])
+        else:
+            routes[r].insert(position, k)
+
+    def greedy_insertion(self, routes, removed):
+        '''
+        Inserts the removed customers in random order, each at its cheapest loadable position. Returns False when a
+        customer cannot be inserted anywhere.
+        '''
+        for k in [removed[idx] for idx in self.rng.permutation(len(removed))]:
+            best = self.cheapest_insertion(routes, k)
+            if best is None:
+                return False
+            self.insert(routes, k, *best[1:])
+        return True
+
+    def regret_insertion(self, routes, removed):
+        '''
+        Inserts first the customer that loses the most from not getting its cheapest route, the regret between its
+        best and second best route, at its cheapest loadable position. Regrets are ranked on the added distance alone
+        with the least added distance of every customer per route kept and only recomputed for the route that changed,
+        so only the inserted customer is packed.
+        '''
+        removed = list(removed)
+        table = {k: [self.route_insertion(route, k) for route in routes] for k in removed}
+        while removed:
+            choice = None
+            for k in removed:
+                new = self.distance[0, self.index[k]] + self.distance[self.index[k], 0]
+                if len(routes) >= len(self.vehicles):
+                    new += self.penalty
+                costs = np.partition(np.append(table[k], [new, np.inf]), 1)[:2]
+                regret = costs[1] - costs[0]
+                if choice is None or regret > choice[0]:
+                    choice = (regret, k)
+
+            k = choice[1]
+            best = self.cheapest_insertion(routes, k)
+            if best is None:
+                return False
+            _, r, position = best
+            self.insert(routes, k, r, position)
+            removed.remove(k)
+            del table[k]
+            for l in removed:
+                if r < len(table[l]):
+                    table[l][r] = self.route_insertion(routes[r], l)
+                else:
+                    table[l].append(self.route_insertion(routes[r], l))
+        return True
+
+    def optimize(self):
+        '''
+        Runs the search until the time limit or the iteration limit. Returns the route and placements of every used
+        vehicle of the best solution, or None when no solution within the number of vehicles is found.
+        '''
+        start = time.perf_counter()
+        current = self.initial()
+        if current is None:
+            return None
+        current_cost = self.cost(current)
+        self.best, self.best_cost = [list(route) for route in current], current_cost
+
+        # Annealing starts where a solution 5% worse than the initial one is accepted with probability one half and
+        # cools to one thousandth of that over the time or iteration budget
+        temperature = start_temperature = 0.05 * current_cost / np.log(2)
+        scores = {key: np.zeros(len(weights)) for key, weights in self.weights.items()}
+        uses = {key: np.zeros(len(weights)) for key, weights in self.weights.items()}
+
+        iteration = 0
+        self.status = TIME_LIMIT
+        while True:
+            elapsed = time.perf_counter() - start
+            if self.time_limit is not None and elapsed >= self.time_limit:
+                break
+            if self.iterations is not None and iteration >= self.iterations:
+                self.status = ITERATION_LIMIT
+                break
+            iteration += 1
+
+            destroy = self.rng.choice(len(self.DESTROY), p=self.weights["destroy"] / self.weights["destroy"].sum())
+            repair = self.rng.choice(len(self.REPAIR), p=self.weights["repair"] / self.weights["repair"].sum())
+            routes = [list(route) for route in current]
+            removed = getattr(self, self.DESTROY[destroy])(routes, self.removal_count())
+            routes = [[k for k in route if k not in removed] for route in routes]
+            routes = [route for route in routes if route]
+
+            score = 0
+            if getattr(self, self.REPAIR[repair])(routes, removed):
+                cost = self.cost(routes)
+                if cost < self.best_cost - 1e-9:
+                    self.best, self.best_cost = [list(route) for route in routes], cost
+                    self.history.append((elapsed, cost))
+                    score = self.SCORES[0]
+                elif cost < current_cost - 1e-9:
+                    score = self.SCORES[1]
+                elif self.rng.random() < np.exp(-(cost - current_cost) / max(temperature, 1e-9)):
+                    score = self.SCORES[2]
+                if score:
+                    current, current_cost = routes, cost
+
+            scores["destroy"][destroy] += score
+            scores["repair"][repair] += score
+            uses["destroy"][destroy] += 1
+            uses["repair"][repair] += 1
+
+            # Weights follow the mean score of every operator over the last segment
+            if iteration % self.SEGMENT == 0:
+                for key, weights in self.weights.items():
+                    used = uses[key] > 0
+                    weights[used] = (1 - self.REACTION) * weights[used] + \
+                        self.REACTION * scores[key][used] / uses[key][used]
+                    weights[:] = np.maximum(weights, 1e-3)
+                    scores[key][:] = 0
+                    uses[key][:] = 0
+
+            budget = 0.0 if self.time_limit is None else elapsed / self.time_limit
+            if self.iterations is not None:
+                budget = max(budget, iteration / self.iterations)
+            temperature = start_temperature * 1e-3 ** budget
+
+        self.iteration_count = iteration
+        if len(self.best) > len(self.vehicles):
+            return None
+        return {v: (tuple(route), self.load(route)) for v, route in zip(self.vehicles, self.best)}
+
+    def solution(self):
+        '''
+        Best solution found as a Solution, shaped like CVRP.solution: the vehicle leaves the depot at stage 1,
+        arrives at the t-th customer of its route at stage t and its boxes are loaded for that stage. Returns None
+        when no solution within the number of vehicles is found.
+        '''
+        if self.best is None or len(self.best) > len(self.vehicles):
+            return None
+
+        arcs = []
+        placements = []
+        front = {}
+        for v, route in zip(self.vehicles, self.best):
+            stops = [self.depot] + list(route) + [self.depot]
+            arcs.extend((v, t + 1, stops[t], stops[t + 1]) for t in range(len(stops) - 1))
+
+            stage = {k: t + 1 for t, k in enumerate(route)}
+            for x, y, z, i, k in self.load(route):
+                placements.append((v, stage[k], k, i, x, y, z))
+                front[k, v] = max(front.get((k, v), 0), x + self.boxes[i][0])
+
+        return Solution(self.best_cost, self.status, self.depot, arcs, placements, front)
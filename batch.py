@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from benchmark import run_case, write_results
+
+# Seconds a worker gets beyond the Gurobi time limit to build its model and report before it is killed
+GRACE = 60
+
+def load_instance(path):
+    '''
+    Reads an instance definition from JSON. Links are stored as [i, j, distance] triples and the box and customer
+    keys of boxes and demand as strings, these are converted back to the CVRP arguments. An optional "constraints"
+    entry lists the active constraint numbers.
+    '''
+    with open(path) as file:
+        data = json.load(file)
+
+    instance = {
+        "nodes": data["nodes"],
+        "links": {(i, j): {"distance": distance} for i, j, distance in data["links"]},
+        "vehicles": data["vehicles"],
+        "dimensions": data["dimensions"],
+        "boxes": {int(i): dims for i, dims in data["boxes"].items()},
+        "demand": {int(i): {int(k): amount for k, amount in demand.items()} for i, demand in data["demand"].items()},
+        "maximum_reach": data["maximum_reach"],
+        "p": data["p"],
+        "sigma": data["sigma"]
+    }
+    return instance, data.get("constraints", list(range(1, 20)))
+
+def save_instance(instance, path, constraints=None):
+    '''
+    Writes an instance, a dict of CVRP arguments, in the JSON format read by load_instance
+    '''
+    data = dict(instance)
+    data["links"] = [[i, j, link["distance"]] for (i, j), link in instance["links"].items()]
+    if constraints is not None:
+        data["constraints"] = list(constraints)
+
+    with open(path, "w") as file:
+        json.dump(data, file, indent=2, default=lambda value: value.item())
+
+def _solve(connection, name, instance, active, time_limit, builder, threads):
+    '''
+    Worker process, solves one instance and sends its result back
+    '''
+    connection.send(run_case(name, instance, "batch", active, time_limit, builder, threads))
+    connection.close()
+
+def run_batch(instances, workers=None, time_limit=60, builder="matrix", grace=GRACE):
+    '''
+    Builds and solves every instance in its own process, with at most workers processes at a time. instances is a
+    directory of instance JSON files, a list of such files or a list of (name, instance, constraints) tuples.
+    The cores are split evenly over the workers through the Gurobi Threads parameter. A worker that crashes or runs
+    past the time limit plus grace is recorded as failed without affecting the others. Returns the results in the
+    order of the instances.
+    '''
+    if isinstance(instances, str):
+        instances = sorted(os.path.join(instances, file) for file in os.listdir(instances) if file.endswith(".json"))
+    jobs = []
+    for item in instances:
+        if isinstance(item, str):
+            jobs.append((os.path.splitext(os.path.basename(item))[0],) + load_instance(item))
+        else:
+            jobs.append(tuple(item))
+
+    cores = os.cpu_count() or 1
+    workers = min(workers or cores, max(len(jobs), 1))
+    threads = max(1, cores // workers)
+
+    # Spawned workers start without the Gurobi state of this process
+    context = multiprocessing.get_context("spawn")
+    results = [None] * len(jobs)
+    pending = list(enumerate(jobs))
+    running = {}
+
+    while pending or running:
+        while pending and len(running) < workers:
+            idx, (name, instance, active) = pending.pop(0)
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=_solve, args=(sender, name, instance, list(active), time_limit, builder,
+                                                           threads))
+            process.start()
+            sender.close()
+            running[idx] = (name, process, receiver, time.monotonic() + time_limit + grace)
+
+        ready = wait([receiver for _, _, receiver, _ in running.values()], timeout=1)
+        now = time.monotonic()
+        for idx, (name, process, receiver, deadline) in list(running.items()):
+            if receiver in ready:
+                try:
+                    results[idx] = receiver.recv()
+                except EOFError:
+                    process.join()
+                    results[idx] = {"instance": name, "error": f"worker exited with code {process.exitcode}"}
+            elif now > deadline:
+                process.kill()
+                results[idx] = {"instance": name, "error": "worker timed out"}
+            else:
+                continue
+
+            process.join()
+            receiver.close()
+            del running[idx]
+
+    return results
+
+def summarize(results):
+    '''
+    Number of instances per outcome and the total build and solve time of a batch
+    '''
+    outcomes = {}
+    for result in results:
+        outcome = "error" if "error" in result else str(result["status"])
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    return {"instances": len(results),
+            "outcomes": outcomes,
+            "build_time": sum(result.get("build_time", 0) for result in results),
+            "solve_time": sum(result.get("solve_time", 0) for result in results)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve a directory of CVRP instances in a process pool")
+    parser.add_argument("instances", nargs="+", help="instance JSON files or a directory holding them")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--time-limit", type=float, default=60)
+    parser.add_argument("--builder", choices=["loop", "matrix"], default="matrix")
+    parser.add_argument("--output", default="batch_output.json")
+    args = parser.parse_args()
+
+    instances = args.instances[0] if len(args.instances) == 1 and os.path.isdir(args.instances[0]) else args.instances
+    results = run_batch(instances, args.workers, args.time_limit, args.builder)
+    write_results(results, args.output)
+    print(json.dumps(summarize(results), indent=2))
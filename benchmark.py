@@ -0,0 +1,263 @@
+import argparse
+import itertools
+import json
+import subprocess
+import time
+import numpy as np
+import gurobipy as gp
+from gurobipy import GRB
+from model import CVRP
+from helper import constraintGenerator, make_links
+
+# Constraint sets benchmarked by default, values are passed to constraintGenerator
+CONSTRAINT_SETS = {"routing": [2, 3, 4, 5, 8],
+                   "loading": [2, 3, 4, 5, 8, 9, 10, 11],
+                   "full": range(1, 20)}
+
+def generate_instance(n_nodes, n_vehicles, n_box_types, dimensions, demand_density, max_demand=3, box_size=(2, 6),
+                      density=1, seed=None):
+    '''
+    Generates a random 3L-CVRP instance with node 1 as depot and nodes 2..n_nodes as customers.
+    demand_density is the probability that a customer orders a given box type, every customer orders at least one.
+    Box sizes are drawn from box_size along every axis and capped at the vehicle dimensions.
+    Returns a dict holding the CVRP arguments nodes, links, vehicles, dimensions, boxes, demand, maximum_reach,
+    p and sigma.
+    '''
+    if seed is not None:
+        np.random.seed(seed)
+
+    nodes = list(range(1, n_nodes + 1))
+    links = make_links(nodes)
+
+    boxes = {}
+    for i in range(1, n_box_types + 1):
+        boxes[i] = [int(np.random.randint(box_size[0], min(box_size[1], dimensions[axis]) + 1))
+                    for axis in ("length", "width", "height")]
+
+    # Every customer orders each box type with probability demand_density, and at least one box type
+    ordered = np.random.random_sample((n_box_types, n_nodes - 1)) < demand_density
+    ordered[np.random.randint(n_box_types, size=n_nodes - 1), np.arange(n_nodes - 1)] = True
+    amounts = np.random.randint(1, max_demand + 1, size=ordered.shape) * ordered
+    demand = {i: {k: int(amounts[i-1, k-2]) for k in nodes[1:]} for i in boxes}
+
+    return {
+        "nodes": nodes,
+        "links": links,
+        "vehicles": list(range(n_vehicles)),
+        "dimensions": dict(dimensions),
+        "boxes": boxes,
+        "demand": demand,
+        "maximum_reach": [[boxes[i][0] for k in nodes[1:]] for i in boxes.keys()],
+        "p": [density * boxes[i][0] * boxes[i][1] * boxes[i][2] for i in boxes.keys()],
+        "sigma": [9999999 for i in boxes.keys()]
+    }
+
+def instance_grid(nodes, vehicles, box_types, dimensions, densities, seed=0):
+    '''
+    Parameter sets for generate_instance over the product of the given node counts, vehicle counts, box type counts,
+    vehicle dimensions and demand densities, each with a descriptive name
+    '''
+    grid = []
+    for n, v, b, dims, density in itertools.product(nodes, vehicles, box_types, dimensions, densities):
+        grid.append({"name": f"n{n}_v{v}_b{b}_{dims['length']}x{dims['width']}x{dims['height']}_d{density}",
+                     "n_nodes": n, "n_vehicles": v, "n_box_types": b, "dimensions": dims,
+                     "demand_density": density, "seed": seed})
+    return grid
+
+def compare_builders(instance, constraints, repeats=3):
+    '''
+    Builds the same instance with the loop and the matrix builder and reports the best build time of each.
+    The instance is a dict holding the CVRP arguments nodes, links, vehicles, dimensions, boxes, demand,
+    maximum_reach, p and sigma.
+    '''
+    results = {}
+    for builder in ("loop", "matrix"):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            problem = CVRP(f"{builder}_build", constraints=constraints, builder=builder, **instance)
+            problem.model.update()
+            times.append(time.perf_counter() - start)
+
+        results[builder] = {"build_time": min(times),
+                            "rows": problem.model.NumConstrs,
+                            "columns": problem.model.NumVars,
+                            "nonzeros": problem.model.NumNZs}
+        problem.model.dispose()
+
+    results["speedup"] = results["loop"]["build_time"] / results["matrix"]["build_time"]
+    return results
+
+def _attribute(model, name):
+    '''
+    Model attribute, or None when Gurobi has no value for it
+    '''
+    try:
+        return getattr(model, name)
+    except (gp.GurobiError, AttributeError):
+        return None
+
+def run_case(name, instance, constraint_set, active, time_limit, builder="matrix", threads=0, symmetry=False,
+             big_m="tight"):
+    '''
+    Builds and solves one instance with one constraint set. Failures, such as a model that is too large for the
+    license, are recorded in the result rather than raised.
+    '''
+    result = {"instance": name, "constraint_set": constraint_set, "builder": builder, "symmetry": symmetry,
+              "big_m": big_m, "nodes": len(instance["nodes"]), "vehicles": len(instance["vehicles"]),
+              "box_types": len(instance["boxes"]), "dimensions": instance["dimensions"]}
+    problem = None
+    try:
+        start = time.perf_counter()
+        problem = CVRP(name, constraints=constraintGenerator(active), builder=builder, profile=True, symmetry=symmetry,
+                       big_m=big_m, **instance)
+        result["build_time"] = time.perf_counter() - start
+
+        build = problem.profiler.report()["total"]
+        result.update({"build_peak_memory": build["peak_memory"], "rows": build["rows"],
+                       "columns": build["columns"], "nonzeros": build["nonzeros"]})
+
+        problem.model.setParam("OutputFlag", 0)
+        problem.model.setParam("TimeLimit", time_limit)
+        problem.model.setParam("Threads", threads)
+        start = time.perf_counter()
+        problem.model.optimize()
+        result["solve_time"] = time.perf_counter() - start
+
+        model = problem.model
+        result.update({"status": model.Status, "node_count": model.NodeCount, "solver_memory": model.MaxMemUsed})
+
+        # Objective, bound and gap only exist after an optimal solve or with an incumbent, and even then the bound of
+        # an interrupted solve may be missing, so each is read on its own
+        solved = model.Status == GRB.OPTIMAL or model.SolCount > 0
+        for key, attribute in (("objective", "ObjVal"), ("bound", "ObjBound"), ("mip_gap", "MIPGap")):
+            result[key] = _attribute(model, attribute) if solved else None
+    except gp.GurobiError as error:
+        result["error"] = str(error)
+    finally:
+        if problem is not None:
+            problem.model.dispose()
+    return result
+
+def compare_symmetry(name, instance, constraint_set, active, time_limit, builder="matrix", threads=0):
+    '''
+    Solves one instance with and without the symmetry breaking rows and reports the branch-and-bound node count and
+    solve time of both
+    '''
+    results = {}
+    for symmetry in (False, True):
+        result = run_case(name, instance, constraint_set, active, time_limit, builder, threads, symmetry)
+        results["symmetry" if symmetry else "plain"] = result
+    return results
+
+def compare_big_m(name, instance, constraint_set, active, time_limit, builder="matrix", threads=0):
+    '''
+    Solves one instance with the global and the tightened big-M values of the multidrop constraints and with
+    indicator constraints, and reports the branch-and-bound node count and solve time of every formulation
+    '''
+    return {big_m: run_case(name, instance, constraint_set, active, time_limit, builder, threads, big_m=big_m)
+            for big_m in ("global", "tight", "indicator")}
+
+
+def benchmark_suite(instances, constraint_sets=CONSTRAINT_SETS, time_limit=60, builder="matrix", threads=0):
+    '''
+    Generates every instance from its generate_instance parameters and runs it with every constraint set.
+    Returns one result dict per (instance, constraint set), ordered by instance and then constraint set.
+    '''
+    results = []
+    for params in instances:
+        params = dict(params)
+        name = params.pop("name")
+        instance = generate_instance(**params)
+        for constraint_set, active in constraint_sets.items():
+            results.append(run_case(name, instance, constraint_set, active, time_limit, builder, threads))
+    return results
+
+def write_results(results, path, record_commit=False):
+    '''
+    Writes benchmark results as JSON with sorted keys and one stable ordering, so result files of different commits
+    can be diffed directly. The current commit is only written with record_commit, it changes on every commit
+    '''
+    output = {"results": results}
+    if record_commit:
+        try:
+            output["commit"] = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                              check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            output["commit"] = None
+
+    with open(path, "w") as file:
+        json.dump(output, file, indent=2, sort_keys=True)
+        file.write("\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CVRP model build and solve on generated instances")
+    parser.add_argument("--nodes", type=int, nargs="+", default=[3, 6])
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--box-types", type=int, nargs="+", default=[4])
+    parser.add_argument("--dimensions", type=int, nargs=3, action="append", metavar=("LENGTH", "WIDTH", "HEIGHT"))
+    parser.add_argument("--density", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--sets", nargs="+", choices=list(CONSTRAINT_SETS), default=list(CONSTRAINT_SETS))
+    parser.add_argument("--time-limit", type=float, default=60)
+    parser.add_argument("--builder", choices=["loop", "matrix"], default="matrix")
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--record-commit", action="store_true", help="write the current git commit into the output")
+    parser.add_argument("--compare-builders", action="store_true",
+                        help="only compare the build time of the loop and matrix builders")
+    parser.add_argument("--compare-symmetry", action="store_true",
+                        help="only compare the node counts with and without symmetry breaking")
+    parser.add_argument("--compare-big-m", action="store_true",
+                        help="only compare the node counts of the big-M and indicator multidrop formulations")
+    args = parser.parse_args()
+
+    dimensions = [dict(zip(("length", "width", "height"), dims)) for dims in args.dimensions or [(12, 8, 8)]]
+    grid = instance_grid(args.nodes, args.vehicles, args.box_types, dimensions, args.density, seed=args.seed)
+
+    if args.compare_builders:
+        for params in grid:
+            params = dict(params)
+            name = params.pop("name")
+            results = compare_builders(generate_instance(**params), constraintGenerator(range(1, 20)))
+            print(f"{name}: loop {results['loop']['build_time']:.3f}s | matrix {results['matrix']['build_time']:.3f}s | "
+                  f"rows {results['matrix']['rows']} | nonzeros {results['matrix']['nonzeros']} | "
+                  f"speedup {results['speedup']:.1f}x")
+    elif args.compare_symmetry:
+        results = []
+        for params in grid:
+            params = dict(params)
+            name = params.pop("name")
+            instance = generate_instance(**params)
+            for constraint_set in args.sets:
+                comparison = compare_symmetry(name, instance, constraint_set, CONSTRAINT_SETS[constraint_set],
+                                              args.time_limit, args.builder, args.threads)
+                results.extend(comparison.values())
+                plain, symmetry = comparison["plain"], comparison["symmetry"]
+                print(f"{name:<28} {constraint_set:<8} nodes {plain.get('node_count')} -> {symmetry.get('node_count')} | "
+                      f"solve {plain.get('solve_time', float('nan')):.3f}s -> {symmetry.get('solve_time', float('nan')):.3f}s "
+                      f"{plain.get('error', '')}{symmetry.get('error', '')}")
+        write_results(results, args.output, args.record_commit)
+    elif args.compare_big_m:
+        results = []
+        for params in grid:
+            params = dict(params)
+            name = params.pop("name")
+            instance = generate_instance(**params)
+            for constraint_set in args.sets:
+                comparison = compare_big_m(name, instance, constraint_set, CONSTRAINT_SETS[constraint_set],
+                                           args.time_limit, args.builder, args.threads)
+                results.extend(comparison.values())
+                print(f"{name:<28} {constraint_set:<8} " + " | ".join(
+                    f"{big_m} nodes {result.get('node_count')} solve {result.get('solve_time', float('nan')):.3f}s "
+                    f"{result.get('error', '')}" for big_m, result in comparison.items()))
+        write_results(results, args.output, args.record_commit)
+    else:
+        sets = {key: CONSTRAINT_SETS[key] for key in args.sets}
+        results = benchmark_suite(grid, sets, args.time_limit, args.builder, args.threads)
+        write_results(results, args.output, args.record_commit)
+        for result in results:
+            print(f"{result['instance']:<28} {result['constraint_set']:<8} build {result.get('build_time', float('nan')):.3f}s "
+                  f"solve {result.get('solve_time', float('nan')):.3f}s gap {result.get('mip_gap')} "
+                  f"{result.get('error', '')}")
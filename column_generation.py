@@ -0,0 +1,184 @@
+import numpy as np
+import gurobipy as gp
+from gurobipy import GRB
+from helper import distance_matrix
+from heuristic import route_cost, route_volume, savings_routes
+from decomposition import RouteChecker
+
+class ColumnGeneration(RouteChecker):
+    '''
+    Route-based set-partitioning formulation of the 3L-CVRP solved by column generation. The master selects routes so
+    every customer is served exactly once by at most len(vehicles) vehicles, its columns are single vehicle routes
+    whose loading is checked by RouteChecker before they enter. New routes are priced by an elementary shortest path
+    labelling over the links with the vehicle volume as resource (constraint 8). Once pricing finds no improving
+    loadable route the master is solved as a MIP over the generated columns (price-and-branch), so the result is a
+    heuristic solution.
+
+    lp_value is the LP value of the last restricted master and no lower bound on the optimum: the pricing keeps the
+    cheapest label per last customer and visited set whether or not its route can be loaded, and generation stops
+    when no priced route can be loaded, so loadable routes with a negative reduced cost may be left out. With labels
+    the pricing keeps at most that many labels per customer, which keeps it fast on larger instances but misses
+    more routes.
+    '''
+    def __init__(self, name, nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma,
+                 packing=range(1, 20), exact=True, cache=None, columns=20, labels=50, max_iterations=200):
+        super().__init__(nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma, packing, exact,
+                         cache)
+        self.distance = distance_matrix(nodes, links)
+
+        # Resources of every customer in the pricing with their limits: the volume of its boxes (constraint 8) and,
+        # when routes are only checked by the packer, the length of the slab the packer loads its boxes in, as the
+        # packer gives every customer of a route its own slab along the vehicle length
+        self.usage = np.zeros((len(nodes), 2))
+        self.usage[1:, 0] = [route_volume([k], demand, boxes) for k in nodes[1:]]
+        if not exact:
+            self.usage[1:, 1] = [self.packer.slab(k, demand) for k in nodes[1:]]
+        self.limits = np.array([dimensions["length"] * dimensions["width"] * dimensions["height"],
+                                dimensions["length"]])
+
+        # Negative reduced cost routes added per pricing round, labels kept per customer by the pricing, None for an
+        # exact pricing, and the maximum number of rounds
+        self.columns = columns
+        self.labels = labels
+        self.max_iterations = max_iterations
+
+        # Generated routes with their placements, routes that cannot be loaded and the LP value of the last master
+        self.routes = {}
+        self.infeasible = set()
+        self.lp_value = None
+        self.iterations = 0
+
+        self.model = gp.Model(name)
+        self.model.setParam("OutputFlag", 0)
+        self.cover = self.model.addConstrs((gp.LinExpr() == 1 for k in nodes[1:]), name="Cover")
+        self.fleet = self.model.addConstr(gp.LinExpr() <= len(vehicles), name="Fleet")
+
+        # Artificial columns keep the master feasible before enough routes are known, priced above any real route
+        links = self.distance[~np.eye(len(nodes), dtype=bool)]
+        penalty = 2 * len(nodes) * links[np.isfinite(links)].max()
+        self.artificial = self.model.addVars(nodes[1:], obj=penalty, name="artificial")
+        for k in nodes[1:]:
+            self.model.chgCoeff(self.cover[k], self.artificial[k], 1.0)
+        self.lam = {}
+
+    def add_route(self, route):
+        '''
+        Adds a route as master column if it can be loaded. Returns whether it was added.
+        '''
+        route = tuple(route)
+        if route in self.routes or route in self.infeasible:
+            return False
+
+        placements = self.feasible(route)
+        if placements is None:
+            self.infeasible.add(route)
+            return False
+
+        self.routes[route] = placements
+        column = gp.Column([1.0] * (len(route) + 1), [self.cover[k] for k in route] + [self.fleet])
+        self.lam[route] = self.model.addVar(obj=route_cost(route, self.links, self.depot), column=column,
+                                            name=f"lambda[{','.join(map(str, route))}]")
+        return True
+
+    def price(self, duals, fleet_dual, limit=None, tolerance=1e-6):
+        '''
+        Elementary shortest path labelling from and back to the depot with the arc costs reduced by the cover duals and
+        the resources of usage. Labels are extended one customer at a time for all labels at once, of the
+        labels with the same last customer and the same visited customers only the cheapest is kept, which are the
+        states of an exact dynamic program. With a limit only that many labels of lowest cost are kept per last
+        customer, a heuristic pricing that may miss routes. Returns every route with a negative reduced cost, most
+        negative first, leaving out routes already known.
+        '''
+        n = len(self.nodes)
+        reduced = self.distance - np.concatenate([[0.0], duals])[None, :]
+        reduced[:, 0] -= fleet_dual
+        reachable = np.isfinite(reduced)
+        reachable[:, 0] = False
+
+        # Labels of the current level as arrays: last customer, reduced cost, resources used, visited customers and
+        # the index of the label it extends
+        last = np.zeros(1, dtype=np.int64)
+        cost = np.zeros(1)
+        used = np.zeros((1, len(self.limits)))
+        visited = np.zeros((1, n), dtype=bool)
+        parents = []
+        found = []
+
+        while len(last):
+            extend = reachable[last] & ~visited & (used[:, None] + self.usage[None] <= self.limits).all(axis=2)
+            rows, customers = np.nonzero(extend)
+            if not len(rows):
+                break
+            cost = cost[rows] + reduced[last[rows], customers]
+            used = used[rows] + self.usage[customers]
+            visited = visited[rows]
+            visited[np.arange(len(rows)), customers] = True
+            last = customers
+
+            # Cheapest label per last customer and visited set, then at most limit labels per last customer
+            order = np.lexsort((cost, last))
+            keys = np.concatenate([last[order, None], np.packbits(visited[order], axis=1)], axis=1)
+            _, first = np.unique(keys, axis=0, return_index=True)
+            keep = order[np.sort(first)]
+            if limit is not None:
+                rank = np.arange(len(keep)) - np.searchsorted(last[keep], last[keep])
+                keep = keep[rank < limit]
+            last, cost, used, visited, rows = last[keep], cost[keep], used[keep], visited[keep], rows[keep]
+            parents.append((rows, last))
+
+            closing = cost + reduced[last, 0]
+            for idx in np.flatnonzero(closing < -tolerance):
+                found.append((closing[idx], len(parents) - 1, idx))
+
+        routes = []
+        for value, level, idx in sorted(found):
+            route = []
+            for parent, customers in reversed(parents[:level + 1]):
+                route.append(self.nodes[customers[idx]])
+                idx = parent[idx]
+            route = tuple(reversed(route))
+            if route not in self.infeasible and route not in self.routes:
+                routes.append(route)
+        return routes
+
+    def generate(self):
+        '''
+        Column generation on the LP relaxation of the master, starting from single customer routes and the savings
+        heuristic. Returns the LP value of the last master.
+        '''
+        for k in self.nodes[1:]:
+            self.add_route((k,))
+        savings = savings_routes(self.nodes, self.links, len(self.vehicles), self.demand, self.boxes,
+                                 self.dimensions, self.packer)
+        for route, _ in savings or []:
+            self.add_route(route)
+
+        # Route columns are continuous while generating. Priced routes are checked most negative first until columns
+        # of them could be loaded, generation stops when no priced route can be loaded
+        for self.iterations in range(1, self.max_iterations + 1):
+            self.model.optimize()
+            self.lp_value = self.model.ObjVal
+
+            duals = np.array(self.model.getAttr(GRB.Attr.Pi, [self.cover[k] for k in self.nodes[1:]]))
+            added = 0
+            for route in self.price(duals, self.fleet.Pi, self.labels):
+                added += self.add_route(route)
+                if added == self.columns:
+                    break
+            if added == 0:
+                break
+        return self.lp_value
+
+    def optimize(self):
+        '''
+        Generates the columns and solves the master as a MIP over them. Returns the route and placements of every
+        used vehicle, or None when the generated routes cannot serve every customer.
+        '''
+        self.generate()
+        self.model.setAttr(GRB.Attr.VType, list(self.lam.values()), [GRB.BINARY] * len(self.lam))
+        self.model.optimize()
+        if self.model.SolCount == 0 or any(var.X > 0.5 for var in self.artificial.values()):
+            return None
+
+        chosen = [route for route, var in self.lam.items() if var.X > 0.5]
+        return {v: (route, self.routes[route]) for v, route in zip(self.vehicles, chosen)}
@@ -0,0 +1,191 @@
+import gurobipy as gp
+from gurobipy import GRB
+from model import CVRP
+from helper import constraintGenerator, grid_positions, stage_horizon
+from packing import ExtremePointPacker
+from packing_cache import PackingCache
+
+# Constraints of the routing master, every other constraint is checked per route by the packing subproblem
+ROUTING = [2, 3, 4, 5, 8]
+
+class RoutingMaster(CVRP):
+    '''
+    CVRP holding only the routing variables and the routing constraints, without any loading variables
+    '''
+    def decision_variables(self):
+        '''
+        Creates the routing variables only, the loading index is emptied so neither builder adds loading columns.
+        Without the loading constraints a vehicle could leave the depot several times at later stages, so departures
+        are restricted to stage 1 and every vehicle drives a single route.
+        '''
+        self.loading_index = []
+        self.box_customers = {i: [] for i in self.boxID}
+        super().decision_variables()
+
+        for l in self.successors[self.depot]:
+            for v in self.vehicles:
+                for t in self.stages[1:]:
+                    self.d[self.depot, l, v, t].UB = 0.0
+
+
+class RouteChecker():
+    '''
+    Loading check of single vehicle routes. A route is first loaded with the extreme-point packer and, when that fails
+    and exact is set, with a single vehicle CVRP of the route holding the packing constraints. Verdicts are kept in a
+    PackingCache, pass a persistent one to share them between runs.
+    '''
+    def __init__(self, nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma,
+                 packing=range(1, 20), exact=True, cache=None):
+        self.nodes = nodes
+        self.depot = nodes[0]
+        self.links = links
+        self.vehicles = vehicles
+        self.dimensions = dimensions
+        self.boxes = boxes
+        self.demand = demand
+        self.maximum_reach = maximum_reach
+        self.p = p
+        self.sigma = sigma
+
+        # Constraints of the exact packing subproblem, passed to constraintGenerator
+        self.packing = packing
+        self.exact = exact
+
+        # Verdicts are only shared between checkers with the same packing constraints and exact flag
+        self.rules = (tuple(sorted(packing)), exact)
+
+        self.packer = ExtremePointPacker(boxes, dimensions, grid_positions(dimensions, boxes, demand), p, sigma)
+
+        # Packing verdict of every checked route, the placements of a feasible route or None
+        self.cache = cache if cache is not None else PackingCache()
+
+    def subproblem(self, customers, ordered=True):
+        '''
+        Single vehicle CVRP of the given customers, renumbered 2..m+1 with the depot as 1. With ordered the vehicle
+        has to visit them in the given order. Stages are only trimmed when the ordered route fits the stage horizon,
+        otherwise the stages of its later stops would not exist.
+        '''
+        nodes = [1] + [s + 2 for s in range(len(customers))]
+        original = dict(zip(nodes, (self.depot,) + tuple(customers)))
+        links = {(k, l): self.links[original[k], original[l]] for k in nodes for l in nodes}
+        demand = {i: {k: self.demand[i][original[k]] for k in nodes[1:]} for i in self.boxes}
+        maximum_reach = [[self.maximum_reach[i-1][original[k] - 2] for k in nodes[1:]] for i in self.boxes]
+
+        trim_stages = not ordered or len(customers) <= stage_horizon(nodes, self.dimensions, self.boxes, demand)
+        problem = CVRP(f"packing_{'_'.join(map(str, customers))}", nodes, links, [self.vehicles[0]], self.dimensions,
+                       self.boxes, demand, maximum_reach, self.p, self.sigma, constraintGenerator(self.packing),
+                       trim_stages=trim_stages)
+        problem.model.setParam("OutputFlag", 0)
+
+        if ordered:
+            stops = nodes + [1]
+            for t in range(len(stops) - 1):
+                problem.d[stops[t], stops[t+1], self.vehicles[0], t+1].LB = 1.0
+        return problem
+
+    def feasible(self, route):
+        '''
+        Checks whether the boxes of a route can be loaded for the given visiting order. Returns the placements as
+        (x, y, z, i, k) tuples, or None when the route cannot be loaded
+        '''
+        instance = (self.demand, self.boxes, self.dimensions, self.maximum_reach, self.p, self.sigma)
+        found, placements = self.cache.get(route, *instance, rules=self.rules)
+        if found:
+            return placements
+
+        # A vehicle cannot serve more customers than the stage horizon of the route allows, no loading exists then
+        fits = len(route) <= stage_horizon((self.depot,) + tuple(route), self.dimensions, self.boxes, self.demand)
+        placements = self.packer.pack(list(route), self.demand) if fits else None
+        if placements is None and self.exact and fits:
+            problem = self.subproblem(route)
+            problem.optimize()
+            if problem.model.SolCount > 0:
+                placements = [(x, y, z, i, route[k-2])
+                              for _, _, k, i, x, y, z in problem.solution().placements.tolist()]
+            problem.model.dispose()
+
+        # Only proven verdicts are shared, a heuristic failure without the exact check is no proof
+        if placements is not None or self.exact:
+            self.cache.put(route, *instance, placements, rules=self.rules)
+        return placements
+
+
+class Decomposition(RouteChecker):
+    '''
+    Routing/packing decomposition of the 3L-CVRP. A routing master with constraints 2-5 and 8 is solved by Gurobi and
+    every route of an incumbent is checked for a feasible loading by RouteChecker. Infeasible routes are cut off in a
+    callback: a set cut when the customers of the route cannot share a vehicle in any order, a no-good cut on the
+    ordered route otherwise.
+    '''
+    def __init__(self, name, nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma,
+                 packing=range(1, 20), builder="loop", exact=True, cache=None):
+        super().__init__(nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma, packing, exact,
+                         cache)
+        self.master = RoutingMaster(name, nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma,
+                                    constraintGenerator(ROUTING), builder=builder)
+        self.cuts = {"route": 0, "set": 0}
+
+    def routes(self, values):
+        '''
+        Customer sequence of every used vehicle in a solution of the routing variables, given as a dict keyed like d
+        '''
+        arcs = {(k, v, t): l for (k, l, v, t), value in values.items() if value > 0.5}
+        routes = {}
+        for v in self.vehicles:
+            route = []
+            k, t = self.depot, 1
+            while (k, v, t) in arcs and arcs[k, v, t] != self.depot:
+                k, t = arcs[k, v, t], t + 1
+                route.append(k)
+            if route:
+                routes[v] = tuple(route)
+        return routes
+
+    def separate(self, model, where):
+        '''
+        Gurobi callback cutting off every incumbent route that cannot be loaded
+        '''
+        if where != GRB.Callback.MIPSOL:
+            return
+
+        d = self.master.d
+        values = dict(zip(d.keys(), model.cbGetSolution(list(d.values()))))
+        for route in self.routes(values).values():
+            if self.feasible(route) is not None:
+                continue
+
+            # Customers that cannot share a vehicle in any order are cut off as a set on every vehicle
+            if self.exact and len(route) > 1:
+                problem = self.subproblem(route, ordered=False)
+                problem.optimize()
+                shared = problem.model.SolCount > 0
+                problem.model.dispose()
+                if not shared:
+                    for v in self.vehicles:
+                        model.cbLazy(gp.quicksum(d[k, l, v, t]
+                                                 for k in route
+                                                 for l in self.master.successors[k]
+                                                 for t in self.master.stages)
+                                     <= len(route) - 1)
+                    self.cuts["set"] += 1
+                    continue
+
+            # No-good cut on the arcs of the ordered route, on any vehicle
+            stops = (self.depot,) + route + (self.depot,)
+            for v in self.vehicles:
+                model.cbLazy(gp.quicksum(d[stops[t], stops[t+1], v, t+1] for t in range(len(stops) - 1))
+                             <= len(stops) - 2)
+            self.cuts["route"] += 1
+
+    def optimize(self):
+        '''
+        Solves the routing master with the packing check in a callback. Returns the route and placements of every
+        used vehicle, or None when no feasible solution is found.
+        '''
+        self.master.model.setParam("LazyConstraints", 1)
+        self.master.model.optimize(self.separate)
+        if self.master.model.SolCount == 0:
+            return None
+
+        values = dict(zip(self.master.d.keys(), self.master.model.getAttr("X", list(self.master.d.values()))))
+        return {v: (route, self.feasible(route)) for v, route in self.routes(values).items()}
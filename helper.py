@@ -1,11 +1,17 @@
+from functools import lru_cache
 import matplotlib.pyplot as plt
 import numpy as np
+import scipy as sp
+import scipy.optimize
+import scipy.sparse
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 
-def constraintGenerator(active) -> dict:
+def constraintGenerator(active, lazy=()) -> dict:
     '''
     Determines constraints that will be active in the model, input can be either a list or a range of active constraints
     Keep in mind that the inserted range should go up to constraint n + 1 rather than n.
+    Constraints ten and thirteen can be listed in lazy, they are then left out of the model and separated in a callback
+    by CVRP.optimize.
     '''
     # Dictionary of all constraints, constraint one, six and eleven are dummy constraints that are always active
     # and used for incremental counting
@@ -49,6 +55,15 @@ def constraintGenerator(active) -> dict:
     else:
         raise TypeError("Invalid Type Provided to constraintGenerator. Provide a range or list")
 
+    # Lazy Activation (List values should be the constraint numbers)
+    enum = 1
+    for key, value in constraints.items():
+        if enum in lazy:
+            if key not in ("constraintTen", "constraintThirteen"):
+                raise ValueError(f"Constraint {enum} cannot be lazy. Only constraints 10 and 13 are separated lazily")
+            constraints[key] = "lazy"
+        enum += 1
+
     return constraints
 
 def plot_boxes_3d(used_boxes, boxes, dimensions):
@@ -118,17 +133,290 @@ def make_links(nodes):
     return links
 
 
+def distance_matrix(nodes, links):
+    '''
+    Distances between the nodes as a matrix indexed by position in nodes, pairs without a link are infinite. links is
+    a dict as made by make_links or already such a matrix.
+    '''
+    if isinstance(links, np.ndarray):
+        return links.astype(float)
+
+    position = {node: idx for idx, node in enumerate(nodes)}
+    distance = np.full((len(nodes), len(nodes)), np.inf)
+    for (i, j), link in links.items():
+        distance[position[i], position[j]] = link["distance"]
+    return distance
+
+def prune_arcs(distance, neighbours=None, upper_bound=None):
+    '''
+    Arcs kept for the routing variables as a boolean matrix, with the depot as first node. Self-loops and missing
+    links are always dropped. With neighbours a customer only keeps the arcs to and from its nearest customers, arcs
+    from and to the depot are all kept, so the optimum can be lost. With an upper_bound on the objective every arc is
+    dropped whose reduced cost in the assignment relaxation lifts the relaxation above the bound, no solution within
+    the bound uses such an arc. The assignment relaxation holds whenever constraints two, three and five are active.
+    '''
+    keep = ~np.eye(len(distance), dtype=bool) & np.isfinite(distance)
+
+    if neighbours is not None:
+        customers = np.where(keep[1:, 1:], distance[1:, 1:], np.inf)
+        nearest = np.argsort(customers, axis=1)[:, :neighbours]
+        near = np.zeros(customers.shape, dtype=bool)
+        np.put_along_axis(near, nearest, True, axis=1)
+        keep[1:, 1:] &= near | near.T
+
+    if upper_bound is not None and len(distance) > 1:
+        keep &= assignment_bound(distance, keep) <= upper_bound + 1e-6
+
+    return keep
+
+def assignment_bound(distance, keep):
+    '''
+    Lower bound on the cost of any solution using each arc, from the LP relaxation of the assignment problem: every
+    customer has one incoming and one outgoing arc and the depot, the first node, is left as often as it is entered
+    and at least once. The bound of an arc is the relaxation optimum plus the reduced cost of the arc.
+    '''
+    n = len(distance)
+    tails, heads = np.nonzero(keep)
+    arcs = np.arange(len(tails))
+
+    # Rows 0..n-1 count outgoing arcs, rows n..2n-1 incoming arcs, of which the customer rows are equalities
+    degree = sp.sparse.csr_matrix((np.ones(2 * len(arcs)), (np.concatenate([tails, n + heads]), np.tile(arcs, 2))),
+                                  shape=(2 * n, len(arcs)))
+    customers = np.r_[1:n, n + 1:2 * n]
+    balance = degree[0] - degree[n]
+    result = sp.optimize.linprog(distance[tails, heads],
+                                 A_ub=-degree[0], b_ub=[-1],
+                                 A_eq=sp.sparse.vstack([degree[customers], balance]),
+                                 b_eq=np.r_[np.ones(len(customers)), 0],
+                                 bounds=(0, 1), method="highs")
+
+    bound = np.full(distance.shape, np.inf)
+    if result.status == 0:
+        bound[tails, heads] = result.fun + np.maximum(result.lower.marginals, 0)
+    return bound
+
 def reachable_positions(sizes, counts, max_pos):
-    positions = {0}
+    '''
+    Positions along one axis reachable by stacking boxes, every sum of count_i copies at most of size_i up to max_pos.
+    Results are memoised per (sizes, counts, max_pos) as the same box catalogue is used for every instance.
+    '''
+    return set(_reachable_positions(tuple(sizes), tuple(counts), max_pos))
+
+
+@lru_cache(maxsize=1024)
+def _reachable_positions(sizes, counts, max_pos):
+    '''
+    Bounded subset sum over an integer bitset, bit v is set if position v is reachable
+    '''
+    if max_pos < 0:
+        return frozenset({0})
+
+    mask = (1 << (max_pos + 1)) - 1
+    bits = 1
     for size, count in zip(sizes, counts):
-        new_positions = set()
-        for p in positions:
-            for k in range(1, count + 1):
-                v = p + k * size
-                if v <= max_pos:
-                    new_positions.add(v)
-        positions |= new_positions
-    return positions
+        if size <= 0:
+            continue
+
+        # Split the count in powers of two so every multiple 0..count of size is added in log(count) shifts
+        count = min(count, max_pos // size)
+        piece = 1
+        while count > 0:
+            piece = min(piece, count)
+            bits |= (bits << (piece * size)) & mask
+            count -= piece
+            piece *= 2
+
+    flags = np.unpackbits(np.frombuffer(bits.to_bytes((max_pos + 8) // 8, "little"), dtype=np.uint8), bitorder="little")
+    return frozenset(np.flatnonzero(flags).tolist())
+
+
+def grid_positions(dimensions, boxes, demand):
+    '''
+    Sorted grid positions (xpos, ypos, zpos) of a vehicle, every position along an axis reachable by stacking the
+    demanded boxes that still leaves room for the smallest box
+    '''
+    counts = [sum(demand[i].values()) for i in boxes]
+    positions = []
+    for axis, key in enumerate(("length", "width", "height")):
+        sizes = [dims[axis] for dims in boxes.values()]
+        positions.append(sorted(reachable_positions(sizes, counts, dimensions[key] - min(sizes))))
+    return tuple(positions)
+
+def grid_scale(dimensions, boxes, resolution=None):
+    '''
+    Grid unit along every axis. Without resolution it is the greatest common divisor of the vehicle dimension and
+    the box sizes along that axis, so the instance can be solved in multiples of it without changing it. A
+    resolution, one value or one per axis, is used as unit instead.
+    '''
+    if resolution is not None:
+        return np.broadcast_to(np.asarray(resolution, dtype=np.int64), (3,)).copy()
+    return np.array([np.gcd.reduce([dimensions[key]] + [dims[axis] for dims in boxes.values()])
+                     for axis, key in enumerate(("length", "width", "height"))], dtype=np.int64)
+
+def scale_instance(dimensions, boxes, maximum_reach, p, sigma, scale):
+    '''
+    Vehicle dimensions, box sizes, maximum reach, box weights and load-bearing strengths of an instance measured in
+    grid units of scale. Box sizes are rounded up and the vehicle dimensions and reach down, so every loading of the
+    scaled instance maps back to a loading of the original one. With the units of grid_scale the vehicle and the boxes
+    are not rounded, but the maximum reach is not part of grid_scale and is still floored to the grid unit.
+    Weights are scaled with the footprint of the boxes, so pressures and load-bearing strengths keep their units.
+    '''
+    sx, sy, sz = (int(unit) for unit in scale)
+    scaled_dimensions = {key: dimensions[key] // unit for key, unit in zip(("length", "width", "height"), (sx, sy, sz))}
+    scaled_boxes = {i: [-(-L // sx), -(-W // sy), -(-H // sz)] for i, (L, W, H) in boxes.items()}
+    scaled_reach = [[reach // sx for reach in row] for row in maximum_reach]
+
+    # Pressure p_i / (L_i W_i) of constraint eighteen is the same on the scaled footprint
+    scaled_p = [p[idx] * (scaled_boxes[i][0] * scaled_boxes[i][1]) / (boxes[i][0] * boxes[i][1])
+                for idx, i in enumerate(boxes)]
+    return scaled_dimensions, scaled_boxes, scaled_reach, scaled_p, list(sigma)
+
+def multidrop_big_m(length, reach, x):
+    '''
+    Big-M values (M1, M2) of the row of constraint fifteen for a box at x with the given maximum reach, broadcast
+    over arrays. Fronts L'_{lv} above the vehicle length are never needed, so without the box at x the row only has to
+    be relaxed by length - reach, and without the arc from k to l by length - reach - x.
+    '''
+    m1 = np.maximum(length - np.asarray(reach, dtype=float), 0.0)
+    return m1, np.maximum(m1 - np.asarray(x, dtype=float), 0.0)
+
+def stage_horizon(nodes, dimensions, boxes, demand):
+    '''
+    Upper bound on the number of customers a single vehicle can serve. The customers with the smallest demand have to
+    fit in the vehicle volume (constraint 8), and their boxes have to fit in the count bound of the vehicle: every box
+    is at least as large as the smallest dimension of the demanded box types along every axis, so no more than
+    floor(L / min_L) * floor(W / min_W) * floor(H / min_H) boxes fit.
+    '''
+    customers = nodes[1:]
+    volumes = sorted(sum(np.prod(boxes[i]) * demand[i].get(k, 0) for i in boxes) for k in customers)
+    counts = sorted(sum(demand[i].get(k, 0) for i in boxes) for k in customers)
+
+    # Only box types with demand can be loaded
+    size = (dimensions["length"], dimensions["width"], dimensions["height"])
+    loaded = [boxes[i] for i in boxes if sum(demand[i].get(k, 0) for k in customers) > 0] or list(boxes.values())
+    smallest = [min(dims[axis] for dims in loaded) for axis in range(3)]
+    capacity = np.prod(size)
+    max_boxes = np.prod([size[axis] // smallest[axis] for axis in range(3)])
+
+    by_volume = int(np.searchsorted(np.cumsum(volumes), capacity, side="right"))
+    by_count = int(np.searchsorted(np.cumsum(counts), max_boxes, side="right"))
+    return max(1, min(by_volume, by_count, len(customers)))
+
+def interval_product(lo, hi):
+    '''
+    Expands per-row index intervals [lo, hi) along every axis into all index combinations they span.
+    lo and hi have shape (rows, axes), returns the row of every combination and its index along every axis.
+    '''
+    lengths = np.maximum(hi - lo, 0)
+    counts = lengths.prod(axis=1)
+    rows = np.repeat(np.arange(len(lo)), counts)
+
+    # Position of every combination within its own row, unravelled over the interval lengths of that row
+    local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    index = np.empty((len(rows), lo.shape[1]), dtype=np.int64)
+    for axis in reversed(range(lo.shape[1])):
+        length = lengths[rows, axis]
+        index[:, axis] = lo[rows, axis] + local % length
+        local //= length
+    return rows, index
+
+
+def coverage_index(xpos, ypos, zpos, placement_list, boxes, above=False):
+    '''
+    Sparse (cell, placement) matrix of the grid cells (x', y', z') in row-major order and the placements (x, y, z, i)
+    covering them, a placement covers x <= x' <= x + L_i - 1 along every axis. With above=True a placement is instead
+    linked to every cell below it in the column of cells it covers, as used by the load-bearing constraint.
+    '''
+    grid = [np.asarray(xpos), np.asarray(ypos), np.asarray(zpos)]
+    placements = np.asarray(placement_list, dtype=np.int64).reshape(-1, 4)
+    sizes = np.array([boxes[i] for i in placements[:, 3]], dtype=np.int64).reshape(-1, 3)
+
+    # Interval sweep along every axis, the cells covered by a placement form a contiguous range of grid positions
+    lo = np.column_stack([np.searchsorted(grid[axis], placements[:, axis], "left") for axis in range(3)])
+    hi = np.column_stack([np.searchsorted(grid[axis], placements[:, axis] + sizes[:, axis] - 1, "right")
+                          for axis in range(3)])
+    if above:
+        hi[:, 2] = lo[:, 2]
+        lo[:, 2] = 0
+
+    placement, cell = interval_product(lo, hi)
+    shape = tuple(len(positions) for positions in grid)
+    return sp.sparse.csr_matrix((np.ones(len(placement), dtype=np.int8), (np.ravel_multi_index(cell.T, shape), placement)),
+                                shape=(int(np.prod(shape)), len(placements)))
+
+
+def support_index(placement_list, boxes, xpos_lst, ypos_lst, zpos_lst):
+    '''
+    Sparse (placement, placement) matrix linking every placement (x, y, z, i) above the vehicle floor to the placements
+    (x'', y'', z - H_j, j) that can support its bottom face, the faces overlap for x - L_j < x'' < x + L_i and likewise
+    for y.
+    Placements of box j are the row-major product of xpos_lst[j-1], ypos_lst[j-1] and zpos_lst[j-1].
+    '''
+    placements = np.asarray(placement_list, dtype=np.int64).reshape(-1, 4)
+    above = np.nonzero(placements[:, 2] > 0)[0]
+    x, y, z, i = placements[above].T
+    L_i = np.array([boxes[box][0] for box in i], dtype=np.int64)
+    W_i = np.array([boxes[box][1] for box in i], dtype=np.int64)
+
+    rows, cols = [], []
+    offset = 0
+    for j, dims in boxes.items():
+        L, W, H = dims
+        grid = [np.asarray(xpos_lst[j-1]), np.asarray(ypos_lst[j-1]), np.asarray(zpos_lst[j-1])]
+
+        # Box j has to end exactly at height z, and can be shifted along x and y as long as the faces touch
+        z_pp = np.searchsorted(grid[2], z - H)
+        valid = (z - H >= 0) & (z_pp < len(grid[2]))
+        valid[valid] &= grid[2][z_pp[valid]] == (z - H)[valid]
+
+        lo = np.column_stack([np.searchsorted(grid[0], x[valid] - L + 1, "left"),
+                              np.searchsorted(grid[1], y[valid] - W + 1, "left"),
+                              z_pp[valid]])
+        hi = np.column_stack([np.searchsorted(grid[0], x[valid] + L_i[valid] - 1, "right"),
+                              np.searchsorted(grid[1], y[valid] + W_i[valid] - 1, "right"),
+                              z_pp[valid] + 1])
+        row, index = interval_product(lo, hi)
+        rows.append(above[valid][row])
+        cols.append(offset + np.ravel_multi_index(index.T, tuple(len(positions) for positions in grid)))
+        offset += int(np.prod([len(positions) for positions in grid]))
+
+    rows = np.concatenate(rows)
+    return sp.sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, np.concatenate(cols))),
+                                shape=(len(placements), len(placements)))
+
+
+def overlap_areas(boxes):
+    '''
+    Overlap area of the bottom face of box i with the top face of box j for every pair of box types and offset
+    (x'' - x, y'' - y) of box j, the area of constraint thirteen computed once for all positions. Returns the tensor
+    indexed [i, j, x'' - x + shift[0], y'' - y + shift[1]] with box ids as index and shift, offsets at which the
+    faces do not overlap have area zero.
+    '''
+    ids = np.array(list(boxes), dtype=np.int64)
+    sizes = np.zeros((ids.max() + 1, 3), dtype=np.int64)
+    sizes[ids] = [boxes[i] for i in ids]
+    shift = sizes[:, :2].max(axis=0)
+
+    # Overlap of [0, L_i) with [d, d + L_j) along x and y for every offset d between -shift and shift
+    lengths = []
+    for axis in range(2):
+        d = np.arange(-shift[axis], shift[axis] + 1)
+        size_i, size_j = sizes[:, None, None, axis], sizes[None, :, None, axis]
+        lengths.append(np.maximum(np.minimum(size_i, d + size_j) - np.maximum(d, 0), 0))
+    return (lengths[0][:, :, :, None] * lengths[1][:, :, None, :]).astype(float), shift
+
+
+def support_areas(support, placement_list, boxes, overlap=None):
+    '''
+    Support index weighted with the overlap area of every (supported, supporting) placement pair, looked up in the
+    tensor of overlap_areas
+    '''
+    area, shift = overlap_areas(boxes) if overlap is None else overlap
+    placements = np.asarray(placement_list, dtype=np.int64).reshape(-1, 4)
+    pairs = support.tocoo()
+    offset = placements[pairs.col, :2] - placements[pairs.row, :2] + shift
+    values = area[placements[pairs.row, 3], placements[pairs.col, 3], offset[:, 0], offset[:, 1]]
+    return sp.sparse.csr_matrix((values, (pairs.row, pairs.col)), shape=support.shape)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+def route_volume(route, demand, boxes):
+    '''
+    Total volume of the boxes demanded by the customers of a route
+    '''
+    return sum(boxes[i][0] * boxes[i][1] * boxes[i][2] * demand[i].get(k, 0) for k in route for i in boxes)
+
+def route_cost(route, links, depot):
+    '''
+    Distance of a route leaving from and returning to the depot
+    '''
+    stops = [depot] + list(route) + [depot]
+    return sum(links[stops[s], stops[s+1]]["distance"] for s in range(len(stops) - 1))
+
+def savings_routes(nodes, links, n_vehicles, demand, boxes, dimensions, packer):
+    '''
+    Clarke-Wright savings heuristic. Starts with one route per customer and merges the route ending in customer i
+    with the route starting in customer j in order of decreasing saving, as long as the merged route stays within the
+    vehicle volume (constraint 8) and the packer can load it. Merges with a negative saving are only made while
+    there are more routes than vehicles.
+    Returns a list of (route, placements) with placements as (x, y, z, i, k) tuples, or None if no solution is found.
+    '''
+    depot = nodes[0]
+    capacity = dimensions["length"] * dimensions["width"] * dimensions["height"]
+
+    # Single customer routes, a customer whose boxes cannot be loaded on an empty vehicle makes the heuristic fail
+    routes = {}
+    for k in nodes[1:]:
+        placements = packer.pack([k], demand)
+        if placements is None or route_volume([k], demand, boxes) > capacity:
+            return None
+        routes[k] = ([k], placements)
+
+    savings = sorted(((links[i, depot]["distance"] + links[depot, j]["distance"] - links[i, j]["distance"], i, j)
+                      for i in nodes[1:] for j in nodes[1:] if i != j),
+                     key=lambda saving: -saving[0])
+
+    # Route of every customer, keyed by the first customer of the route
+    first = {k: k for k in nodes[1:]}
+    for saving, i, j in savings:
+        if saving < 0 and len(routes) <= n_vehicles:
+            break
+
+        head_i, head_j = first[i], first[j]
+        if head_i == head_j or routes[head_i][0][-1] != i or head_j != j:
+            continue
+
+        merged = routes[head_i][0] + routes[head_j][0]
+        if route_volume(merged, demand, boxes) > capacity:
+            continue
+        placements = packer.pack(merged, demand)
+        if placements is None:
+            continue
+
+        routes[head_i] = (merged, placements)
+        del routes[head_j]
+        for k in merged:
+            first[k] = head_i
+
+    if len(routes) > n_vehicles:
+        return None
+    return list(routes.values())
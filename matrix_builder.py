@@ -0,0 +1,360 @@
+import numpy as np
+from scipy import sparse
+from gurobipy import GRB
+from helper import multidrop_big_m
+
+class MatrixBuilder():
+    '''
+    Builds the constraint families of a CVRP instance from sparse coefficient matrices and adds them in bulk through
+    the Gurobi matrix API. Every method mirrors the constraint method of the same name on CVRP and adds the same rows.
+    '''
+    def __init__(self, cvrp):
+        self.cvrp = cvrp
+        self.model = cvrp.model
+
+        # Columns only exist after an update, the matrix constraints are expressed over all model variables
+        self.model.update()
+        self.n_cols = self.model.NumVars
+
+        # Sizes of the index sets
+        self.nN = len(cvrp.nodes)
+        self.nC = self.nN - 1
+        self.nV = len(cvrp.vehicles)
+        self.nT = len(cvrp.stages)
+        self.nT1 = self.nT - 1
+        self.nI = len(cvrp.boxID)
+
+        # Grid positions, positions of box i are a prefix of the general positions as these are sorted
+        self.X = np.asarray(cvrp.xpos)
+        self.Y = np.asarray(cvrp.ypos)
+        self.Z = np.asarray(cvrp.zpos)
+        self.nXi = np.array([len(lst) for lst in cvrp.xpos_lst])
+        self.nYi = np.array([len(lst) for lst in cvrp.ypos_lst])
+        self.nZi = np.array([len(lst) for lst in cvrp.zpos_lst])
+
+        # Box dimensions and customer volumes per box type, indexed by position in boxID and customer list
+        self.L, self.W, self.H = (np.array([cvrp.boxes[i][axis] for i in cvrp.boxID]) for axis in range(3))
+        self.q = np.array([[cvrp.demand[i][k] for k in cvrp.nodes[1:]] for i in cvrp.boxID], dtype=float)
+        self.t_values = np.asarray(cvrp.stages, dtype=float)
+
+        # Customers demanding box i, as positions in the customer list
+        customer = {k: idx for idx, k in enumerate(cvrp.nodes[1:])}
+        self.K = [np.array([customer[k] for k in cvrp.box_customers[i]], dtype=np.int64) for i in cvrp.boxID]
+
+        # Column indices of the decision variables. Routing variables only exist for the kept arcs, the columns of
+        # pruned arcs are -1 and dropped by _add
+        node = {n: idx for idx, n in enumerate(cvrp.nodes)}
+        vehicle = {v: idx for idx, v in enumerate(cvrp.vehicles)}
+        self.D = np.full((self.nN, self.nN, self.nV, self.nT), -1, dtype=np.int64)
+        for (k, l, v, t), var in cvrp.d.items():
+            self.D[node[k], node[l], vehicle[v], t - 1] = var.index
+        self.Lp = self._columns(cvrp.l_p, (self.nC, self.nV))
+
+        # The loading variables follow the loading index, one (k, x, y, z, t, v) block per box type. Blocks are stored
+        # as A[i][x, y, z, k, t, v] with k running over the customers demanding box i
+        columns = self._columns(cvrp.a, (len(cvrp.a),))
+        self.A = []
+        offset = 0
+        for i in range(self.nI):
+            shape = (len(self.K[i]), self.nXi[i], self.nYi[i], self.nZi[i], self.nT1, self.nV)
+            size = int(np.prod(shape))
+            self.A.append(columns[offset:offset + size].reshape(shape).transpose(1, 2, 3, 0, 4, 5))
+            offset += size
+
+    @staticmethod
+    def _columns(variables, shape):
+        '''
+        Returns the column index of every variable in a tupledict reshaped to the dimensions of its index sets
+        '''
+        return np.fromiter((var.index for var in variables.values()), dtype=np.int64, count=len(variables)).reshape(shape)
+
+    def _add(self, n_rows, terms, sense, rhs, name=""):
+        '''
+        Assembles (row, column, coefficient) triplets into a sparse matrix and adds it as one matrix constraint.
+        Every term is broadcast to a common shape first, entries of missing columns (-1) are skipped, duplicate
+        entries are summed and zero entries dropped.
+        '''
+        if n_rows == 0:
+            return
+
+        rows, cols, vals = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], [np.empty(0)]
+        for row, col, val in terms:
+            row, col, val = np.broadcast_arrays(row, col, val)
+            present = col.ravel() >= 0
+            rows.append(row.ravel()[present])
+            cols.append(col.ravel()[present])
+            vals.append(val.ravel()[present].astype(float))
+
+        A = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                              shape=(n_rows, self.n_cols))
+        A.sum_duplicates()
+        A.eliminate_zeros()
+
+        self.model.addMConstr(A, None, sense, np.broadcast_to(np.asarray(rhs, dtype=float), (n_rows,)),
+                              [name] * n_rows if name else "")
+
+    def _covering(self, index, i):
+        '''
+        (row, placement) pairs of a sparse placement index restricted to the placements of box i, with the placements
+        numbered from zero within box i
+        '''
+        ids = self.cvrp.placement_ids[self.cvrp.boxID[i]]
+        return index[:, ids.start:ids.stop].tocoo()
+
+    def _placements(self, i):
+        '''
+        Loading columns of box i as (placement, k, t, v) with placements flattened in (x, y, z) order
+        '''
+        return self.A[i].reshape(self.nXi[i] * self.nYi[i] * self.nZi[i], len(self.K[i]), self.nT1, self.nV)
+
+    def ObjectiveFunc(self):
+        '''
+        Sets the link costs as objective coefficients of the routing variables in one call
+        '''
+        cvrp = self.cvrp
+        node = {n: idx for idx, n in enumerate(cvrp.nodes)}
+        cost = [cvrp.distance[node[k], node[l]] for k, l, v, t in cvrp.d.keys()]
+        self.model.setAttr(GRB.Attr.Obj, list(cvrp.d.values()), cost)
+        self.model.ModelSense = GRB.MINIMIZE
+
+    def constraintTwo(self):
+        '''
+        Constraint two, every customer is visited exactly once
+        '''
+        rows = np.arange(self.nC)[:, None, None, None]
+        self._add(self.nC, [(rows, self.D[1:], 1.0)], GRB.EQUAL, 1.0, "2|VisitOnce")
+
+    def constraintThree(self):
+        '''
+        Constraint three, connectivity of each tour
+        '''
+        rows = np.arange(self.nC)[:, None, None, None]
+        leave = (rows, self.D[1:, :, :, 1:], self.t_values[1:])
+        arrive = (rows, self.D[:, 1:].transpose(1, 0, 2, 3), -self.t_values)
+        self._add(self.nC, [leave, arrive], GRB.EQUAL, 1.0, "3|Connectivity")
+
+    def constraintFour(self):
+        '''
+        Constraint four, vehicles leave the depot at most once over all stages
+        '''
+        rows = np.arange(self.nV)[None, :, None]
+        self._add(self.nV, [(rows, self.D[0, 1:], 1.0)], GRB.LESS_EQUAL, 1.0, "4|LeaveDepotOnce")
+
+    def constraintFive(self):
+        '''
+        Constraint five, a vehicle arriving at customer k at stage t leaves customer k at stage t + 1
+        '''
+        n_rows = self.nC * self.nT1 * self.nV
+        rows = np.arange(n_rows).reshape(self.nC, self.nT1, self.nV)[..., None]
+        leave = (rows, self.D[1:, :, :, 1:].transpose(0, 3, 2, 1), 1.0)
+        arrive = (rows, self.D[:, 1:, :, :-1].transpose(1, 3, 2, 0), -1.0)
+        self._add(n_rows, [leave, arrive], GRB.EQUAL, 0.0, "5|CustomerToCustomer")
+
+    def constraintSeven(self):
+        return
+
+    def constraintEight(self):
+        '''
+        Constraint eight, the capacity of vehicles is not exceeded
+        '''
+        cvrp = self.cvrp
+        volume = self.L * self.W * self.H
+        weight = (volume[:, None] * self.q).sum(axis=0)
+        rows = np.arange(self.nV)[:, None, None, None]
+        cols = self.D[1:, :, :, 1:].transpose(2, 0, 1, 3)
+        capacity = cvrp.dimensions["length"] * cvrp.dimensions["width"] * cvrp.dimensions["height"]
+        self._add(self.nV, [(rows, cols, weight[None, :, None, None])], GRB.LESS_EQUAL, capacity, "8|VehicleCapacity")
+
+    def constraintNine(self):
+        '''
+        Constraint nine, all boxes for customer k are unpacked when at that customer
+        '''
+        n_rows = self.nC * self.nT1 * self.nV
+        rows = np.arange(n_rows).reshape(self.nC, self.nT1, self.nV)
+        terms = [(rows[..., None], self.D[:, 1:, :, :-1].transpose(1, 3, 2, 0), -self.q.sum(axis=0)[:, None, None, None])]
+        for i in range(self.nI):
+            boxes = self._placements(i).transpose(1, 2, 3, 0)
+            terms.append((rows[self.K[i]][..., None], boxes, 1.0))
+
+        self._add(n_rows, terms, GRB.EQUAL, 0.0, "9|UnpackAll")
+
+    def constraintTen(self):
+        '''
+        Constraint ten, boxes do not overlap. Rows are (x', y', z', v), a box covers every cell it occupies
+        '''
+        n_cells = self.cvrp.coverage.shape[0]
+        v = np.arange(self.nV)
+
+        terms = []
+        for i in range(self.nI):
+            cover = self._covering(self.cvrp.coverage, i)
+            rows = cover.row[:, None, None, None] * self.nV + v
+            terms.append((rows, self._placements(i)[cover.col], 1.0))
+
+        self._add(n_cells * self.nV, terms, GRB.LESS_EQUAL, 1.0, "10|NoOverlapBoxes")
+
+    def constraintEleven(self):
+        '''
+        Constraint eleven, the demand can be satisfied
+        '''
+        terms = []
+        rhs = []
+        offset = 0
+        for i in range(self.nI):
+            rows = offset + np.arange(len(self.K[i]))
+            terms.append((rows[:, None, None, None], self._placements(i).transpose(1, 0, 2, 3), 1.0))
+            rhs.append(self.q[i, self.K[i]])
+            offset += len(rows)
+
+        self._add(offset, terms, GRB.EQUAL, np.concatenate(rhs), "11|DemandSatisfiability")
+
+    def constraintThirteen(self):
+        '''
+        Constraint thirteen, the area of the bottom face of a box is completely supported.
+        Rows are (i, k, t, v, x, y, z) for every position of box i above the floor
+        '''
+        cvrp = self.cvrp
+        stages = np.arange(self.nT1)
+        t_idx, u_idx = np.nonzero(stages[:, None] <= stages[None, :])
+
+        terms = []
+        offset = 0
+        for i in range(self.nI):
+            nx, ny, nz = self.nXi[i], self.nYi[i], self.nZi[i] - 1
+            if nx == 0 or ny == 0 or nz <= 0 or len(self.K[i]) == 0:
+                continue
+            shape = (len(self.K[i]), self.nT1, self.nV, nx, ny, nz)
+            rows = offset + np.arange(np.prod(shape)).reshape(shape)
+
+            # Box i itself, A[x, y, z, i, k, t, v] ordered as the rows
+            own = self.A[i][:, :, 1:].transpose(3, 4, 5, 0, 1, 2)
+            terms.append((rows, own, -float(self.L[i] * self.W[i])))
+
+            # Supported and supporting placement pairs with their overlap area from the weighted support index
+            ids = cvrp.placement_ids[cvrp.boxID[i]]
+            support = cvrp.support_area[ids.start:ids.stop]
+            for j in range(self.nI):
+                pairs = self._covering(support, j)
+                if pairs.nnz == 0:
+                    continue
+                x, y, z = np.unravel_index(pairs.row, (nx, ny, nz + 1))
+                area = pairs.data
+
+                # Broadcast over (k, (t, u), v, pair, l) with supporting stages u >= t
+                row = rows[:, t_idx][:, :, :, x, y, z - 1][..., None]
+                col = self._placements(j)[pairs.col][:, :, u_idx]
+                terms.append((row, col.transpose(2, 3, 0, 1)[None], area[:, None]))
+
+            offset += np.prod(shape)
+
+        self._add(offset, terms, GRB.GREATER_EQUAL, 0.0)
+
+    def constraintFourteen(self):
+        '''
+        Constraint fourteen, multidrop situation constraint 1
+        '''
+        terms = []
+        offset = 0
+        for i in range(self.nI):
+            nx, ny, nz = self.nXi[i], self.nYi[i], self.nZi[i]
+            shape = (len(self.K[i]), self.nV, nx, ny, nz)
+            rows = offset + np.arange(np.prod(shape)).reshape(shape)
+            front = (self.X[:nx] + self.L[i]).reshape(-1, 1, 1, 1)
+            terms.append((rows[..., None], self.A[i].transpose(3, 5, 0, 1, 2, 4), front))
+            terms.append((rows, self.Lp[self.K[i]][:, :, None, None, None], -1.0))
+            offset += np.prod(shape)
+
+        self._add(offset, terms, GRB.LESS_EQUAL, 0.0)
+
+    def constraintFifteen(self):
+        '''
+        Constraint fifteen, multidrop situation constraint 2. Rows are (i, v, k, l, x, y, z), indicator constraints
+        are added by the loop builder
+        '''
+        cvrp = self.cvrp
+        if cvrp.big_m == "indicator":
+            return cvrp.constraintFifteen()
+        reach = np.array([[cvrp.maximum_reach[i-1][k-2] for k in cvrp.nodes[1:]] for i in cvrp.boxID], dtype=float)
+        visits = self.D[1:, 1:, :, :-1].transpose(2, 0, 1, 3)
+        lp = self.Lp.T[:, None, :, None, None, None]
+
+        terms = []
+        rhs = []
+        offset = 0
+        for i in range(self.nI):
+            nx, ny, nz = self.nXi[i], self.nYi[i], self.nZi[i]
+            K = self.K[i]
+            shape = (self.nV, len(K), self.nC, nx, ny, nz)
+            rows = offset + np.arange(np.prod(shape)).reshape(shape)
+
+            # Big-M values per (k, x)
+            if cvrp.big_m == "global":
+                M1, M2 = np.full((len(K), 1), cvrp.M1), np.full((len(K), nx), cvrp.M2)
+            else:
+                M1, M2 = multidrop_big_m(cvrp.dimensions["length"], reach[i, K][:, None], self.X[None, :nx])
+            M1, M2 = M1.reshape(1, -1, 1, 1, 1, 1), M2.reshape(1, len(K), 1, nx, 1, 1)
+
+            boxes = self.A[i].transpose(5, 3, 0, 1, 2, 4)[:, :, None]
+            terms.append((rows[..., None], boxes, (M1 - self.X[:nx].reshape(-1, 1, 1))[..., None]))
+            terms.append((rows[..., None], visits[:, K, :, None, None, None, :], M2[..., None]))
+            terms.append((rows, lp, 1.0))
+            rhs.append(np.broadcast_to(reach[i, K].reshape(1, -1, 1, 1, 1, 1) + M1 + M2, shape).ravel())
+            offset += np.prod(shape)
+
+        self._add(offset, terms, GRB.LESS_EQUAL, np.concatenate(rhs))
+
+    def constraintSixteen(self):
+        '''
+        Constraint sixteen, multidrop situation constraint 3. Rows are (k, l, v), indicator constraints are added by
+        the loop builder
+        '''
+        if self.cvrp.big_m == "indicator":
+            return self.cvrp.constraintSixteen()
+        n_rows = self.nC * self.nC * self.nV
+        rows = np.arange(n_rows).reshape(self.nC, self.nC, self.nV)
+        terms = [(rows, self.Lp[None, :, :], 1.0),
+                 (rows, self.Lp[:, None, :], -1.0),
+                 (rows[..., None], self.D[1:, 1:, :, :-1], self.cvrp.M3)]
+        self._add(n_rows, terms, GRB.LESS_EQUAL, self.cvrp.M3)
+
+    def constraintSeventeen(self):
+        '''
+        Constraint seventeen, multidrop situation constraint 4
+        '''
+        n_rows = self.nC * self.nV
+        rows = np.arange(n_rows).reshape(self.nC, self.nV)
+        self._add(n_rows, [(rows, self.Lp, 1.0)], GRB.LESS_EQUAL, self.cvrp.dimensions["length"])
+
+    def constraintEighteen(self):
+        '''
+        Constraint eighteen, load-bearing strength. Rows are (x', y', z', v), the weight per unit area of the boxes
+        above a cell is bounded by the strength of the box covering it
+        '''
+        cvrp = self.cvrp
+        n_cells = cvrp.coverage.shape[0]
+        v = np.arange(self.nV)
+
+        terms = []
+        for j in range(self.nI):
+            above = self._covering(cvrp.coverage_above, j)
+            pressure = cvrp.p[cvrp.boxID[j] - 1] / (self.L[j] * self.W[j])
+            terms.append((above.row[:, None, None, None] * self.nV + v, self._placements(j)[above.col], pressure))
+
+        for i in range(self.nI):
+            cover = self._covering(cvrp.coverage, i)
+            strength = -cvrp.sigma[cvrp.boxID[i] - 1]
+            terms.append((cover.row[:, None, None, None] * self.nV + v, self._placements(i)[cover.col], strength))
+
+        self._add(n_cells * self.nV, terms, GRB.LESS_EQUAL, 0.0)
+
+    def symmetryVehicles(self):
+        '''
+        Vehicle symmetry breaking, a handful of rows so the loop version on CVRP adds them
+        '''
+        self.cvrp.symmetryVehicles()
+
+    def symmetryMirror(self):
+        '''
+        Mirror symmetry breaking, one row per vehicle so the loop version on CVRP adds them
+        '''
+        self.cvrp.symmetryMirror()
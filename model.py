@@ -1,22 +1,54 @@
+import time
 import numpy as np
 import scipy as sp
 import matplotlib.pyplot as plt
 import gurobipy as gp
 from gurobipy import GRB
 from helper import *
+from matrix_builder import MatrixBuilder
+from profiler import BuildProfiler
+from packing import ExtremePointPacker
+from heuristic import route_volume, savings_routes
+from model_cache import ModelCache
+from solution import Solution
+from telemetry import SolveTelemetry
 
 class CVRP():
     '''
-    class containing a three-dimensional loading capacitated vehicle routing problem (3L-CVRP)
+    class containing a three-dimensional loading capacitated vehicle routing problem (3L-CVRP). With trim_stages the
+    stages are cut to the stage_horizon of the instance, which is only implied when the capacity constraint 8 and the
+    loading constraints are active, so trimming is off by default
     '''
-    def __init__(self, name, nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma, constraints):
+    def __init__(self, name, nodes, links, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma, constraints,
+                 builder="loop", profile=False, cache=None, trim_stages=False, neighbours=None, upper_bound=None,
+                 symmetry=False, resolution=None, big_m="tight"):
+        build_start = time.perf_counter()
+
+        # Grid unit along every axis, by default the common divisor of the box sizes and vehicle dimensions. The
+        # model is built in these units and solution maps placements back, with a resolution the boxes are rounded
+        # up and the vehicle down to it. Support and load-bearing are then checked on the rounded boxes.
+        self.scale = grid_scale(dimensions, boxes, resolution)
+        dimensions, boxes, maximum_reach, p, sigma = scale_instance(dimensions, boxes, maximum_reach, p, sigma,
+                                                                    self.scale)
 
         # Define the nodes and demands (Depot 0, rest customer nodes)
         self.nodes = nodes
         self.depot = self.nodes[0]
-        self.links = links
         self.demand = demand
 
+        # Distances as a matrix indexed by position in nodes, links may be given as a dict of links or as this matrix
+        self.distance = distance_matrix(nodes, links)
+        self.links = links if isinstance(links, dict) else \
+            {(i, j): {"distance": self.distance[k, l]}
+             for k, i in enumerate(nodes) for l, j in enumerate(nodes) if np.isfinite(self.distance[k, l])}
+
+        # Arcs that get routing variables, without self-loops and pruned by prune_arcs when neighbours or upper_bound
+        # is given
+        keep = prune_arcs(self.distance, neighbours, upper_bound)
+        self.arcs = [(nodes[k], nodes[l]) for k, l in zip(*np.nonzero(keep))]
+        self.successors = {k: [l for l, j in zip(nodes, keep[idx]) if j] for idx, k in enumerate(nodes)}
+        self.predecessors = {l: [k for k, j in zip(nodes, keep[:, idx]) if j] for idx, l in enumerate(nodes)}
+
         # Vehicle IDs and Vehicle Dimensions
         self.vehicles = vehicles
         self.dimensions = dimensions
@@ -30,30 +62,19 @@ class CVRP():
         self.p = p
         self.sigma = sigma
 
-        # Large numbers
+        # Large numbers of the multidrop constraints. "global" uses one value for all rows, "tight" gives every row of
+        # constraint fifteen its own values from multidrop_big_m and bounds constraint sixteen by the vehicle length,
+        # "indicator" adds both constraints as indicator constraints on the routing variables instead
+        if big_m not in ("global", "tight", "indicator"):
+            raise ValueError(f"Invalid big_m {big_m!r} provided to CVRP. Use 'global', 'tight' or 'indicator'")
+        self.big_m = big_m
         self.M1 = 1.1 * sum(self.boxes[i][0] * sum(self.demand[i].values()) for i in self.boxes)
         self.M2 = 1.1 * sum(self.boxes[i][1] * sum(self.demand[i].values()) for i in self.boxes)
-        self.M3 = 1.1 * sum(self.boxes[i][2] * sum(self.demand[i].values()) for i in self.boxes)
-
-        # Create lists with box lengths, widths, heights and the amount of a given box
-        sizes_L = []
-        sizes_W = []
-        sizes_H = []
-        counts = []
-
-        for box_id, dims in self.boxes.items():
-            sizes_L.append(dims[0])
-            sizes_W.append(dims[1])
-            sizes_H.append(dims[2])
-            counts.append(sum(self.demand[box_id].values()))
-
-        # Extract minimum dimensions (take transpose of dictionary values and take minimum)
-        min_L, min_W, min_H = map(min, zip(*boxes.values()))
+        self.M3 = 1.1 * sum(self.boxes[i][2] * sum(self.demand[i].values()) for i in self.boxes) \
+            if big_m == "global" else self.dimensions["length"]
 
-        # Create general set of possible positions
-        self.xpos = reachable_positions(sizes_L, counts, self.dimensions["length"] - min_L)
-        self.ypos = reachable_positions(sizes_W, counts, self.dimensions["width"] - min_W)
-        self.zpos = reachable_positions(sizes_H, counts, self.dimensions["height"] - min_H)
+        # Create general set of possible positions, sorted so both builders see the same ordering
+        self.xpos, self.ypos, self.zpos = grid_positions(dimensions, boxes, demand)
 
         # Limit box i's positions to vehicle dimension minus box i's dimension to keep box inside
         self.xpos_lst = []
@@ -65,21 +86,140 @@ class CVRP():
             self.ypos_lst.append([y for y in self.ypos if y <= self.dimensions["width"] - dims[1]])
             self.zpos_lst.append([z for z in self.zpos if z <= self.dimensions["height"] - dims[2]])
 
-        # Define time stages and active constraints
-        self.stages = [i+1 for i in range(len(nodes))]
+        # Sparse loading index of feasible (x, y, z, i, k) tuples, box i is only placed at its own positions and only
+        # for customers with a demand for it
+        self.placements = {i: [(x, y, z) for x in self.xpos_lst[i-1] for y in self.ypos_lst[i-1] for z in self.zpos_lst[i-1]]
+                           for i in self.boxID}
+        self.box_customers = {i: [k for k in self.nodes[1:] if self.demand[i][k] > 0] for i in self.boxID}
+        self.loading_index = [(x, y, z, i, k)
+                              for i in self.boxID
+                              for k in self.box_customers[i]
+                              for x, y, z in self.placements[i]]
+
+        # Placements (x, y, z, i) of all box types, with the sparse indices shared by the overlap, support and
+        # load-bearing constraints. Coverage maps grid cells to the placements covering them, coverage_above to the
+        # placements stacked above them and support maps placements to the placements that can carry them
+        self.placement_list = [(x, y, z, i) for i in self.boxID for x, y, z in self.placements[i]]
+        self.placement_ids = {}
+        start = 0
+        for i in self.boxID:
+            self.placement_ids[i] = range(start, start + len(self.placements[i]))
+            start += len(self.placements[i])
+
+        self.coverage = coverage_index(self.xpos, self.ypos, self.zpos, self.placement_list, self.boxes)
+        self.coverage_above = coverage_index(self.xpos, self.ypos, self.zpos, self.placement_list, self.boxes, above=True)
+        self.support = support_index(self.placement_list, self.boxes, self.xpos_lst, self.ypos_lst, self.zpos_lst)
+
+        # Overlap areas of every pair of box types and offset, and the support index weighted with them, so the
+        # support constraint only looks up the area of a (supported, supporting) pair
+        self.overlap = overlap_areas(self.boxes)
+        self.support_area = support_areas(self.support, self.placement_list, self.boxes, self.overlap)
+
+        # Define time stages and active constraints. A vehicle serving at most horizon customers arrives at the last
+        # one at stage horizon and returns at stage horizon + 1. Without trim_stages every customer can be served by
+        # one vehicle, the volume and box count bound of the horizon only hold with the loading constraints
+        self.horizon = stage_horizon(nodes, dimensions, boxes, demand) if trim_stages else len(nodes) - 1
+        self.stages = [t+1 for t in range(self.horizon + 1)]
         self.constraints = constraints
 
-        # Create the model
+        # Symmetry breaking rows are kept as two extra constraint groups, so set_constraints can toggle them as well
+        if symmetry:
+            self.constraints = {**constraints, "symmetryVehicles": True, "symmetryMirror": True}
+
+        # Model builder, "loop" adds constraints row by row, "matrix" adds them in bulk through the matrix API
+        if builder not in ("loop", "matrix"):
+            raise ValueError(f"Invalid builder {builder!r} provided to CVRP. Use 'loop' or 'matrix'")
+        self.builder = builder
+
+        # Lazy constraints are left out of the model and separated in a callback by optimize
+        self.lazy = [key for key, value in self.constraints.items() if value == "lazy"]
+
+        # Model cache directory, an identical model built before is reloaded instead of rebuilt
+        self.cache = ModelCache(cache) if isinstance(cache, str) else cache
+
+        # Create the model, the profiler records every build phase when profile is enabled. The rows of every
+        # constraint method are kept as a group so set_constraints can switch it off and on again
         self.model = gp.Model(name)
+        self.build = None
+        self.groups = {}
+        self.solution_keys = None
+        if self.cache is not None and self.cache.load(self):
+            self.profiler = BuildProfiler(self.model, enabled=profile)
+            self.build_time = time.perf_counter() - build_start
+            return
+        self.profiler = BuildProfiler(self.model, enabled=profile)
 
         # Create decision variables
-        self.decision_variables()
-        self.ObjectiveFunc()
+        with self.profiler.phase("decision_variables"):
+            self.decision_variables()
+
+        if self.builder == "matrix":
+            with self.profiler.phase("MatrixBuilder"):
+                self.builder_instance()
+
+        with self.profiler.phase("ObjectiveFunc"):
+            self.builder_instance().ObjectiveFunc()
 
         # Add constraints selectively, calls the function if it is enabled
         for key, value in self.constraints.items():
-            if value:
-                getattr(self, key)()
+            if value and value != "lazy":
+                with self.profiler.phase(key):
+                    self.groups[key] = self.add_group(key)
+
+        if self.cache is not None:
+            self.cache.store(self)
+        self.build_time = time.perf_counter() - build_start
+
+    def builder_instance(self):
+        '''
+        Object holding the constraint methods, the model itself for the loop builder or a MatrixBuilder
+        '''
+        if self.build is None:
+            self.build = MatrixBuilder(self) if self.builder == "matrix" else self
+        return self.build
+
+    def add_group(self, key):
+        '''
+        Calls one constraint method and returns the rows and indicator constraints it added
+        '''
+        self.model.update()
+        start, general = self.model.NumConstrs, self.model.NumGenConstrs
+        getattr(self.builder_instance(), key)()
+        self.model.update()
+        return self.model.getConstrs()[start:] + self.model.getGenConstrs()[general:]
+
+    def set_constraints(self, constraints):
+        '''
+        Switches constraint groups on the live model, constraints maps constraint method names to their new value as
+        in constraintGenerator and may hold only the groups that change. Rows of groups switched off are removed and
+        groups switched on are built, every other row and all variables are left untouched.
+        '''
+        self.constraints = {**self.constraints, **constraints}
+        for key, value in self.constraints.items():
+            active = bool(value) and value != "lazy"
+            if key in self.groups and not active:
+                self.model.remove(self.groups.pop(key))
+            elif active and key not in self.groups:
+                self.groups[key] = self.add_group(key)
+
+        self.lazy = [key for key, value in self.constraints.items() if value == "lazy"]
+        self.model.update()
+
+    def indexed(self, index, row):
+        '''
+        Placements (x, y, z, i) stored in a row of one of the sparse placement indices
+        '''
+        return [self.placement_list[p] for p in index.indices[index.indptr[row]:index.indptr[row + 1]]]
+
+    def supporting(self, p):
+        '''
+        Placements (x, y, z, j) that can support placement p with their overlap area, placements without overlap are
+        left out
+        '''
+        start, stop = self.support_area.indptr[p], self.support_area.indptr[p + 1]
+        return [(self.placement_list[q], area)
+                for q, area in zip(self.support_area.indices[start:stop], self.support_area.data[start:stop].tolist())
+                if area > 0]
 
     def decision_variables(self):
         '''
@@ -87,12 +227,19 @@ class CVRP():
         '''
 
         # Binary route decision variables \(d_{kl}^{tv}\)
-        self.d = self.model.addVars(self.nodes, self.nodes, self.vehicles, self.stages,
+        self.d = self.model.addVars([(i, j, v, t)
+                                     for i, j in self.arcs
+                                     for v in self.vehicles
+                                     for t in self.stages],
                                     vtype=GRB.BINARY,
                                     name='d')
 
-        # Binary loading decision variables \(a_{xyz}^{iktv}\) Note that t and v are inverted
-        self.a = self.model.addVars(self.xpos, self.ypos, self.zpos, self.boxID, self.nodes[1:], self.stages[:-1], self.vehicles,
+        # Binary loading decision variables \(a_{xyz}^{iktv}\) Note that t and v are inverted, only created for the
+        # feasible tuples in the loading index
+        self.a = self.model.addVars([(x, y, z, i, k, t, v)
+                                     for x, y, z, i, k in self.loading_index
+                                     for t in self.stages[:-1]
+                                     for v in self.vehicles],
                                     vtype=GRB.BINARY,
                                     name='a')
 
@@ -106,12 +253,187 @@ class CVRP():
         Takes link cost and routing decision variables and creates the objective function
         '''
         objective = gp.quicksum(self.links[i, j]["distance"] * self.d[i, j, v, t]
-                                for i, j in self.links
+                                for i, j in self.arcs
                                 for v in self.vehicles
                                 for t in self.stages)
 
         self.model.setObjective(objective, GRB.MINIMIZE)
 
+    def optimize(self, user_cuts=False, telemetry=None):
+        '''
+        Optimizes the model. Constraint families marked lazy by constraintGenerator are separated in a callback from
+        every incumbent, and with user_cuts also from the node relaxations. telemetry, a SolveTelemetry or the path of
+        a new one, records the build timings and samples the progress of the solve.
+        '''
+        callbacks = []
+        if self.lazy:
+            self.user_cuts = user_cuts
+            self.prepare_separation()
+            self.model.setParam("LazyConstraints", 1)
+            if user_cuts:
+                self.model.setParam("PreCrush", 1)
+            callbacks.append(self.separate)
+
+        owned = isinstance(telemetry, str)
+        if owned:
+            telemetry = SolveTelemetry(telemetry)
+        if telemetry is not None:
+            telemetry.build(self)
+            callbacks.append(telemetry.callback)
+
+        def callback(model, where):
+            for function in callbacks:
+                function(model, where)
+
+        try:
+            if callbacks:
+                self.model.optimize(callback)
+            else:
+                self.model.optimize()
+            if telemetry is not None:
+                telemetry.final(self.model)
+        finally:
+            if owned:
+                telemetry.close()
+
+    def prepare_separation(self):
+        '''
+        Index arrays of the loading variables used to separate the lazy constraint families
+        '''
+        placement = {placement: p for p, placement in enumerate(self.placement_list)}
+        vehicle = {v: idx for idx, v in enumerate(self.vehicles)}
+        keys = list(self.a.keys())
+
+        self.a_vars = list(self.a.values())
+        self.a_keys = keys
+        self.a_placement = np.array([placement[key[:4]] for key in keys], dtype=np.int64)
+        self.a_stage = np.array([key[5] for key in keys], dtype=np.int64)
+        self.a_vehicle = np.array([vehicle[key[6]] for key in keys], dtype=np.int64)
+
+    def violated_rows(self, values, tolerance=1e-6):
+        '''
+        Rows of the lazy constraint families violated by the given values of the loading variables
+        '''
+        values = np.asarray(values)
+        n_placements = len(self.placement_list)
+        rows = []
+
+        for idx, v in enumerate(self.vehicles):
+            in_vehicle = self.a_vehicle == idx
+            if not (values[in_vehicle] > tolerance).any():
+                continue
+
+            # Cells of vehicle v covered more than once
+            if "constraintTen" in self.lazy:
+                load = np.bincount(self.a_placement[in_vehicle], values[in_vehicle], minlength=n_placements)
+                for cell in np.flatnonzero(self.coverage @ load > 1 + tolerance):
+                    rows.append(self.overlap_row(self.indexed(self.coverage, cell), v))
+
+            # Boxes whose bottom face is not supported by boxes delivered at the same or a later stage
+            if "constraintThirteen" in self.lazy:
+                for t in self.stages[:-1]:
+                    later = in_vehicle & (self.a_stage >= t)
+                    supported = self.support_area @ np.bincount(self.a_placement[later], values[later],
+                                                                minlength=n_placements)
+                    for a in np.flatnonzero(in_vehicle & (self.a_stage == t) & (values > tolerance)):
+                        x, y, z, i, k, _, _ = self.a_keys[a]
+                        p = self.a_placement[a]
+                        if z > 0 and supported[p] < self.boxes[i][0] * self.boxes[i][1] * values[a] - tolerance:
+                            rows.append(self.support_row(x, y, z, i, k, t, v, self.supporting(p)))
+
+        return rows
+
+    def separate(self, model, where):
+        '''
+        Gurobi callback adding the violated lazy rows of every incumbent and, with user cuts, of node relaxations
+        '''
+        if where == GRB.Callback.MIPSOL:
+            for row in self.violated_rows(model.cbGetSolution(self.a_vars)):
+                model.cbLazy(row)
+
+        elif where == GRB.Callback.MIPNODE and self.user_cuts:
+            if model.cbGet(GRB.Callback.MIPNODE_STATUS) == GRB.OPTIMAL:
+                for row in self.violated_rows(model.cbGetNodeRel(self.a_vars)):
+                    model.cbCut(row)
+
+    def solution(self, threshold=0.5):
+        '''
+        Reads the incumbent in one bulk call and returns it as a Solution, or None when the model has no solution.
+        Binaries above threshold count as chosen.
+        '''
+        if self.model.SolCount == 0:
+            return None
+
+        # Variables are created as one block of d, then a and then l_p columns
+        values = np.asarray(self.model.getAttr(GRB.Attr.X))
+        n_d, n_a = len(self.d), len(self.a)
+        if self.solution_keys is None:
+            self.solution_keys = (np.array(list(self.d.keys()), dtype=np.int64).reshape(-1, 4),
+                                  np.array(list(self.a.keys()), dtype=np.int64).reshape(-1, 7))
+        d_keys, a_keys = self.solution_keys
+
+        # (k, l, v, t) to (vehicle, stage, from, to) and (x, y, z, i, k, t, v) to (vehicle, stage, customer, box, x, y, z),
+        # positions and fronts back in the units of the instance
+        arcs = d_keys[values[:n_d] > threshold][:, [2, 3, 0, 1]]
+        placements = a_keys[values[n_d:n_d + n_a] > threshold][:, [6, 5, 4, 3, 0, 1, 2]]
+        placements[:, 4:] *= self.scale
+        served = set(arcs[:, 3].tolist())
+        front = {key: float(value) * self.scale[0] for key, value in zip(self.l_p.keys(), values[n_d + n_a:])
+                 if key[0] in served}
+
+        return Solution(self.model.ObjVal, self.model.Status, self.depot, arcs, placements, front)
+
+    def warm_start(self):
+        '''
+        Runs the savings routing and extreme-point packing heuristic and writes its solution as MIP start on d, a and
+        l_p, so the branch-and-bound starts from an incumbent. Call before optimize. Returns the route of every used
+        vehicle, or None when the heuristic finds no solution on the kept arcs and no start is set.
+        '''
+        packer = ExtremePointPacker(self.boxes, self.dimensions, (self.xpos, self.ypos, self.zpos), self.p, self.sigma)
+        routes = savings_routes(self.nodes, self.links, len(self.vehicles), self.demand, self.boxes, self.dimensions, packer)
+        if routes is None:
+            return None
+
+        # Routes over pruned arcs have no routing variables to start from
+        for route, _ in routes:
+            stops = [self.depot] + route + [self.depot]
+            if any(stops[t+1] not in self.successors[stops[t]] for t in range(len(stops) - 1)):
+                return None
+
+        # Everything not on a heuristic route starts at zero
+        for variables in (self.d, self.a, self.l_p):
+            self.model.setAttr(GRB.Attr.Start, list(variables.values()), [0.0] * len(variables))
+
+        used = {}
+        # Vehicles ordered by decreasing load volume, as required by the vehicle symmetry breaking rows
+        routes = sorted(routes, key=lambda route: -route_volume(route[0], self.demand, self.boxes))
+        for v, (route, placements) in zip(self.vehicles, routes):
+            used[v] = route
+
+            # The vehicle leaves the depot at stage 1 and arrives at the t-th customer of its route at stage t
+            stops = [self.depot] + route + [self.depot]
+            for t in range(len(stops) - 1):
+                self.d[stops[t], stops[t+1], v, t+1].Start = 1.0
+
+            # Loadings with their centre in the right half are mirrored for the mirror symmetry breaking row
+            width = self.dimensions["width"]
+            if self.groups.get("symmetryMirror") and \
+                    sum(np.prod(self.boxes[i]) * (2 * y + self.boxes[i][1] - width) for _, y, _, i, _ in placements) > 0:
+                placements = [(x, width - self.boxes[i][1] - y, z, i, k) for x, y, z, i, k in placements]
+
+            # Boxes are loaded for the stage their customer is visited, L'_{kv} is the front of the boxes of k
+            stage = {k: t+1 for t, k in enumerate(route)}
+            front = {k: 0 for k in route}
+            for x, y, z, i, k in placements:
+                if (x, y, z, i, k, stage[k], v) in self.a:
+                    self.a[x, y, z, i, k, stage[k], v].Start = 1.0
+                front[k] = max(front[k], x + self.boxes[i][0])
+
+            for k in route:
+                self.l_p[k, v].Start = front[k]
+
+        return used
+
     def constraintTwo(self):
         '''
         Constraint two presented in the paper, ensures every customer is visited exactly once
@@ -119,7 +441,7 @@ class CVRP():
         for k in self.nodes[1:]:
             self.model.addConstr(
                 gp.quicksum(self.d[k, l, v, t]
-                            for l in self.nodes
+                            for l in self.successors[k]
                             for v in self.vehicles
                             for t in self.stages
                 )
@@ -134,12 +456,12 @@ class CVRP():
         for k in self.nodes[1:]:
             self.model.addConstr(
                 gp.quicksum(t * self.d[k, l, v, t]
-                            for l in self.nodes
+                            for l in self.successors[k]
                             for v in self.vehicles
                             for t in self.stages[1:]
                 )
                 - gp.quicksum(t * self.d[p, k, v, t]
-                            for p in self.nodes
+                            for p in self.predecessors[k]
                             for v in self.vehicles
                             for t in self.stages)
                 == 1,
@@ -148,12 +470,14 @@ class CVRP():
 
     def constraintFour(self):
         '''
-        Constraint four presented in paper, ensures vehicles leave the depot at most once at stage 1
+        Constraint four presented in paper, ensures vehicles leave the depot at most once. The paper only restricts
+        stage 1, which lets a vehicle that starts late leave the depot a second time within the same route
         '''
         for v in self.vehicles:
             self.model.addConstr(
-                gp.quicksum(self.d[1, l, v, 1]
-                            for l in self.nodes[1:]
+                gp.quicksum(self.d[self.depot, l, v, t]
+                            for l in self.successors[self.depot]
+                            for t in self.stages
                 )
                 <= 1,
                 name=f"4|LeaveDepotOnce"
@@ -169,10 +493,10 @@ class CVRP():
                 for v in self.vehicles:
                     self.model.addConstr(
                         gp.quicksum(self.d[k, l, v, t+1]
-                                    for l in self.nodes
+                                    for l in self.successors[k]
                         )
                         - gp.quicksum(self.d[p, k, v, t]
-                                      for p in self.nodes)
+                                      for p in self.predecessors[k])
                         == 0,
                         name="5|CustomerToCustomer"
                     )
@@ -188,8 +512,8 @@ class CVRP():
             self.model.addConstr(
                 gp.quicksum(self.boxes[i][0] * self.boxes[i][1] * self.boxes[i][2] * self.demand[i][k] * self.d[k, l, v, t]
                             for t in self.stages[1:]
-                            for l in self.nodes
                             for k in self.nodes[1:]
+                            for l in self.successors[k]
                             for i in self.boxID)
                 <= self.dimensions["length"] * self.dimensions["width"] * self.dimensions["height"],
                 name="8|VehicleCapacity"
@@ -204,14 +528,12 @@ class CVRP():
                 for v in self.vehicles:
                     self.model.addConstr(
                         gp.quicksum(self.a[x, y, z, i, k, t, v]
-                                    for i in self.boxID
-                                    for x in self.xpos
-                                    for y in self.ypos
-                                    for z in self.zpos)
+                                    for i in self.boxID if self.demand[i][k] > 0
+                                    for x, y, z in self.placements[i])
                         ==
                         gp.quicksum(self.demand[i][k] * self.d[l, k, v, t]
                                     for i in self.boxID
-                                    for l in self.nodes),
+                                    for l in self.predecessors[k]),
                         name="9|UnpackAll"
                     )
 
@@ -219,35 +541,30 @@ class CVRP():
         '''
         Constraint ten presented in paper, ensures boxes do not overlap. (Slows down model significantly)
         '''
-        for x_prime in self.xpos:
-            for y_prime in self.ypos:
-                for z_prime in self.zpos:
-                    for v in self.vehicles:
-                        self.model.addConstr(
-                            gp.quicksum(self.a[x, y, z, i, k, t, v]
-                                        for i in self.boxID
-                                        for k in self.nodes[1:]
-                                        for t in self.stages[:-1]
-                                        for x in self.xpos_lst[i-1] if x_prime - self.boxes[i][0] + 1 <= x <= x_prime
-                                        for y in self.ypos_lst[i-1] if y_prime - self.boxes[i][1] + 1 <= y <= y_prime
-                                        for z in self.zpos_lst[i-1] if z_prime - self.boxes[i][2] + 1 <= z <= z_prime
-                            )
-                            <=
-                            1,
-                            name="10|NoOverlapBoxes"
-                        )
+        for cell in range(self.coverage.shape[0]):
+            covering = self.indexed(self.coverage, cell)
+            for v in self.vehicles:
+                self.model.addConstr(self.overlap_row(covering, v), name="10|NoOverlapBoxes")
+
+    def overlap_row(self, covering, v):
+        '''
+        Row of constraint ten for the placements covering one grid cell of vehicle v
+        '''
+        return gp.quicksum(self.a[x, y, z, i, k, t, v]
+                           for x, y, z, i in covering
+                           for k in self.box_customers[i]
+                           for t in self.stages[:-1]
+               ) <= 1
 
     def constraintEleven(self):
         '''
         Constraint eleven presented in paper, ensures the demand can be satisfied
         '''
         for i in self.boxID:
-            for k in self.nodes[1:]:
+            for k in self.box_customers[i]:
                 self.model.addConstr(
                     gp.quicksum(self.a[x, y, z, i, k, t, v]
-                                for z in self.zpos_lst[i-1]
-                                for y in self.ypos_lst[i-1]
-                                for x in self.xpos_lst[i-1]
+                                for x, y, z in self.placements[i]
                                 for v in self.vehicles
                                 for t in self.stages[:-1])
                     ==
@@ -260,42 +577,52 @@ class CVRP():
         Constraint thirteen presented in paper, ensures area of the bottom face of a box is completely supported
         '''
         for i in self.boxID:
-            for k in self.nodes[1:]:
+            # Supporting placements with their overlap area of every placement of box i above the vehicle floor
+            supported = [(self.placement_list[p], self.supporting(p))
+                         for p in self.placement_ids[i] if self.placement_list[p][2] > 0]
+
+            # The supported area does not depend on the customer of box i, it is summed once for all customers
+            area = {}
+            for k in self.box_customers[i]:
                 for t in self.stages[:-1]:
                     for v in self.vehicles:
-                        for x in self.xpos_lst[i-1]:
-                            for y in self.ypos_lst[i-1]:
-                                for z in self.zpos_lst[i-1][1:]:
-                                    self.model.addConstr(
-                                        gp.quicksum((min(x + self.boxes[i][0], x_pp + self.boxes[j][0]) - max(x, x_pp)) * \
-                                                    (min(y + self.boxes[i][1], y_pp + self.boxes[j][1]) - max(y, y_pp)) * \
-                                                    self.a[x_pp, y_pp, z-self.boxes[j][2], j, l, u, v]
-                                                    for j in self.boxID if z - self.boxes[j][2] >= 0 and z - self.boxes[j][2] in self.zpos
-                                                    for l in self.nodes[1:]
-                                                    for u in self.nodes[:-1] if u >= t
-                                                    for x_pp in self.xpos_lst[j-1] if x - self.boxes[j][0] + 1 <= x_pp <= x + self.boxes[j][0] - 1
-                                                    for y_pp in self.ypos_lst[j-1] if y - self.boxes[j][1] + 1 <= y_pp <= y + self.boxes[j][1] - 1
-                                        )
-                                        >=
-                                        self.boxes[i][0] * self.boxes[i][1] * self.a[x, y, z, i, k, t, v]
-                                    )
+                        for p, ((x, y, z, _), supporting) in enumerate(supported):
+                            if (t, v, p) not in area:
+                                area[t, v, p] = self.supported_area(t, v, supporting)
+                            self.model.addConstr(area[t, v, p] >= self.boxes[i][0] * self.boxes[i][1] *
+                                                 self.a[x, y, z, i, k, t, v])
+
+    def supported_area(self, t, v, supporting):
+        '''
+        Area of the bottom face of a box in vehicle v at stage t covered by the given supporting placements with their
+        overlap area, counting boxes delivered at stage t or later
+        '''
+        return gp.quicksum(area * self.a[x_pp, y_pp, z_pp, j, l, u, v]
+                           for (x_pp, y_pp, z_pp, j), area in supporting
+                           for l in self.box_customers[j]
+                           for u in self.stages[:-1] if u >= t)
+
+    def support_row(self, x, y, z, i, k, t, v, supporting):
+        '''
+        Row of constraint thirteen for box i of customer k at (x, y, z) in vehicle v at stage t, given the placements
+        that can support it with their overlap area
+        '''
+        return self.supported_area(t, v, supporting) >= self.boxes[i][0] * self.boxes[i][1] * self.a[x, y, z, i, k, t, v]
 
     def constraintFourteen(self):
         '''
         Constraint fourteen presented in paper, multidrop situation constraint 1
         '''
         for i in self.boxID:
-            for k in self.nodes[1:]:
+            for k in self.box_customers[i]:
                 for v in self.vehicles:
-                    for x in self.xpos_lst[i-1]:
-                        for y in self.ypos_lst[i-1]:
-                            for z in self.zpos_lst[i-1]:
-                                self.model.addConstr(
-                                    (x + self.boxes[i][0]) * \
-                                    gp.quicksum(self.a[x, y, z, i, k, t, v] for t in self.stages[:-1])
-                                    <=
-                                    self.l_p[k, v]
-                                )
+                    for x, y, z in self.placements[i]:
+                        self.model.addConstr(
+                            (x + self.boxes[i][0]) * \
+                            gp.quicksum(self.a[x, y, z, i, k, t, v] for t in self.stages[:-1])
+                            <=
+                            self.l_p[k, v]
+                        )
 
 
     def constraintFifteen(self):
@@ -304,30 +631,54 @@ class CVRP():
         '''
         for i in self.boxID:
             for v in self.vehicles:
-                for k in self.nodes[1:]:
+                for k in self.box_customers[i]:
+                    reach = self.maximum_reach[i-1][k-2] # i starts at 1, k at 2 but are indexed at 0.
                     for l in self.nodes[1:]:
-                        for x in self.xpos_lst[i-1]:
-                            for y in self.ypos_lst[i-1]:
-                                for z in self.zpos_lst[i-1]:
-                                    self.model.addConstr(
-                                        self.l_p[l, v] - self.maximum_reach[i-1][k-2] # i starts at 1, k at 2 but are indexed at 0.
-                                        <=
-                                        x * gp.quicksum(self.a[x, y, z, i, k, t, v] for t in self.stages[:-1]) + \
-                                        (1 - gp.quicksum(self.a[x, y, z, i, k, t, v] for t in self.stages[:-1])) * self.M1 + \
-                                        (1 - gp.quicksum(self.d[k, l, v, t] for t in self.stages[:-1])) * self.M2
-                                    )
+                        for x, y, z in self.placements[i]:
+                            loaded = gp.quicksum(self.a[x, y, z, i, k, t, v] for t in self.stages[:-1])
+                            M1, M2 = self.multidrop_m(reach, x)
+                            if self.big_m == "indicator":
+                                for t in self.stages[:-1]:
+                                    if (k, l, v, t) in self.d:
+                                        self.model.addConstr((self.d[k, l, v, t] == 1) >>
+                                                             (self.l_p[l, v] - reach <= x * loaded + (1 - loaded) * M1))
+                                continue
+
+                            self.model.addConstr(
+                                self.l_p[l, v] - reach
+                                <=
+                                x * loaded + \
+                                (1 - loaded) * M1 + \
+                                (1 - gp.quicksum(self.d.get((k, l, v, t), 0) for t in self.stages[:-1])) * M2
+                            )
+
+    def multidrop_m(self, reach, x):
+        '''
+        Big-M values (M1, M2) of the row of constraint fifteen for a box at x with the given maximum reach
+        '''
+        if self.big_m == "global":
+            return self.M1, self.M2
+        M1, M2 = multidrop_big_m(self.dimensions["length"], reach, x)
+        return float(M1), float(M2)
+
     def constraintSixteen(self):
         '''
         Constraint Sixteen presented in paper, multidrop situation constraint 3
         '''
         for k in self.nodes[1:]:
             for l in self.nodes[1:]:
-                for v in vehicles:
+                for v in self.vehicles:
+                    if self.big_m == "indicator":
+                        for t in self.stages[:-1]:
+                            if (k, l, v, t) in self.d:
+                                self.model.addConstr((self.d[k, l, v, t] == 1) >> (self.l_p[l, v] <= self.l_p[k, v]))
+                        continue
+
                     self.model.addConstr(
                         self.l_p[l, v]
                         <=
                         self.l_p[k, v] +
-                        (1 - gp.quicksum(self.d[k, l, v, t] for t in self.stages[:-1])) * self.M3
+                        (1 - gp.quicksum(self.d.get((k, l, v, t), 0) for t in self.stages[:-1])) * self.M3
                     )
 
 
@@ -336,7 +687,7 @@ class CVRP():
         Constraint Seventeen presented in paper, multidrop situation constraint 4
         '''
         for k in self.nodes[1:]:
-            for v in vehicles:
+            for v in self.vehicles:
                 self.model.addConstr(
                     self.l_p[k, v]
                     <=
@@ -347,29 +698,58 @@ class CVRP():
         '''
         Constraint Eighteen presented in paper, load-bearing strength, ensures boxes are not damaged by pressure
         '''
-        for x_p in self.xpos:
-            for y_p in self.ypos:
-                for z_p in self.zpos:
-                    for v in vehicles:
-                        self.model.addConstr(
-                            gp.quicksum((self.p[j-1] / (self.boxes[j][0] * self.boxes[j][1])) * self.a[x_pp, y_pp, z_pp, j, l, u, v]
-                                        for j in self.boxID
-                                        for l in self.nodes[1:]
-                                        for u in self.nodes[:-1]
-                                        for x_pp in self.xpos_lst[j-1] if x_p - self.boxes[j][0] + 1 <= x_pp <= x_p
-                                        for y_pp in self.ypos_lst[j-1] if y_p - self.boxes[j][1] + 1 <= y_pp <= y_p
-                                        for z_pp in self.zpos_lst[j-1] if z_p + 1 <= z_pp <= self.dimensions["height"] - self.boxes[j][2]
-                            )
-                            <=
-                            gp.quicksum(self.sigma[i-1] * self.a[x, y, z, i, k, t, v]
-                                        for i in self.boxID
-                                        for k in self.nodes[1:]
-                                        for t in self.stages[:-1]
-                                        for x in self.xpos_lst[i-1] if x_p - self.boxes[i][0] + 1 <= x <= x_p
-                                        for y in self.ypos_lst[i-1] if y_p - self.boxes[i][1] + 1 <= y <= y_p
-                                        for z in self.zpos_lst[i-1] if z_p - self.boxes[i][2] + 1 <= z <= z_p
-                            )
-                        )
+        for cell in range(self.coverage.shape[0]):
+            above = self.indexed(self.coverage_above, cell)
+            covering = self.indexed(self.coverage, cell)
+            for v in self.vehicles:
+                self.model.addConstr(
+                    gp.quicksum((self.p[j-1] / (self.boxes[j][0] * self.boxes[j][1])) * self.a[x_pp, y_pp, z_pp, j, l, u, v]
+                                for x_pp, y_pp, z_pp, j in above
+                                for l in self.box_customers[j]
+                                for u in self.stages[:-1]
+                    )
+                    <=
+                    gp.quicksum(self.sigma[i-1] * self.a[x, y, z, i, k, t, v]
+                                for x, y, z, i in covering
+                                for k in self.box_customers[i]
+                                for t in self.stages[:-1]
+                    )
+                )
+
+    def symmetryVehicles(self):
+        '''
+        Symmetry breaking for the identical vehicles, the load volume is non-increasing in the vehicle order
+        '''
+        volume = {v: gp.quicksum(self.boxes[i][0] * self.boxes[i][1] * self.boxes[i][2] * self.demand[i][k] * self.d[k, l, v, t]
+                                 for t in self.stages[1:]
+                                 for k in self.nodes[1:]
+                                 for l in self.successors[k]
+                                 for i in self.boxID)
+                  for v in self.vehicles}
+
+        for v, w in zip(self.vehicles, self.vehicles[1:]):
+            self.model.addConstr(volume[v] >= volume[w], name="S|VehicleOrder")
+
+    def symmetryMirror(self):
+        '''
+        Symmetry breaking for the mirror image of a loading in the width of the vehicle, the centre of the loaded volume
+        lies in the left half. Only added when the positions of every box are symmetric, otherwise the mirror image
+        of a loading can be off the grid.
+        '''
+        width = self.dimensions["width"]
+        for i in self.boxID:
+            if {width - self.boxes[i][1] - y for y in self.ypos_lst[i-1]} != set(self.ypos_lst[i-1]):
+                return
+
+        for v in self.vehicles:
+            self.model.addConstr(
+                gp.quicksum(self.boxes[i][0] * self.boxes[i][1] * self.boxes[i][2] * (2 * y + self.boxes[i][1] - width) *
+                            self.a[x, y, z, i, k, t, v]
+                            for x, y, z, i, k in self.loading_index
+                            for t in self.stages[:-1])
+                <= 0,
+                name="S|Mirror"
+            )
 
 
 if __name__ == "__main__":
@@ -471,19 +851,18 @@ if __name__ == "__main__":
                   3: [],
                   4: []}
 
-    # Print out taken routes by vehicles
+    # Print out taken routes by vehicles, the solution is read in one call
     if problem.model.status == GRB.OPTIMAL:
+        solution = problem.solution()
         print("\nActive decision variables (d[i,j,v,t] = 1):")
-        for i, j, v, t in problem.d.keys():
-            if problem.d[i, j, v, t].X > 0.5:  # X gives the value after optimization
-                print(f"Vehicle {v} travels from node {i} to {j} at stage {t} | {links[i, j]}")
-        for x, y, z, i, k, t, v in problem.a.keys():
-            if problem.a[x, y, z, i, k, t, v].X > 0.5:
-                if v == 0:
-                    used_boxes1[i].append([x, y, z])
-                if v == 1:
-                    used_boxes2[i].append([x, y, z])
-                print(f"Box of type {i} in vehicle {v} for customer {k} is at xyz: [{x},{y},{z}] at stage {t}")
+        for v, t, i, j in solution.arcs:
+            print(f"Vehicle {v} travels from node {i} to {j} at stage {t} | {links[i, j]}")
+        for v, t, k, i, x, y, z in solution.placements:
+            if v == 0:
+                used_boxes1[i].append([x, y, z])
+            if v == 1:
+                used_boxes2[i].append([x, y, z])
+            print(f"Box of type {i} in vehicle {v} for customer {k} is at xyz: [{x},{y},{z}] at stage {t}")
 
     # Call the function
     plot_boxes_3d(used_boxes1, boxes, dimensions)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+import gurobipy as gp
+from gurobipy import GRB
+
+# Bumped whenever the built model changes for the same inputs, so stale cache entries are never reloaded
+FORMAT = 7
+
+class ModelCache():
+    '''
+    Content-addressed store of built CVRP models. A model is hashed by every input of CVRP that shapes it and is
+    written as compressed MPS next to a JSON index holding the keys of d, a and l_p, the constraint names and the rows
+    of every constraint group, so a later construction with the same inputs reads the file and rebinds its variables
+    and groups instead of rebuilding.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(cvrp):
+        '''
+        Hash of the inputs of a CVRP instance, the builder is left out as both builders add the same rows. The class
+        is included since subclasses such as the routing master build different models from the same inputs.
+        '''
+        inputs = {"format": FORMAT,
+                  "class": type(cvrp).__name__,
+                  "nodes": cvrp.nodes,
+                  "distance": cvrp.distance.tolist(),
+                  "vehicles": cvrp.vehicles,
+                  "dimensions": cvrp.dimensions,
+                  "scale": cvrp.scale.tolist(),
+                  "boxes": sorted([i, list(dims)] for i, dims in cvrp.boxes.items()),
+                  "demand": sorted([i, sorted(demand.items())] for i, demand in cvrp.demand.items()),
+                  "maximum_reach": cvrp.maximum_reach,
+                  "p": cvrp.p,
+                  "sigma": cvrp.sigma,
+                  "constraints": cvrp.constraints,
+                  "big_m": cvrp.big_m,
+                  "stages": cvrp.stages,
+                  "arcs": cvrp.arcs}
+        text = json.dumps(inputs, sort_keys=True, default=lambda value: value.item())
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _paths(self, key):
+        '''
+        Model and index file of a key
+        '''
+        return os.path.join(self.directory, f"{key}.mps.gz"), os.path.join(self.directory, f"{key}.json")
+
+    def load(self, cvrp):
+        '''
+        Replaces the model of cvrp by its cached copy and rebinds d, a, l_p and the constraint groups. Returns False
+        when nothing is cached.
+        '''
+        model_path, index_path = self._paths(self.key(cvrp))
+        if not (os.path.exists(model_path) and os.path.exists(index_path)):
+            return False
+
+        with open(index_path) as file:
+            index = json.load(file)
+
+        model = gp.read(model_path)
+        model.ModelName = cvrp.model.ModelName
+        model.setAttr(GRB.Attr.ConstrName, model.getConstrs(), index["constraints"])
+
+        # Variables are read back in the order they were written, every family is a contiguous block of columns
+        columns = model.getVars()
+        start = 0
+        for family in ("d", "a", "l_p"):
+            keys = [tuple(key) for key in index[family]]
+            setattr(cvrp, family, gp.tupledict(zip(keys, columns[start:start + len(keys)])))
+            start += len(keys)
+
+        rows, general = model.getConstrs(), model.getGenConstrs()
+        cvrp.groups = {key: rows[start:start + count] for key, (start, count) in index["groups"].items()}
+        for key, (start, count) in index["general"].items():
+            cvrp.groups[key] = cvrp.groups[key] + general[start:start + count]
+
+        cvrp.model.dispose()
+        cvrp.model = model
+        return True
+
+    def store(self, cvrp):
+        '''
+        Writes the built model of cvrp with its variable and constraint index
+        '''
+        key = self.key(cvrp)
+        model_path, index_path = self._paths(key)
+        model = cvrp.model
+        model.update()
+
+        index = {family: [list(key) for key in getattr(cvrp, family).keys()] for family in ("d", "a", "l_p")}
+        index["constraints"] = model.getAttr(GRB.Attr.ConstrName, model.getConstrs())
+        index["groups"] = {}
+        index["general"] = {}
+        start = 0
+        for group, rows in cvrp.groups.items():
+            # Indicator constraints have no index, groups are built one after another so they follow in group order
+            general = [row for row in rows if isinstance(row, gp.GenConstr)]
+            rows = [row for row in rows if not isinstance(row, gp.GenConstr)]
+            index["groups"][group] = [rows[0].index if rows else 0, len(rows)]
+            index["general"][group] = [start, len(general)]
+            start += len(general)
+
+        # Written under a temporary name first so a concurrent reader never sees a partial file. Constraint names
+        # are repeated within a family, MPS gets default names and the index restores them, so the warning is muted
+        partial = f"{key}.{os.getpid()}"
+        output = model.Params.OutputFlag
+        model.Params.OutputFlag = 0
+        try:
+            model.write(os.path.join(self.directory, f"{partial}.mps.gz"))
+        finally:
+            model.Params.OutputFlag = output
+        with open(os.path.join(self.directory, f"{partial}.json"), "w") as file:
+            json.dump(index, file)
+
+        os.replace(os.path.join(self.directory, f"{partial}.json"), index_path)
+        os.replace(os.path.join(self.directory, f"{partial}.mps.gz"), model_path)
@@ -0,0 +1,125 @@
+import numpy as np
+
+class ExtremePointPacker():
+    '''
+    Extreme-point packer loading the boxes of one vehicle route. Customers are loaded in reverse visiting order,
+    each in its own slab behind the door so the multidrop constraints hold, and every box goes to the
+    back-bottom-left extreme point where it fits. Placements respect the grid positions of the model, the bottom face
+    support of constraint 13 and the load-bearing strength of constraint 18.
+    '''
+    def __init__(self, boxes, dimensions, positions, p=None, sigma=None):
+        self.boxes = boxes
+        self.dimensions = dimensions
+        self.size = np.array([dimensions["length"], dimensions["width"], dimensions["height"]])
+
+        # Grid positions (xpos, ypos, zpos) of the model, placements are restricted to these
+        self.grid = [np.asarray(sorted(axis)) for axis in positions]
+        self.on_grid = [set(axis) for axis in positions]
+
+        # Index of the first grid position at or after, and past, every coordinate along every axis
+        self.first = [np.searchsorted(grid, np.arange(size + 1), "left") for grid, size in zip(self.grid, self.size)]
+        self.past = [np.searchsorted(grid, np.arange(size + 1), "right") for grid, size in zip(self.grid, self.size)]
+
+        # Weight per unit area and strength per box type, the load-bearing check is skipped without them
+        self.pressure = None
+        if p is not None and sigma is not None:
+            self.pressure = {i: p[i-1] / (boxes[i][0] * boxes[i][1]) for i in boxes}
+            self.strength = {i: sigma[i-1] for i in boxes}
+
+    def _cells(self, lo, hi, axis):
+        '''
+        Index range of the grid positions in [lo, hi] along an axis
+        '''
+        return self.first[axis][lo], self.past[axis][hi]
+
+    def _fits(self, point, i, lo, hi, pressure, strength):
+        '''
+        Checks whether box i can be placed at point, given the lower and upper corners of the boxes placed so far and
+        the pressure and strength of every grid cell
+        '''
+        dims = np.asarray(self.boxes[i])
+        point = np.asarray(point)
+        top = point + dims
+        if (top > self.size).any() or any(point[axis] not in self.on_grid[axis] for axis in range(3)):
+            return False
+
+        # No overlap with any placed box
+        if ((point < hi) & (lo < top)).all(axis=1).any():
+            return False
+
+        # Bottom face supported by boxes ending at height z, with the overlap areas used by constraint 13
+        if point[2] > 0:
+            below = (hi[:, 2] == point[2]) & (lo[:, :2] < top[:2]).all(axis=1) & (point[:2] < hi[:, :2]).all(axis=1)
+            overlap = np.maximum(np.minimum(top[:2], hi[below, :2]) - np.maximum(point[:2], lo[below, :2]), 0).prod(axis=1)
+            if overlap.sum() < dims[0] * dims[1]:
+                return False
+
+        # Pressure on every cell underneath the box stays within the strength of the boxes covering it
+        if self.pressure is not None and point[2] > 0:
+            x0, x1 = self._cells(point[0], top[0] - 1, 0)
+            y0, y1 = self._cells(point[1], top[1] - 1, 1)
+            z1 = self.first[2][point[2]]
+            column = (slice(x0, x1), slice(y0, y1), slice(0, z1))
+            if (pressure[column] + self.pressure[i] > strength[column]).any():
+                return False
+
+        return True
+
+    def pack(self, route, demand):
+        '''
+        Loads the boxes demanded by the customers of a route, visited in the given order. Returns the placements as
+        (x, y, z, i, k) tuples, or None when the packer cannot load every box.
+        '''
+        lo = np.empty((0, 3), dtype=np.int64)
+        hi = np.empty((0, 3), dtype=np.int64)
+        pressure = np.zeros(tuple(len(axis) for axis in self.grid))
+        strength = np.zeros(pressure.shape)
+
+        placements = []
+        slab = 0
+        for k in reversed(route):
+            # Largest boxes first, every customer starts a new slab in front of the customers delivered later
+            items = sorted((i for i in self.boxes for _ in range(demand[i].get(k, 0))),
+                           key=lambda i: -self.boxes[i][0] * self.boxes[i][1] * self.boxes[i][2])
+            points = {(slab, 0, 0)}
+            front = slab
+
+            for i in items:
+                for point in sorted(points, key=lambda point: (point[0], point[2], point[1])):
+                    if self._fits(point, i, lo, hi, pressure, strength):
+                        break
+                else:
+                    return None
+
+                x, y, z = point
+                top = np.asarray(point) + self.boxes[i]
+                lo = np.vstack([lo, point])
+                hi = np.vstack([hi, top])
+                placements.append((x, y, z, i, k))
+                front = max(front, int(top[0]))
+
+                # New extreme points in front of, next to and on top of the box
+                points.discard(point)
+                points |= {(int(top[0]), y, z), (x, int(top[1]), z), (x, y, int(top[2]))}
+
+                if self.pressure is not None:
+                    x0, x1 = self._cells(x, top[0] - 1, 0)
+                    y0, y1 = self._cells(y, top[1] - 1, 1)
+                    z0, z1 = self._cells(z, top[2] - 1, 2)
+                    strength[x0:x1, y0:y1, z0:z1] += self.strength[i]
+                    pressure[x0:x1, y0:y1, :z0] += self.pressure[i]
+
+            slab = front
+
+        return placements
+
+    def slab(self, k, demand):
+        '''
+        Length along the vehicle of the slab the boxes of customer k take on an empty vehicle, or infinity when they
+        cannot be loaded. Every customer of a route gets its own slab, so a route whose slabs add up to more than the
+        vehicle length cannot be loaded by pack.
+        '''
+        placements = self.pack([k], demand)
+        if placements is None:
+            return np.inf
+        return max((x + self.boxes[i][0] for x, _, _, i, _ in placements), default=0)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import sqlite3
+from collections import OrderedDict
+
+def packing_key(route, demand, boxes, dimensions, maximum_reach, p, sigma, rules=()):
+    '''
+    Instance independent key of the packing problem of a route. Every customer, in visiting order, is described by
+    the multiset of its boxes as (length, width, height, count, reach, weight, strength) so routes of different
+    instances with the same loading problem share a key. The rules describe how a verdict was reached, e.g. the
+    active packing constraints and the exact flag, so runs with different rules never share verdicts. Returns the key
+    and, per customer, the box ids in key order.
+    '''
+    customers = []
+    box_ids = []
+    for k in route:
+        items = sorted((tuple(boxes[i]) + (demand[i][k], maximum_reach[i-1][k-2], p[i-1], sigma[i-1]), i)
+                       for i in boxes if demand[i].get(k, 0) > 0)
+        customers.append(tuple(item for item, _ in items))
+        box_ids.append([i for _, i in items])
+
+    vehicle = (dimensions["length"], dimensions["width"], dimensions["height"])
+    return (vehicle, tuple(customers), rules), box_ids
+
+
+class PackingCache():
+    '''
+    LRU cache of packing verdicts keyed by packing_key. A verdict is the witness placement of a feasible route or
+    None for a route that cannot be loaded. With a path, verdicts are also written to an SQLite file so later runs
+    find them; entries evicted from memory are read back from disk on their next lookup.
+    '''
+    def __init__(self, capacity=4096, path=None):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, witness TEXT)")
+            self.connection.commit()
+
+    @staticmethod
+    def _digest(key):
+        '''
+        Stable text digest of a key, used as primary key on disk
+        '''
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+    def _remember(self, digest, witness):
+        '''
+        Stores a verdict in memory as most recently used and evicts the least recently used entries over capacity
+        '''
+        self.entries[digest] = witness
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def lookup(self, key):
+        '''
+        Returns (found, witness) for a key, the witness is a list of (x, y, z, s, j) placements of the j-th box
+        type of the s-th customer in the key, or None for an infeasible route
+        '''
+        digest = self._digest(key)
+        if digest in self.entries:
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return True, self.entries[digest]
+
+        if self.connection is not None:
+            row = self.connection.execute("SELECT witness FROM verdicts WHERE key = ?", (digest,)).fetchone()
+            if row is not None:
+                witness = json.loads(row[0])
+                witness = None if witness is None else [tuple(placement) for placement in witness]
+                self._remember(digest, witness)
+                self.hits += 1
+                return True, witness
+
+        self.misses += 1
+        return False, None
+
+    def store(self, key, witness):
+        '''
+        Stores the verdict of a key, see lookup for the witness format
+        '''
+        digest = self._digest(key)
+        self._remember(digest, witness)
+        if self.connection is not None:
+            self.connection.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?)", (digest, json.dumps(witness)))
+            self.connection.commit()
+
+    def get(self, route, demand, boxes, dimensions, maximum_reach, p, sigma, rules=()):
+        '''
+        Looks up the verdict of a route of an instance under the given rules. Returns (found, placements) with
+        placements as (x, y, z, i, k) tuples, or None for a route that cannot be loaded
+        '''
+        key, box_ids = packing_key(route, demand, boxes, dimensions, maximum_reach, p, sigma, rules)
+        found, witness = self.lookup(key)
+        if witness is None:
+            return found, None
+        return found, [(x, y, z, box_ids[s][j], route[s]) for x, y, z, s, j in witness]
+
+    def put(self, route, demand, boxes, dimensions, maximum_reach, p, sigma, placements, rules=()):
+        '''
+        Stores the verdict of a route of an instance under the given rules, placements as (x, y, z, i, k) tuples or
+        None
+        '''
+        key, box_ids = packing_key(route, demand, boxes, dimensions, maximum_reach, p, sigma, rules)
+        witness = None
+        if placements is not None:
+            position = {k: s for s, k in enumerate(route)}
+            witness = [(int(x), int(y), int(z), position[k], box_ids[position[k]].index(i))
+                       for x, y, z, i, k in placements]
+        self.store(key, witness)
+
+    def close(self):
+        '''
+        Closes the on-disk store
+        '''
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,76 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class BuildProfiler():
+    '''
+    Records the wall time, peak Python memory and the rows, columns and nonzeros added by every build phase of a
+    CVRP model. A disabled profiler runs the phases untouched, an enabled one updates the model after each phase to
+    count its size, so it is opt-in.
+    '''
+    def __init__(self, model, enabled=True):
+        self.model = model
+        self.enabled = enabled
+        self.phases = []
+
+    def _size(self):
+        '''
+        Current size of the model, pending modifications are processed first
+        '''
+        self.model.update()
+        return {"rows": self.model.NumConstrs,
+                "general_constraints": self.model.NumGenConstrs,
+                "columns": self.model.NumVars,
+                "nonzeros": self.model.NumNZs}
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        Context manager measuring a single build phase, e.g. one constraint method
+        '''
+        if not self.enabled:
+            yield
+            return
+
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+
+        before = self._size()
+        memory_start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            after = self._size()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] - memory_start
+            if not tracing:
+                tracemalloc.stop()
+
+            record = {"phase": name, "time": elapsed, "peak_memory": peak}
+            record.update({key: after[key] - before[key] for key in after})
+            self.phases.append(record)
+
+    def report(self):
+        '''
+        Returns the recorded phases and their totals as a dictionary
+        '''
+        totals = {"time": sum(phase["time"] for phase in self.phases),
+                  "peak_memory": max((phase["peak_memory"] for phase in self.phases), default=0)}
+        for key in ("rows", "general_constraints", "columns", "nonzeros"):
+            totals[key] = sum(phase[key] for phase in self.phases)
+
+        return {"model": self.model.ModelName, "phases": list(self.phases), "total": totals}
+
+    def to_json(self, path=None, indent=2):
+        '''
+        Returns the report as a JSON string and writes it to path if one is given
+        '''
+        text = json.dumps(self.report(), indent=indent)
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(text)
+        return text
@@ -0,0 +1,100 @@
+import os
+import numpy as np
+from matplotlib.figure import Figure
+from mpl_toolkits.mplot3d.art3d import Poly3DCollection
+
+# Corners of the unit cube and the corner indices of its six faces: bottom, top, two sides, front and back
+CORNERS = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0],
+                    [0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]])
+FACES = np.array([[0, 1, 2, 3], [4, 5, 6, 7], [0, 1, 5, 4], [2, 3, 7, 6], [1, 2, 6, 5], [4, 7, 3, 0]])
+
+# Colors per box type, cycled when there are more box types
+COLORS = ["red", "green", "blue", "cyan", "magenta", "orange", "yellow"]
+
+def box_faces(origins, sizes):
+    '''
+    Vertices of the six faces of every box as an array of shape (n_boxes * 6, 4, 3), from the (x, y, z) origins and
+    (length, width, height) sizes of the boxes
+    '''
+    origins = np.asarray(origins, dtype=float).reshape(-1, 1, 1, 3)
+    sizes = np.asarray(sizes, dtype=float).reshape(-1, 1, 1, 3)
+    return (origins + CORNERS[FACES][None] * sizes).reshape(-1, 4, 3)
+
+class LoadRenderer():
+    '''
+    Headless renderer of vehicle load plans. Every image is drawn on one reused figure without pyplot, with all
+    boxes of a vehicle in a single collection, and written to PNG, SVG or any other format matplotlib can save.
+    '''
+    def __init__(self, boxes, dimensions, figsize=(8, 6), dpi=100, alpha=0.35):
+        self.boxes = boxes
+        self.dimensions = dimensions
+        self.dpi = dpi
+        self.alpha = alpha
+
+        # The axes are set up once, every drawing only swaps the box collection. Fixed ticks without a grid keep the
+        # axis layout, which dominates the drawing time of a 3D plot, cheap
+        self.figure = Figure(figsize=figsize)
+        ax = self.axes = self.figure.add_subplot(111, projection="3d")
+        for axis, label, key in ((ax.xaxis, "Length", "length"), (ax.yaxis, "Width", "width"),
+                                 (ax.zaxis, "Height", "height")):
+            axis.set_ticks([0, dimensions[key]])
+            axis.set_label_text(label)
+        ax.set_xlim(0, dimensions["length"])
+        ax.set_ylim(0, dimensions["width"])
+        ax.set_zlim(0, dimensions["height"])
+        ax.grid(False)
+        self.collection = None
+
+        # Box sizes and face colors indexed by box id
+        size = max(boxes) + 1
+        self.sizes = np.zeros((size, 3))
+        self.colors = np.empty(size, dtype=object)
+        for idx, i in enumerate(boxes):
+            self.sizes[i] = boxes[i]
+            self.colors[i] = COLORS[idx % len(COLORS)]
+
+    def draw(self, loading, title=""):
+        '''
+        Draws one loading, given as rows (box, x, y, z, ...) such as Solution.loading returns
+        '''
+        loading = np.asarray(loading, dtype=np.int64)
+        if self.collection is not None:
+            self.collection.remove()
+            self.collection = None
+
+        if len(loading):
+            faces = box_faces(loading[:, 1:4], self.sizes[loading[:, 0]])
+            self.collection = Poly3DCollection(faces, alpha=self.alpha, edgecolor="black")
+            self.collection.set_facecolor(np.repeat(self.colors[loading[:, 0]], 6).tolist())
+            self.axes.add_collection3d(self.collection)
+
+        self.axes.set_title(title)
+
+    def save(self, path):
+        '''
+        Writes the current drawing, the format follows from the file extension
+        '''
+        # Fast zlib compression, PNG encoding otherwise takes longer than drawing
+        options = {"pil_kwargs": {"compress_level": 1}} if path.endswith(".png") else {}
+        self.figure.savefig(path, dpi=self.dpi, **options)
+        return path
+
+    def render(self, solution, directory, fmt="png", stages=False):
+        '''
+        Renders the load plan of every used vehicle of a Solution to directory, named vehicle_<v>.<fmt>. With stages
+        every vehicle also gets one frame per visited customer, vehicle_<v>_stage_<t>.<fmt>, showing the boxes still
+        on board after that customer is served. Returns the written paths.
+        '''
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for v in np.unique(solution.placements[:, 0]):
+            loading = solution.loading(v)
+            self.draw(loading, f"Vehicle {v}")
+            paths.append(self.save(os.path.join(directory, f"vehicle_{v}.{fmt}")))
+
+            if stages:
+                # Boxes of the customer visited at stage t leave the vehicle at stage t
+                for t in np.unique(loading[:, 5]):
+                    self.draw(loading[loading[:, 5] > t], f"Vehicle {v} after stage {t}")
+                    paths.append(self.save(os.path.join(directory, f"vehicle_{v}_stage_{t}.{fmt}")))
+        return paths
@@ -0,0 +1,82 @@
+import json
+import numpy as np
+
+# Columns of the arrays held by a Solution
+ARC_COLUMNS = ("vehicle", "stage", "from", "to")
+PLACEMENT_COLUMNS = ("vehicle", "stage", "customer", "box", "x", "y", "z")
+
+class Solution():
+    '''
+    Compact solution of a CVRP model. arcs holds one row (vehicle, stage, from, to) per travelled link and placements
+    one row (vehicle, stage, customer, box, x, y, z) per loaded box, both as integer NumPy arrays sorted by vehicle
+    and stage. front holds L'_{kv} per (customer, vehicle) for the served customers.
+    '''
+    def __init__(self, objective, status, depot, arcs, placements, front=None):
+        self.objective = objective
+        self.status = status
+        self.depot = depot
+        self.arcs = np.asarray(arcs, dtype=np.int64).reshape(-1, len(ARC_COLUMNS))
+        self.placements = np.asarray(placements, dtype=np.int64).reshape(-1, len(PLACEMENT_COLUMNS))
+        self.front = {} if front is None else front
+
+        self.arcs = self.arcs[np.lexsort(self.arcs[:, 1::-1].T)]
+        self.placements = self.placements[np.lexsort(self.placements[:, 1::-1].T)]
+
+    def routes(self):
+        '''
+        Customers of every used vehicle in visiting order
+        '''
+        routes = {}
+        for v, _, _, l in self.arcs:
+            if l != self.depot:
+                routes.setdefault(int(v), []).append(int(l))
+        return routes
+
+    def loading(self, v):
+        '''
+        Placements of vehicle v as (box, x, y, z, customer, stage) rows
+        '''
+        rows = self.placements[self.placements[:, 0] == v]
+        return rows[:, [3, 4, 5, 6, 2, 1]]
+
+    def to_dict(self):
+        '''
+        Plain dictionary of the solution with the arrays as lists of rows
+        '''
+        return {"objective": self.objective,
+                "status": self.status,
+                "depot": self.depot,
+                "arc_columns": list(ARC_COLUMNS),
+                "arcs": self.arcs.tolist(),
+                "placement_columns": list(PLACEMENT_COLUMNS),
+                "placements": self.placements.tolist(),
+                "front": [[k, v, value] for (k, v), value in sorted(self.front.items())]}
+
+    def to_json(self, path=None, indent=None):
+        '''
+        Returns the solution as a JSON string and writes it to path if one is given
+        '''
+        text = json.dumps(self.to_dict(), indent=indent)
+        if path is not None:
+            with open(path, "w") as file:
+                file.write(text)
+        return text
+
+    def to_npz(self, path):
+        '''
+        Writes the solution arrays to a compressed NumPy archive
+        '''
+        front = np.array([[k, v, value] for (k, v), value in sorted(self.front.items())], dtype=float).reshape(-1, 3)
+        np.savez_compressed(path, objective=np.float64(np.nan if self.objective is None else self.objective),
+                            status=np.int64(self.status), depot=np.int64(self.depot), arcs=self.arcs,
+                            placements=self.placements, front=front)
+
+    @classmethod
+    def from_npz(cls, path):
+        '''
+        Reads a solution written by to_npz
+        '''
+        with np.load(path) as data:
+            objective = None if np.isnan(data["objective"]) else float(data["objective"])
+            front = {(int(k), int(v)): float(value) for k, v, value in data["front"]}
+            return cls(objective, int(data["status"]), int(data["depot"]), data["arcs"], data["placements"], front)
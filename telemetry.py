@@ -0,0 +1,111 @@
+import csv
+import json
+import queue
+import threading
+from gurobipy import GRB
+
+# Columns of every record, build records leave the solve columns empty and the other way around
+FIELDS = ("model", "event", "phase", "time", "rows", "columns", "nonzeros", "runtime", "objective", "bound", "gap",
+          "nodes", "status")
+
+class SolveTelemetry():
+    '''
+    Stream of build and solve records of CVRP models, written as JSON lines or, for a path ending in .csv, as CSV.
+    The Gurobi callback only samples the incumbent, best bound, gap, node count and elapsed time every interval
+    seconds and on every new incumbent, and queues the record; a background thread does the formatting and writing,
+    so the solve is not slowed down by file output. One stream can record several models, every record names its model.
+    '''
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.records = queue.Queue()
+        self.last = {}
+
+        self.file = open(path, "w", newline="")
+        if path.endswith(".csv"):
+            writer = csv.DictWriter(self.file, FIELDS)
+            writer.writeheader()
+            self.write = writer.writerow
+        else:
+            self.write = lambda record: self.file.write(json.dumps(record) + "\n")
+
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        '''
+        Writes queued records until close queues None. The file is flushed whenever the queue runs empty, so it can be
+        followed during a long solve
+        '''
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            self.write(record)
+            if self.records.empty():
+                self.file.flush()
+
+    def build(self, cvrp):
+        '''
+        Queues the build time of a CVRP model and, if it was built with profile enabled, the time and size of every
+        build phase. Called before every solve, so the progress sampling of the model starts over
+        '''
+        name = cvrp.model.ModelName
+        self.last.pop(name, None)
+        for phase in cvrp.profiler.phases:
+            self.records.put({"model": name, "event": "build", "phase": phase["phase"], "time": phase["time"],
+                              "rows": phase["rows"], "columns": phase["columns"], "nonzeros": phase["nonzeros"]})
+        self.records.put({"model": name, "event": "build", "phase": "total", "time": cvrp.build_time})
+
+    def _sample(self, name, event, runtime, objective, bound, nodes, status=None):
+        '''
+        Queues one solve record, an objective of GRB.INFINITY means no incumbent yet
+        '''
+        if objective is not None and abs(objective) >= GRB.INFINITY:
+            objective = None
+        gap = None
+        if objective is not None and bound is not None:
+            if bound == objective:
+                gap = 0.0
+            elif objective != 0:
+                gap = abs(bound - objective) / abs(objective)
+        record = {"model": name, "event": event, "runtime": runtime, "objective": objective, "bound": bound,
+                  "gap": gap, "nodes": int(nodes)}
+        if status is not None:
+            record["status"] = status
+        self.records.put(record)
+
+    def callback(self, model, where):
+        '''
+        Gurobi callback sampling the progress of the branch-and-bound every interval seconds and on new incumbents
+        '''
+        if where == GRB.Callback.MIP:
+            runtime = model.cbGet(GRB.Callback.RUNTIME)
+            if runtime - self.last.get(model.ModelName, -self.interval) < self.interval:
+                return
+            self.last[model.ModelName] = runtime
+            self._sample(model.ModelName, "progress", runtime, model.cbGet(GRB.Callback.MIP_OBJBST),
+                         model.cbGet(GRB.Callback.MIP_OBJBND), model.cbGet(GRB.Callback.MIP_NODCNT))
+
+        elif where == GRB.Callback.MIPSOL:
+            self._sample(model.ModelName, "incumbent", model.cbGet(GRB.Callback.RUNTIME),
+                         model.cbGet(GRB.Callback.MIPSOL_OBJ), model.cbGet(GRB.Callback.MIPSOL_OBJBND),
+                         model.cbGet(GRB.Callback.MIPSOL_NODCNT))
+
+    def final(self, model):
+        '''
+        Queues the outcome of a finished solve
+        '''
+        objective = model.ObjVal if model.SolCount > 0 else None
+        bound = model.ObjBound if model.IsMIP and model.Status != GRB.INFEASIBLE else None
+        self._sample(model.ModelName, "final", model.Runtime, objective, bound, model.NodeCount, model.Status)
+
+    def close(self):
+        '''
+        Writes the remaining records and closes the file
+        '''
+        if self.file.closed:
+            return
+        self.records.put(None)
+        self.thread.join()
+        self.file.close()
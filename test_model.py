@@ -1,10 +1,69 @@
+import itertools
+import json
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
 import numpy as np
 import gurobipy as gp
 from gurobipy import GRB
 
 from model import CVRP
-from helper import make_links
+from helper import constraintGenerator, distance_matrix, make_links, overlap_areas, prune_arcs, reachable_positions, \
+    stage_horizon
+from benchmark import generate_instance, run_case
+from batch import load_instance, run_batch, save_instance, summarize
+from decomposition import Decomposition
+from column_generation import ColumnGeneration
+from alns import ALNS
+from packing import ExtremePointPacker
+from packing_cache import PackingCache
+from model_cache import ModelCache
+from solution import Solution
+from render import LoadRenderer, box_faces
+from telemetry import SolveTelemetry
+from verify import SolutionVerifier
+
+
+def small_instance():
+    """
+    Small instance with two box types that builds quickly with every constraint active
+    """
+    np.random.seed(0)
+    nodes = [1, 2, 3]
+    boxes = {1: [2, 2, 2],
+             2: [4, 2, 2]}
+
+    return {
+        "nodes": nodes,
+        "links": make_links(nodes),
+        "vehicles": [0, 1],
+        "dimensions": {"length": 6, "width": 4, "height": 4},
+        "boxes": boxes,
+        "demand": {1: {2: 1, 3: 1},
+                   2: {2: 1, 3: 0}},
+        "maximum_reach": [[boxes[i][0] for k in nodes[1:]] for i in boxes.keys()],
+        "p": [boxes[i][0] * boxes[i][1] * boxes[i][2] for i in boxes.keys()],
+        "sigma": [20, 30]
+    }
+
+
+def model_rows(model):
+    """
+    Rows of a model as (sense, rhs, terms) with duplicate terms summed, sorted so models can be compared
+    """
+    model.update()
+    rows = []
+    for constr in model.getConstrs():
+        expr = model.getRow(constr)
+        terms = {}
+        for idx in range(expr.size()):
+            name = expr.getVar(idx).VarName
+            terms[name] = terms.get(name, 0.0) + expr.getCoeff(idx)
+        rows.append((constr.Sense, round(constr.RHS, 9),
+                     tuple(sorted((name, round(coeff, 9)) for name, coeff in terms.items() if coeff != 0))))
+    return sorted(rows)
 
 class TestCVRP(unittest.TestCase):
 
@@ -150,8 +209,805 @@ class TestCVRP(unittest.TestCase):
 
 
 
+class TestReachablePositions(unittest.TestCase):
+
+    def test_bounded_subset_sums(self):
+        cases = [([2, 4, 3, 6], [8, 8, 7, 6], 10), ([5, 7], [1, 2], 30), ([3], [0], 9), ([4], [2], -1)]
+        for sizes, counts, max_pos in cases:
+            with self.subTest(sizes=sizes, counts=counts, max_pos=max_pos):
+                expected = {sum(n * size for n, size in zip(combination, sizes))
+                            for combination in itertools.product(*(range(count + 1) for count in counts))}
+                expected = {position for position in expected if position <= max_pos} | {0}
+                self.assertEqual(reachable_positions(sizes, counts, max_pos), expected)
+
+
+class TestMatrixBuilder(unittest.TestCase):
+
+    def test_same_model_as_loop_builder(self):
+        instance = small_instance()
+        loop = CVRP("loop", **instance, constraints=constraintGenerator(range(1, 20)))
+        matrix = CVRP("matrix", **instance, constraints=constraintGenerator(range(1, 20)), builder="matrix")
+
+        self.assertEqual(model_rows(loop.model), model_rows(matrix.model))
+        self.assertEqual([var.Obj for var in loop.model.getVars()], [var.Obj for var in matrix.model.getVars()])
+
+    def test_invalid_builder(self):
+        with self.assertRaises(ValueError):
+            CVRP("invalid", **small_instance(), constraints=constraintGenerator([2]), builder="dense")
+
+
+class TestLeaveDepotOnce(unittest.TestCase):
+
+    def test_second_late_departure_is_infeasible(self):
+        for builder in ("loop", "matrix"):
+            with self.subTest(builder=builder):
+                problem = CVRP("depot", **small_instance(), constraints=constraintGenerator([2, 3, 4, 5]),
+                               builder=builder, trim_stages=False)
+                problem.model.setParam("OutputFlag", 0)
+
+                # Vehicle 0 serves customer 2, returns and leaves the depot again at stage 2 for customer 3
+                for arc in [(1, 2, 0, 1), (2, 1, 0, 2), (1, 3, 0, 2), (3, 1, 0, 3)]:
+                    problem.d[arc].LB = 1.0
+                problem.optimize()
+                self.assertEqual(problem.model.Status, GRB.INFEASIBLE)
+
+
+class TestLoadingIndex(unittest.TestCase):
+
+    def test_loading_variables_only_for_feasible_placements(self):
+        problem = CVRP("sparse", **small_instance(), constraints=constraintGenerator([2]))
+
+        self.assertEqual(len(problem.a), len(problem.loading_index) * len(problem.stages[:-1]) * len(problem.vehicles))
+        for x, y, z, i, k, t, v in problem.a.keys():
+            L, W, H = problem.boxes[i]
+            self.assertGreater(problem.demand[i][k], 0)
+            self.assertLessEqual(x + L, problem.dimensions["length"])
+            self.assertLessEqual(y + W, problem.dimensions["width"])
+            self.assertLessEqual(z + H, problem.dimensions["height"])
+
+
+class TestPlacementIndices(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.problem = CVRP("indices", **small_instance(), constraints=constraintGenerator([2]))
+
+    def test_coverage_matches_box_extents(self):
+        problem = self.problem
+        cells = [(x, y, z) for x in problem.xpos for y in problem.ypos for z in problem.zpos]
+        for cell, (x_p, y_p, z_p) in enumerate(cells):
+            expected = [(x, y, z, i) for x, y, z, i in problem.placement_list
+                        if x <= x_p < x + problem.boxes[i][0]
+                        and y <= y_p < y + problem.boxes[i][1]
+                        and z <= z_p < z + problem.boxes[i][2]]
+            self.assertEqual(sorted(problem.indexed(problem.coverage, cell)), sorted(expected))
+
+    def test_support_neighbours(self):
+        problem = self.problem
+        for p, (x, y, z, i) in enumerate(problem.placement_list):
+            expected = [(x_pp, y_pp, z_pp, j) for x_pp, y_pp, z_pp, j in problem.placement_list
+                        if z > 0 and z_pp + problem.boxes[j][2] == z
+                        and -problem.boxes[j][0] < x_pp - x < problem.boxes[i][0]
+                        and -problem.boxes[j][1] < y_pp - y < problem.boxes[i][1]]
+            self.assertEqual(sorted(problem.indexed(problem.support, p)), sorted(expected))
+
+    def test_overlap_areas(self):
+        boxes = {1: [2, 3, 1], 2: [4, 1, 1]}
+        area, shift = overlap_areas(boxes)
+        for i, j in itertools.product(boxes, repeat=2):
+            for dx, dy in itertools.product(range(-5, 6), repeat=2):
+                expected = max(min(boxes[i][0], dx + boxes[j][0]) - max(0, dx), 0) * \
+                           max(min(boxes[i][1], dy + boxes[j][1]) - max(0, dy), 0)
+                if abs(dx) <= shift[0] and abs(dy) <= shift[1]:
+                    self.assertEqual(area[i, j, dx + shift[0], dy + shift[1]], expected)
+                else:
+                    self.assertEqual(expected, 0)
+
+    def test_supporting_areas(self):
+        problem = self.problem
+        for p, (x, y, z, i) in enumerate(problem.placement_list):
+            for (x_pp, y_pp, _, j), area in problem.supporting(p):
+                self.assertGreater(area, 0)
+                self.assertEqual(area, (min(x + problem.boxes[i][0], x_pp + problem.boxes[j][0]) - max(x, x_pp)) *
+                                       (min(y + problem.boxes[i][1], y_pp + problem.boxes[j][1]) - max(y, y_pp)))
+
+
+class TestBuildProfiler(unittest.TestCase):
+
+    def test_phases_add_up_to_model_size(self):
+        problem = CVRP("profiled", **small_instance(), constraints=constraintGenerator([2, 9, 10]), profile=True)
+        report = problem.profiler.report()
+
+        self.assertEqual([phase["phase"] for phase in report["phases"]],
+                         ["decision_variables", "ObjectiveFunc", "constraintTwo", "constraintNine", "constraintTen"])
+        self.assertEqual(report["total"]["rows"], problem.model.NumConstrs)
+        self.assertEqual(report["total"]["columns"], problem.model.NumVars)
+        self.assertEqual(report["total"]["nonzeros"], problem.model.NumNZs)
+        self.assertEqual(json.loads(problem.profiler.to_json()), report)
+
+    def test_disabled_by_default(self):
+        problem = CVRP("unprofiled", **small_instance(), constraints=constraintGenerator([2]))
+        self.assertEqual(problem.profiler.phases, [])
+
+
+class TestWarmStart(unittest.TestCase):
+
+    def test_start_is_feasible(self):
+        problem = CVRP("warm_start", **small_instance(), constraints=constraintGenerator(range(1, 20)))
+        routes = problem.warm_start()
+        self.assertIsNotNone(routes)
+        self.assertEqual(sorted(k for route in routes.values() for k in route), problem.nodes[1:])
+
+        # Fixing every variable to its start value has to leave a feasible model
+        problem.model.update()
+        for var in problem.model.getVars():
+            var.LB = var.UB = var.Start
+        problem.model.setParam("OutputFlag", 0)
+        problem.model.optimize()
+        self.assertEqual(problem.model.Status, GRB.OPTIMAL)
+
+
+class TestLazyConstraints(unittest.TestCase):
+
+    def test_same_optimum_as_full_model(self):
+        objectives = []
+        for lazy in ([], [10, 13]):
+            problem = CVRP("lazy", **small_instance(), constraints=constraintGenerator(range(1, 20), lazy=lazy))
+            problem.model.setParam("OutputFlag", 0)
+            problem.optimize(user_cuts=True)
+            self.assertEqual(problem.model.Status, GRB.OPTIMAL)
+            objectives.append(problem.model.ObjVal)
+
+        # The incumbent satisfies the lazy rows that were never added to the model
+        self.assertEqual(problem.model.NumConstrs, len(problem.model.getConstrs()))
+        self.assertFalse(any("10|" in constr.ConstrName for constr in problem.model.getConstrs()))
+        self.assertEqual(problem.violated_rows(problem.model.getAttr("X", problem.a_vars)), [])
+        self.assertAlmostEqual(objectives[0], objectives[1])
+
+    def test_only_ten_and_thirteen_can_be_lazy(self):
+        with self.assertRaises(ValueError):
+            constraintGenerator(range(1, 20), lazy=[9])
+
+
+class TestDecomposition(unittest.TestCase):
+
+    def test_same_optimum_as_full_model(self):
+        decomposition = Decomposition("decomposition", **small_instance())
+        decomposition.master.model.setParam("OutputFlag", 0)
+        routes = decomposition.optimize()
+        self.assertEqual(sorted(k for route, _ in routes.values() for k in route), [2, 3])
+
+        problem = CVRP("full", **small_instance(), constraints=constraintGenerator(range(1, 20)))
+        problem.model.setParam("OutputFlag", 0)
+        problem.optimize()
+        self.assertAlmostEqual(decomposition.master.model.ObjVal, problem.model.ObjVal)
+
+    def test_unloadable_route_is_cut(self):
+        # Two boxes that fit the vehicle volume together but cannot be placed side by side or stacked
+        instance = small_instance()
+        instance.update({"boxes": {1: [4, 4, 3]}, "demand": {1: {2: 1, 3: 1}}, "maximum_reach": [[4, 4]],
+                         "p": [48], "sigma": [100]})
+        decomposition = Decomposition("unloadable", **instance)
+        decomposition.master.model.setParam("OutputFlag", 0)
+        routes = decomposition.optimize()
+        self.assertEqual(sorted(route for route, _ in routes.values()), [(2,), (3,)])
+        self.assertTrue(all(placements for _, placements in routes.values()))
+
+    def test_route_longer_than_stage_horizon(self):
+        # Customers 4 and 5 fill the vehicle on their own, a route over both exceeds its stage horizon
+        instance = small_instance()
+        instance.update({"nodes": [1, 2, 3, 4, 5], "links": make_links([1, 2, 3, 4, 5]), "vehicles": [0, 1, 2],
+                         "dimensions": {"length": 5, "width": 5, "height": 5}, "boxes": {1: [2, 2, 2]},
+                         "demand": {1: {2: 1, 3: 1, 4: 6, 5: 6}}, "maximum_reach": [[2, 2, 2, 2]], "p": [8],
+                         "sigma": [100]})
+        decomposition = Decomposition("horizon", **instance)
+        decomposition.master.model.setParam("OutputFlag", 0)
+        self.assertIsNone(decomposition.feasible((4, 5)))
+        self.assertEqual(decomposition.subproblem((4, 5)).stages, [1, 2, 3])
+
+        for engine in (decomposition, ColumnGeneration("horizon", **instance)):
+            routes = engine.optimize()
+            self.assertEqual(sorted(k for route, _ in routes.values() for k in route), [2, 3, 4, 5])
+
+
+class TestColumnGeneration(unittest.TestCase):
+
+    def test_same_optimum_as_full_model(self):
+        generation = ColumnGeneration("columns", **small_instance())
+        routes = generation.optimize()
+        self.assertEqual(sorted(k for route, _ in routes.values() for k in route), [2, 3])
+
+        problem = CVRP("full", **small_instance(), constraints=constraintGenerator(range(1, 20)))
+        problem.model.setParam("OutputFlag", 0)
+        problem.optimize()
+        self.assertAlmostEqual(generation.model.ObjVal, problem.model.ObjVal)
+        self.assertLessEqual(generation.lp_value, generation.model.ObjVal + 1e-6)
+
+    def test_larger_instance(self):
+        instance = generate_instance(16, 16, 3, {"length": 20, "width": 10, "height": 10}, 0.4, max_demand=2, seed=1)
+        generation = ColumnGeneration("columns", **instance, exact=False)
+        routes = generation.optimize()
+
+        self.assertEqual(sorted(k for route, _ in routes.values() for k in route), instance["nodes"][1:])
+        for route, placements in routes.values():
+            self.assertEqual(len(placements), sum(instance["demand"][i][k] for k in route for i in instance["boxes"]))
+        self.assertFalse(generation.infeasible)
+
+
+class TestALNS(unittest.TestCase):
+
+    def test_same_optimum_as_full_model(self):
+        search = ALNS(**small_instance(), iterations=200, seed=0)
+        routes = search.optimize()
+        self.assertEqual(sorted(k for route, _ in routes.values() for k in route), [2, 3])
+
+        problem = CVRP("full", **small_instance(), constraints=constraintGenerator(range(1, 20)))
+        problem.model.setParam("OutputFlag", 0)
+        problem.optimize()
+        self.assertAlmostEqual(search.best_cost, problem.model.ObjVal)
+
+    def test_iterations_only(self):
+        search = ALNS(**small_instance(), time_limit=None, iterations=50, seed=0)
+        self.assertIsNotNone(search.optimize())
+        self.assertEqual(search.iteration_count, 50)
+        self.assertEqual(search.solution().status, GRB.ITERATION_LIMIT)
+        with self.assertRaises(ValueError):
+            ALNS(**small_instance(), time_limit=None)
+
+    def test_time_limit_and_solution_shape(self):
+        instance = generate_instance(20, 3, 4, {"length": 40, "width": 10, "height": 10}, 0.3, max_demand=1, seed=0)
+        search = ALNS(**instance, time_limit=1, seed=0)
+        initial = search.cost(search.initial())
+        search.optimize()
+        solution = search.solution()
+
+        self.assertEqual(solution.status, GRB.TIME_LIMIT)
+        self.assertLessEqual(solution.objective, initial)
+        self.assertLessEqual(len(solution.routes()), 3)
+        self.assertEqual(sorted(k for route in solution.routes().values() for k in route), instance["nodes"][1:])
+        self.assertEqual(len(solution.placements), sum(sum(demand.values()) for demand in instance["demand"].values()))
+
+        # Every route leaves the depot at stage 1 and its boxes are loaded for the stage their customer is visited
+        for v, route in solution.routes().items():
+            arcs = solution.arcs[solution.arcs[:, 0] == v]
+            self.assertEqual(arcs[:, 1].tolist(), list(range(1, len(route) + 2)))
+            loading = solution.loading(v)
+            self.assertTrue(all(route[t - 1] == k for k, t in loading[:, 4:6]))
+
+
+class TestVerifier(unittest.TestCase):
+
+    @staticmethod
+    def verifier(instance):
+        return SolutionVerifier(instance["nodes"], instance["vehicles"], instance["dimensions"], instance["boxes"],
+                                instance["demand"], instance["maximum_reach"], instance["p"], instance["sigma"])
+
+    @staticmethod
+    def checks(violations):
+        return sorted({check for check, _ in violations})
+
+    def test_model_and_heuristic_solutions_pass(self):
+        problem = CVRP("verified", **small_instance(), constraints=constraintGenerator(range(1, 20)))
+        problem.model.setParam("OutputFlag", 0)
+        problem.optimize()
+        self.assertEqual(self.verifier(small_instance()).verify(problem.solution()), [])
+
+        instance = generate_instance(20, 3, 4, {"length": 40, "width": 10, "height": 10}, 0.3, max_demand=1, seed=0)
+        search = ALNS(**instance, iterations=50, seed=0)
+        search.optimize()
+        self.assertTrue(self.verifier(instance).feasible(search.solution()))
+
+    def test_violations(self):
+        verifier = self.verifier(small_instance())
+        arcs = [[0, 1, 1, 3], [0, 2, 3, 1], [1, 1, 1, 2], [1, 2, 2, 1]]
+        placements = [[0, 1, 3, 1, 4, 2, 0], [1, 1, 2, 1, 0, 0, 0], [1, 1, 2, 2, 0, 2, 0]]
+        self.assertEqual(verifier.verify(Solution(46, GRB.OPTIMAL, 1, arcs, placements)), [])
+
+        cases = [("overlap", arcs, [placements[0], placements[1], [1, 1, 2, 2, 0, 1, 0]]),
+                 ("support", arcs, [placements[0], placements[1], [1, 1, 2, 2, 0, 2, 2]]),
+                 ("containment", arcs, [[0, 1, 3, 1, 5, 2, 0]] + placements[1:]),
+                 ("demand", arcs, placements[:2]),
+                 ("demand", arcs, [[1, 1, 3, 1, 4, 2, 0]] + placements[1:]),
+                 ("routes", arcs[:1] + arcs[2:], placements),
+                 ("visits", arcs + [[2, 1, 1, 2], [2, 2, 2, 1]], placements)]
+        for check, case_arcs, case_placements in cases:
+            with self.subTest(check=check):
+                violations = verifier.verify(Solution(46, GRB.OPTIMAL, 1, case_arcs, case_placements))
+                self.assertIn(check, self.checks(violations))
+
+    def test_reach_and_load_bearing(self):
+        instance = small_instance()
+        instance["vehicles"] = [0]
+        verifier = self.verifier(instance)
+        arcs = [[0, 1, 1, 2], [0, 2, 2, 3], [0, 3, 3, 1]]
+
+        # The boxes of customer 2 are unloaded first and have to be within reach of the front of customer 3
+        reachable = [[0, 1, 2, 1, 2, 0, 0], [0, 1, 2, 2, 2, 2, 0], [0, 2, 3, 1, 0, 0, 0]]
+        blocked = [[0, 1, 2, 1, 0, 0, 0], [0, 1, 2, 2, 0, 2, 0], [0, 2, 3, 1, 4, 0, 0]]
+        self.assertEqual(verifier.verify(Solution(0, GRB.OPTIMAL, 1, arcs, reachable)), [])
+        self.assertEqual(self.checks(verifier.verify(Solution(0, GRB.OPTIMAL, 1, arcs, blocked))), ["multidrop"])
+
+        # Box 1 weighs 8 on 4 units of area, more than the strength 1 of box 2 below it
+        instance["sigma"] = [20, 1]
+        stacked = [[0, 1, 2, 1, 2, 0, 2], [0, 1, 2, 2, 2, 0, 0], [0, 2, 3, 1, 0, 0, 0]]
+        self.assertEqual(self.checks(self.verifier(instance).verify(Solution(0, GRB.OPTIMAL, 1, arcs, stacked))),
+                         ["load_bearing"])
+
+
+class TestPacker(unittest.TestCase):
+
+    def test_diagonal_box_gives_no_support(self):
+        # A 3x3 box at (2, 2, 0) misses the 1x1 face at (0, 0, 1) along both axes
+        boxes = {1: [1, 1, 1], 2: [3, 3, 1]}
+        packer = ExtremePointPacker(boxes, {"length": 6, "width": 6, "height": 3}, (range(6), range(6), range(3)))
+        lo, hi = np.array([[2, 2, 0]]), np.array([[5, 5, 1]])
+        grid = np.zeros((6, 6, 3))
+        self.assertFalse(packer._fits((0, 0, 1), 1, lo, hi, grid, grid))
+        self.assertTrue(packer._fits((2, 2, 1), 1, lo, hi, grid, grid))
+
+
+class TestPackingCache(unittest.TestCase):
+
+    def test_verdicts_shared_between_instances(self):
+        instance = small_instance()
+        args = [instance[key] for key in ("demand", "boxes", "dimensions", "maximum_reach", "p", "sigma")]
+        placements = [(0, 0, 0, 2, 2), (4, 0, 0, 1, 2), (0, 2, 0, 1, 3)]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "packing.sqlite")
+            cache = PackingCache(path=path)
+            cache.put((2, 3), *args, placements)
+            cache.put((3, 2), *args, None)
+            cache.close()
+
+            # Same loading problem with the box types numbered the other way round and the customers swapped
+            cache = PackingCache(path=path)
+            boxes = {1: instance["boxes"][2], 2: instance["boxes"][1]}
+            demand = {1: {2: 0, 3: 1}, 2: {2: 1, 3: 1}}
+            relabelled = [demand, boxes, instance["dimensions"], [[4, 4], [2, 2]], instance["p"][::-1],
+                          instance["sigma"][::-1]]
+            self.assertEqual(cache.get((3, 2), *relabelled),
+                             (True, [(0, 0, 0, 1, 3), (4, 0, 0, 2, 3), (0, 2, 0, 2, 2)]))
+            self.assertEqual(cache.get((2, 3), *relabelled), (True, None))
+            self.assertEqual(cache.get((2,), *args), (False, None))
+            cache.close()
+
+    def test_verdicts_not_shared_between_rules(self):
+        instance = small_instance()
+        args = [instance[key] for key in ("demand", "boxes", "dimensions", "maximum_reach", "p", "sigma")]
+        cache = PackingCache()
+        cache.put((2, 3), *args, None, rules=((1, 2, 3), True))
+        self.assertEqual(cache.get((2, 3), *args, rules=((1, 2, 3), True)), (True, None))
+        self.assertEqual(cache.get((2, 3), *args, rules=((1, 2), True)), (False, None))
+        self.assertEqual(cache.get((2, 3), *args, rules=((1, 2, 3), False)), (False, None))
+
+    def test_least_recently_used_entry_evicted(self):
+        cache = PackingCache(capacity=2)
+        cache.store("a", [])
+        cache.store("b", [])
+        cache.lookup("a")
+        cache.store("c", [])
+        self.assertEqual(cache.lookup("b"), (False, None))
+        self.assertEqual(cache.lookup("a"), (True, []))
+
+
+class TestModelCache(unittest.TestCase):
+
+    def test_reloaded_model_matches_build(self):
+        with tempfile.TemporaryDirectory() as directory:
+            built = CVRP("built", **small_instance(), constraints=constraintGenerator(range(1, 20)), cache=directory)
+            loaded = CVRP("loaded", **small_instance(), constraints=constraintGenerator(range(1, 20)),
+                          builder="matrix", cache=directory)
+            self.assertEqual(len(os.listdir(directory)), 2)
+            self.assertEqual(model_rows(loaded.model), model_rows(built.model))
+
+            # The rebound variables belong to the reloaded model
+            for family in ("d", "a", "l_p"):
+                self.assertEqual([var.VarName for var in getattr(loaded, family).values()],
+                                 [var.VarName for var in getattr(built, family).values()])
+                self.assertEqual(list(getattr(loaded, family).keys()), list(getattr(built, family).keys()))
+            self.assertIsNotNone(loaded.warm_start())
+            loaded.model.setParam("OutputFlag", 0)
+            loaded.optimize()
+            self.assertEqual(loaded.model.Status, GRB.OPTIMAL)
+
+            # Different inputs are not served from the cache
+            CVRP("routing", **small_instance(), constraints=constraintGenerator([2, 3, 4, 5, 8]), cache=directory)
+            self.assertEqual(len(os.listdir(directory)), 4)
+
+    def test_files_named_after_model_hash(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ModelCache(directory)
+            models = [CVRP("full", **small_instance(), constraints=constraintGenerator(range(1, 20))),
+                      CVRP("routing", **small_instance(), constraints=constraintGenerator([2, 3, 4, 5, 8]))]
+            keys = [cache.key(problem) for problem in models]
+
+            # Temporary files of every store, seen right before they are renamed
+            seen = []
+            replace = os.replace
+            def record(source, target):
+                seen.extend(os.listdir(directory))
+                replace(source, target)
+
+            with mock.patch("os.replace", side_effect=record):
+                for problem in models:
+                    cache.store(problem)
+            for name in seen + os.listdir(directory):
+                self.assertIn(name.split(".")[0], keys)
+            self.assertEqual(len(os.listdir(directory)), 4)
+
+
+
+class TestConstraintGroups(unittest.TestCase):
+
+    def test_toggled_model_matches_fresh_build(self):
+        full = model_rows(CVRP("full", **small_instance(), constraints=constraintGenerator(range(1, 20))).model)
+        subset = constraintGenerator([2, 3, 4, 5, 8, 9, 11, 14, 15, 16, 17, 18])
+        partial = model_rows(CVRP("partial", **small_instance(), constraints=subset).model)
+
+        for builder in ("loop", "matrix"):
+            with self.subTest(builder=builder):
+                problem = CVRP("toggled", **small_instance(), constraints=constraintGenerator(range(1, 20)),
+                               builder=builder)
+                columns = problem.model.NumVars
+                problem.set_constraints({"constraintTen": False, "constraintThirteen": False})
+                self.assertEqual(model_rows(problem.model), partial)
+                problem.set_constraints(constraintGenerator(range(1, 20)))
+                self.assertEqual(model_rows(problem.model), full)
+                self.assertEqual(problem.model.NumVars, columns)
+
+    def test_groups_survive_model_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            CVRP("built", **small_instance(), constraints=constraintGenerator(range(1, 20)), cache=directory)
+            problem = CVRP("loaded", **small_instance(), constraints=constraintGenerator(range(1, 20)),
+                           cache=directory)
+            problem.set_constraints({"constraintTen": "lazy"})
+            self.assertEqual(problem.lazy, ["constraintTen"])
+            self.assertFalse(any(name.startswith("10|")
+                                 for name in problem.model.getAttr("ConstrName", problem.model.getConstrs())))
+
+
+class TestStageHorizon(unittest.TestCase):
+
+    def test_trimmed_stages_keep_optimum(self):
+        # Two customers fill a 4x4x4 vehicle with 2x2x2 boxes, a third one does not fit
+        np.random.seed(0)
+        nodes = [1, 2, 3, 4]
+        instance = {"nodes": nodes, "links": make_links(nodes), "vehicles": [0, 1],
+                    "dimensions": {"length": 4, "width": 4, "height": 4}, "boxes": {1: [2, 2, 2]},
+                    "demand": {1: {2: 3, 3: 3, 4: 3}}, "maximum_reach": [[2, 2, 2]], "p": [8], "sigma": [100]}
+        self.assertEqual(stage_horizon(nodes, instance["dimensions"], instance["boxes"], instance["demand"]), 2)
+
+        objectives = []
+        for trim_stages in (False, True):
+            problem = CVRP("horizon", **instance, constraints=constraintGenerator(range(1, 20)),
+                           trim_stages=trim_stages)
+            problem.model.setParam("OutputFlag", 0)
+            problem.optimize()
+            objectives.append(problem.model.ObjVal)
+        self.assertEqual(problem.stages, [1, 2, 3])
+        self.assertAlmostEqual(objectives[0], objectives[1])
+
+    def test_not_trimmed_by_default(self):
+        # The horizon of the instance is two customers, without the loading constraints one vehicle serves all three
+        nodes = [1, 2, 3, 4]
+        instance = {"nodes": nodes, "links": make_links(nodes), "vehicles": [0],
+                    "dimensions": {"length": 4, "width": 4, "height": 4}, "boxes": {1: [2, 2, 2]},
+                    "demand": {1: {2: 3, 3: 3, 4: 3}}, "maximum_reach": [[2, 2, 2]], "p": [8], "sigma": [100]}
+        problem = CVRP("routing", **instance, constraints=constraintGenerator([2, 3, 4, 5]))
+        problem.model.setParam("OutputFlag", 0)
+        problem.optimize()
+        self.assertEqual(problem.stages, [1, 2, 3, 4])
+        self.assertEqual(problem.model.Status, GRB.OPTIMAL)
+
+    def test_count_bound(self):
+        # At most eight 2x2x2 boxes fit a 5x5x5 vehicle, the volume bound alone would allow a third customer
+        boxes = {1: [2, 2, 2], 2: [1, 1, 1]}
+        demand = {1: {2: 3, 3: 3, 4: 3}, 2: {2: 0, 3: 0, 4: 0}}
+        self.assertEqual(stage_horizon([1, 2, 3, 4], {"length": 5, "width": 5, "height": 5}, boxes, demand), 2)
+
+
+class TestArcs(unittest.TestCase):
+
+    def test_pruning_within_upper_bound_keeps_optimum(self):
+        instance = generate_instance(4, 2, 2, {"length": 6, "width": 4, "height": 4}, 0.5, box_size=(2, 3), seed=4)
+        full = CVRP("full", **instance, constraints=constraintGenerator(range(1, 20)))
+        full.model.setParam("OutputFlag", 0)
+        full.optimize()
+        self.assertEqual(len(full.arcs), 12)
+
+        for builder in ("loop", "matrix"):
+            with self.subTest(builder=builder):
+                pruned = CVRP("pruned", **instance, constraints=constraintGenerator(range(1, 20)), builder=builder,
+                              upper_bound=full.model.ObjVal)
+                self.assertLess(len(pruned.arcs), len(full.arcs))
+                pruned.model.setParam("OutputFlag", 0)
+                pruned.optimize()
+                self.assertAlmostEqual(pruned.model.ObjVal, full.model.ObjVal)
+
+    def test_distance_matrix_links(self):
+        instance = small_instance()
+        instance["links"] = distance_matrix(instance["nodes"], instance["links"])
+        self.assertEqual(model_rows(CVRP("matrix_links", **instance, constraints=constraintGenerator([2, 3, 5])).model),
+                         model_rows(CVRP("dict_links", **small_instance(), constraints=constraintGenerator([2, 3, 5])).model))
+
+    def test_nearest_neighbours(self):
+        distance = np.array([[0, 1, 1, 1],
+                             [1, 0, 1, 5],
+                             [1, 1, 0, 6],
+                             [1, 5, 6, 0]], dtype=float)
+        keep = prune_arcs(distance, neighbours=1)
+        self.assertFalse(keep.diagonal().any())
+        self.assertTrue(keep[0, 1:].all() and keep[1:, 0].all())
+        self.assertEqual(np.argwhere(keep[1:, 1:]).tolist(), [[0, 1], [0, 2], [1, 0], [2, 0]])
+
+
+class TestSymmetryBreaking(unittest.TestCase):
+
+    def test_same_optimum(self):
+        instance = generate_instance(4, 2, 2, {"length": 6, "width": 4, "height": 4}, 0.5, box_size=(2, 3), seed=1)
+        objectives = []
+        for symmetry in (False, True):
+            problem = CVRP("symmetry", **instance, constraints=constraintGenerator(range(1, 20)), symmetry=symmetry)
+            problem.model.setParam("OutputFlag", 0)
+            problem.optimize()
+            objectives.append(problem.model.ObjVal)
+        self.assertEqual(len(problem.groups["symmetryVehicles"]), 1)
+        self.assertEqual(len(problem.groups["symmetryMirror"]), 2)
+        self.assertAlmostEqual(objectives[0], objectives[1])
+
+    def test_warm_start_respects_vehicle_order(self):
+        problem = CVRP("symmetry", **small_instance(), constraints=constraintGenerator(range(1, 20)), symmetry=True)
+        self.assertIsNotNone(problem.warm_start())
+        problem.model.update()
+        for var in problem.model.getVars():
+            var.LB = var.UB = var.Start
+        problem.model.setParam("OutputFlag", 0)
+        problem.optimize()
+        self.assertEqual(problem.model.Status, GRB.OPTIMAL)
+
+
+class TestGridScale(unittest.TestCase):
+
+    def scaled_instance(self, factor):
+        instance = small_instance()
+        instance["dimensions"] = {key: size * factor for key, size in instance["dimensions"].items()}
+        instance["boxes"] = {i: [size * factor for size in dims] for i, dims in instance["boxes"].items()}
+        instance["maximum_reach"] = [[reach * factor for reach in row] for row in instance["maximum_reach"]]
+        instance["p"] = [weight * factor ** 2 for weight in instance["p"]]
+        return instance
+
+    def test_common_divisor_gives_same_model(self):
+        unit = CVRP("unit", **small_instance(), constraints=constraintGenerator(range(1, 20)))
+        scaled = CVRP("scaled", **self.scaled_instance(5), constraints=constraintGenerator(range(1, 20)))
+
+        self.assertEqual(unit.scale.tolist(), [2, 2, 2])
+        self.assertEqual(scaled.scale.tolist(), [10, 10, 10])
+        self.assertEqual(scaled.boxes, unit.boxes)
+        self.assertEqual(scaled.dimensions, unit.dimensions)
+        self.assertEqual(model_rows(scaled.model), model_rows(unit.model))
+
+        scaled.model.setParam("OutputFlag", 0)
+        scaled.optimize()
+        solution = scaled.solution()
+        self.assertEqual(solution.objective, 46)
+        for _, _, _, i, x, y, z in solution.placements:
+            self.assertEqual([x % 10, y % 10, z % 10], [0, 0, 0])
+            self.assertLessEqual(x + scaled.boxes[i][0] * 10, 60)
+
+    def test_resolution_rounds_outward(self):
+        instance = small_instance()
+        instance["dimensions"] = {"length": 13, "width": 9, "height": 9}
+        instance["boxes"] = {1: [3, 3, 3], 2: [5, 3, 2]}
+        problem = CVRP("rounded", **instance, constraints=constraintGenerator([2]), resolution=2)
+
+        self.assertEqual(problem.dimensions, {"length": 6, "width": 4, "height": 4})
+        self.assertEqual(problem.boxes, {1: [2, 2, 2], 2: [3, 2, 1]})
+        self.assertEqual(problem.maximum_reach, [[1, 1], [2, 2]])
+
+
+class TestBigM(unittest.TestCase):
+
+    def test_same_optimum_for_every_formulation(self):
+        for big_m in ("global", "tight", "indicator"):
+            with self.subTest(big_m=big_m):
+                problem = CVRP(big_m, **small_instance(), constraints=constraintGenerator(range(1, 20)), big_m=big_m)
+                problem.model.setParam("OutputFlag", 0)
+                problem.optimize()
+                self.assertEqual(problem.model.Status, GRB.OPTIMAL)
+                self.assertAlmostEqual(problem.model.ObjVal, 46)
+
+    def test_tight_values_bounded_by_vehicle_length(self):
+        problem = CVRP("tight", **small_instance(), constraints=constraintGenerator([2]))
+        length = problem.dimensions["length"]
+        for i in problem.boxID:
+            for k in problem.box_customers[i]:
+                reach = problem.maximum_reach[i-1][k-2]
+                for x in problem.xpos_lst[i-1]:
+                    M1, M2 = problem.multidrop_m(reach, x)
+                    self.assertEqual((M1, M2), (max(length - reach, 0), max(length - reach - x, 0)))
+                    self.assertLess(M1, problem.M1)
+
+    def test_builders_agree(self):
+        for big_m in ("global", "tight", "indicator"):
+            with self.subTest(big_m=big_m):
+                loop = CVRP("loop", **small_instance(), constraints=constraintGenerator(range(1, 20)), big_m=big_m)
+                matrix = CVRP("matrix", **small_instance(), constraints=constraintGenerator(range(1, 20)),
+                              builder="matrix", big_m=big_m)
+                self.assertEqual(model_rows(loop.model), model_rows(matrix.model))
+                self.assertEqual(loop.model.NumGenConstrs, matrix.model.NumGenConstrs)
+
+    def test_indicators_toggled_and_cached(self):
+        with tempfile.TemporaryDirectory() as directory:
+            CVRP("built", **small_instance(), constraints=constraintGenerator(range(1, 20)), cache=directory,
+                 big_m="indicator")
+            problem = CVRP("loaded", **small_instance(), constraints=constraintGenerator(range(1, 20)), cache=directory,
+                           big_m="indicator")
+            indicators = problem.model.NumGenConstrs
+            self.assertGreater(indicators, 0)
+            self.assertEqual(len(problem.groups["constraintFifteen"]) + len(problem.groups["constraintSixteen"]),
+                             indicators)
+
+            problem.set_constraints({"constraintFifteen": False, "constraintSixteen": False})
+            self.assertEqual(problem.model.NumGenConstrs, 0)
+
+    def test_invalid_big_m(self):
+        with self.assertRaises(ValueError):
+            CVRP("invalid", **small_instance(), constraints=constraintGenerator([2]), big_m="huge")
+
+
+class TestSolution(unittest.TestCase):
+
+    def test_bulk_extraction_matches_variables(self):
+        problem = CVRP("solution", **small_instance(), constraints=constraintGenerator(range(1, 20)))
+        problem.model.setParam("OutputFlag", 0)
+        problem.optimize()
+        solution = problem.solution()
+
+        arcs = sorted((v, t, k, l) for (k, l, v, t), var in problem.d.items() if var.X > 0.5)
+        sx, sy, sz = problem.scale
+        placements = sorted((v, t, k, i, x * sx, y * sy, z * sz)
+                            for (x, y, z, i, k, t, v), var in problem.a.items() if var.X > 0.5)
+        self.assertEqual(sorted(map(tuple, solution.arcs.tolist())), arcs)
+        self.assertEqual(sorted(map(tuple, solution.placements.tolist())), placements)
+        self.assertEqual(sorted(k for route in solution.routes().values() for k in route), [2, 3])
+        self.assertEqual(solution.objective, problem.model.ObjVal)
+
+        with tempfile.TemporaryDirectory() as directory:
+            solution.to_npz(os.path.join(directory, "solution.npz"))
+            loaded = Solution.from_npz(os.path.join(directory, "solution.npz"))
+        self.assertEqual(loaded.to_dict(), solution.to_dict())
+        self.assertEqual(json.loads(solution.to_json())["placements"], solution.placements.tolist())
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_failed_worker_does_not_stop_batch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            save_instance(small_instance(), os.path.join(directory, "a_small.json"), constraints=[2, 3, 4, 5, 8])
+            broken = small_instance()
+            del broken["demand"][2]
+            save_instance(broken, os.path.join(directory, "b_broken.json"))
+
+            instance, constraints = load_instance(os.path.join(directory, "a_small.json"))
+            self.assertEqual(instance, small_instance())
+            self.assertEqual(constraints, [2, 3, 4, 5, 8])
+
+            results = run_batch(directory, workers=2, time_limit=10)
+
+        self.assertEqual([result["instance"] for result in results], ["a_small", "b_broken"])
+        self.assertEqual(results[0]["status"], GRB.OPTIMAL)
+        self.assertIn("error", results[1])
+        self.assertEqual(summarize(results)["outcomes"], {str(GRB.OPTIMAL): 1, "error": 1})
+
+
+class TestRender(unittest.TestCase):
+
+    def test_box_faces(self):
+        faces = box_faces([[0, 0, 0], [1, 2, 3]], [[2, 2, 1], [1, 1, 1]])
+        self.assertEqual(faces.shape, (12, 4, 3))
+        self.assertEqual(faces[1].tolist(), [[0, 0, 1], [2, 0, 1], [2, 2, 1], [0, 2, 1]])
+        self.assertEqual(faces[6:].min(axis=(0, 1)).tolist(), [1, 2, 3])
+        self.assertEqual(faces[6:].max(axis=(0, 1)).tolist(), [2, 3, 4])
+
+    def test_render_vehicles_and_stages(self):
+        instance = small_instance()
+        placements = [[0, 1, 2, 1, 0, 0, 0], [0, 2, 3, 2, 1, 0, 0], [1, 1, 3, 1, 0, 0, 0]]
+        solution = Solution(0, GRB.OPTIMAL, 1, [], placements)
+        renderer = LoadRenderer(instance["boxes"], instance["dimensions"], figsize=(3, 3), dpi=40)
+
+        with tempfile.TemporaryDirectory() as directory:
+            paths = renderer.render(solution, directory, stages=True)
+            self.assertEqual([os.path.basename(path) for path in paths],
+                             ["vehicle_0.png", "vehicle_0_stage_1.png", "vehicle_0_stage_2.png",
+                              "vehicle_1.png", "vehicle_1_stage_1.png"])
+            self.assertTrue(all(os.path.getsize(path) > 0 for path in paths))
+
+            paths = renderer.render(solution, directory, fmt="svg")
+            self.assertEqual(len(paths), 2)
+            with open(paths[0]) as file:
+                self.assertIn("<svg", file.read())
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_build_and_solve_records(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "telemetry.jsonl")
+            telemetry = SolveTelemetry(path, interval=0)
+            for name, lazy in (("plain", ()), ("lazy", (10, 13))):
+                problem = CVRP(name, **small_instance(), constraints=constraintGenerator(range(1, 20), lazy=lazy),
+                               profile=True)
+                problem.model.setParam("OutputFlag", 0)
+                problem.optimize(telemetry=telemetry)
+            telemetry.close()
+
+            with open(path) as file:
+                records = [json.loads(line) for line in file]
+
+            problem.optimize(telemetry=os.path.join(directory, "telemetry.csv"))
+            with open(os.path.join(directory, "telemetry.csv")) as file:
+                header = file.readline().strip().split(",")
+
+        for name in ("plain", "lazy"):
+            phases = [record["phase"] for record in records if record["model"] == name and record["event"] == "build"]
+            self.assertEqual(phases[0], "decision_variables")
+            self.assertEqual(phases[-1], "total")
+
+            final = [record for record in records if record["model"] == name and record["event"] == "final"]
+            self.assertEqual(len(final), 1)
+            self.assertEqual(final[0]["status"], GRB.OPTIMAL)
+            self.assertEqual(final[0]["gap"], 0.0)
+        self.assertIn("progress", {record["event"] for record in records})
+        self.assertEqual(header[:3], ["model", "event", "phase"])
+
+    def test_resolve_samples_progress_and_flushes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "telemetry.jsonl")
+            telemetry = SolveTelemetry(path, interval=1000)
+            problem = CVRP("again", **small_instance(), constraints=constraintGenerator(range(1, 20)))
+            problem.model.setParam("OutputFlag", 0)
+            for _ in range(2):
+                problem.model.reset()
+                problem.optimize(telemetry=telemetry)
+
+            # The records can be read before the stream is closed
+            records = []
+            for _ in range(50):
+                with open(path) as file:
+                    records = [json.loads(line) for line in file]
+                if sum(record["event"] == "final" for record in records) == 2:
+                    break
+                time.sleep(0.1)
+            telemetry.close()
+
+        self.assertEqual(sum(record["event"] == "final" for record in records), 2)
+        self.assertEqual(sum(record["event"] == "progress" for record in records), 2)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_generated_instance(self):
+        params = {"n_nodes": 4, "n_vehicles": 2, "n_box_types": 2, "dimensions": {"length": 6, "width": 4, "height": 4},
+                  "demand_density": 0.3, "box_size": (2, 3), "seed": 4}
+        instance = generate_instance(**params)
+
+        self.assertEqual(instance, generate_instance(**params))
+        self.assertEqual(instance["vehicles"], [0, 1])
+        for k in instance["nodes"][1:]:
+            self.assertGreater(sum(instance["demand"][i][k] for i in instance["boxes"]), 0)
 
+        result = run_case("generated", instance, "routing", [2, 3, 4, 5, 8], time_limit=10)
+        self.assertEqual(result["status"], GRB.OPTIMAL, result.get("error"))
+        self.assertEqual(result["mip_gap"], 0.0)
 
+        # A solve stopped before any incumbent keeps its status and counts but has no bound or gap
+        result = run_case("stopped", instance, "routing", [2, 3, 4, 5, 8], time_limit=0)
+        self.assertNotIn("error", result)
+        self.assertEqual(result["status"], GRB.TIME_LIMIT)
+        self.assertIn("node_count", result)
+        self.assertIsNone(result["bound"])
+        self.assertIsNone(result["mip_gap"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,251 @@
+import itertools
+import numpy as np
+
+class SolutionVerifier():
+    '''
+    Feasibility check of 3L-CVRP solutions without Gurobi, for a Solution of CVRP or of a heuristic. Every check runs
+    on NumPy arrays of the arcs and placements: the routes are checked arc by arc, the loading of every vehicle on an
+    occupancy grid over the box boundaries, so a load plan is verified in milliseconds.
+
+    The checks mirror the model: every customer is visited once (constraint 2), every route is a connected tour
+    from the depot (constraints 3-5), the loaded volume fits the vehicle (constraint 8), every box of the demand is
+    loaded in the vehicle and at the stage its customer is served (constraints 9 and 11), boxes lie inside the
+    vehicle without overlapping (constraint 10), the bottom face of every box is supported by boxes delivered at the
+    same or a later stage (constraint 13), boxes can be reached when their customer is served (constraints 14-17)
+    and the load-bearing strength of every box carries the pressure of the boxes above it (constraint 18).
+    '''
+    CHECKS = ("visits", "routes", "capacity", "demand", "containment", "overlap", "support", "multidrop",
+              "load_bearing")
+
+    def __init__(self, nodes, vehicles, dimensions, boxes, demand, maximum_reach, p, sigma, tolerance=1e-6):
+        self.nodes = nodes
+        self.depot = nodes[0]
+        self.vehicles = vehicles
+        self.size = np.array([dimensions["length"], dimensions["width"], dimensions["height"]], dtype=np.int64)
+        self.tolerance = tolerance
+
+        # Customer index of every node id, -1 for the depot and unknown nodes
+        self.customer = np.full(max(nodes) + 1, -1, dtype=np.int64)
+        self.customer[nodes[1:]] = np.arange(len(nodes) - 1)
+
+        # Box sizes, pressure of a box on the area below it and load-bearing strength, indexed by box id
+        n_boxes = max(boxes) + 1
+        self.sizes = np.zeros((n_boxes, 3), dtype=np.int64)
+        self.pressure = np.zeros(n_boxes)
+        self.strength = np.zeros(n_boxes)
+        for i, dims in boxes.items():
+            self.sizes[i] = dims
+            self.pressure[i] = p[i-1] / (dims[0] * dims[1])
+            self.strength[i] = sigma[i-1]
+
+        # Demand and maximum reach as (box id, customer) arrays, the reach indexed as in the model
+        self.demand = np.zeros((n_boxes, len(nodes) - 1), dtype=np.int64)
+        self.reach = np.zeros((n_boxes, len(nodes) - 1))
+        for i in boxes:
+            self.demand[i] = [demand[i].get(k, 0) for k in nodes[1:]]
+            self.reach[i] = [maximum_reach[i-1][k-2] for k in nodes[1:]]
+        self.volume = (self.demand * self.sizes.prod(axis=1)[:, None]).sum(axis=0)
+
+    def feasible(self, solution):
+        '''
+        Whether the solution passes every check
+        '''
+        return not self.verify(solution)
+
+    def verify(self, solution):
+        '''
+        Runs every check on a Solution and returns the violations as (check, message) pairs, empty when the
+        solution is feasible
+        '''
+        arcs, placements = solution.arcs, solution.placements
+        violations = []
+        violations += self.routing(arcs)
+
+        # Vehicle and stage every customer is served at, and the customer served next by the same vehicle
+        n_customers = len(self.nodes) - 1
+        served_by = np.full(n_customers, -1, dtype=np.int64)
+        served_at = np.full(n_customers, -1, dtype=np.int64)
+        following = np.full(n_customers, -1, dtype=np.int64)
+        visits = arcs[self.known(arcs[:, 3]) & (arcs[:, 3] != self.depot)]
+        served_by[self.customer[visits[:, 3]]] = visits[:, 0]
+        served_at[self.customer[visits[:, 3]]] = visits[:, 1]
+        between = arcs[self.known(arcs[:, 2]) & self.known(arcs[:, 3]) &
+                       (arcs[:, 2] != self.depot) & (arcs[:, 3] != self.depot)]
+        following[self.customer[between[:, 2]]] = self.customer[between[:, 3]]
+
+        violations += self.loading(placements, served_by, served_at)
+        violations += self.multidrop(placements, served_at, following)
+        for v in np.unique(placements[:, 0]):
+            violations += self.packing(v, placements[placements[:, 0] == v])
+        return violations
+
+    def known(self, nodes):
+        '''
+        Mask of the node ids that belong to the instance
+        '''
+        return (nodes >= 0) & (nodes < len(self.customer)) & \
+            ((nodes == self.depot) | (self.customer[np.clip(nodes, 0, len(self.customer) - 1)] >= 0))
+
+    def routing(self, arcs):
+        '''
+        Visit-once, route connectivity and capacity checks on the (vehicle, stage, from, to) rows, sorted by vehicle
+        and stage
+        '''
+        violations = []
+        unknown = ~(self.known(arcs[:, 2]) & self.known(arcs[:, 3]))
+        for v, t, k, l in arcs[unknown]:
+            violations.append(("routes", f"vehicle {v} uses arc ({k}, {l}) at stage {t} between unknown nodes"))
+        arcs = arcs[~unknown]
+
+        # Every customer is entered exactly once
+        entered = np.bincount(self.customer[arcs[arcs[:, 3] != self.depot, 3]], minlength=len(self.nodes) - 1)
+        for c in np.flatnonzero(entered != 1):
+            violations.append(("visits", f"customer {self.nodes[c + 1]} is visited {entered[c]} times"))
+
+        # A route leaves the depot, every next arc starts where the last one ended one stage later, and only the
+        # last arc returns to the depot. The model does not fix the stage of the first arc, a route may start late
+        if len(arcs):
+            same = arcs[1:, 0] == arcs[:-1, 0]
+            first = np.concatenate([[True], ~same])
+            last = np.concatenate([~same, [True]])
+            for v, t, k, _ in arcs[first & (arcs[:, 2] != self.depot)]:
+                violations.append(("routes", f"vehicle {v} starts at node {k} at stage {t}, not at the depot"))
+            broken = same & ((arcs[1:, 1] != arcs[:-1, 1] + 1) | (arcs[1:, 2] != arcs[:-1, 3]))
+            for (v, t, k, _), (_, _, _, l) in zip(arcs[1:][broken], arcs[:-1][broken]):
+                violations.append(("routes", f"vehicle {v} leaves node {k} at stage {t} after arriving at node {l}"))
+            for v, t, _, l in arcs[last & (arcs[:, 3] != self.depot)]:
+                violations.append(("routes", f"vehicle {v} ends at node {l} at stage {t}, not at the depot"))
+            for v, t, _, _ in arcs[~last & (arcs[:, 3] == self.depot)]:
+                violations.append(("routes", f"vehicle {v} returns to the depot at stage {t} before its last arc"))
+
+        # Volume of the customers served by every vehicle
+        served = arcs[arcs[:, 3] != self.depot]
+        vehicles, index = np.unique(served[:, 0], return_inverse=True)
+        load = np.bincount(index, self.volume[self.customer[served[:, 3]]], minlength=len(vehicles))
+        for v, volume in zip(vehicles, load):
+            if volume > self.size.prod() + self.tolerance:
+                violations.append(("capacity", f"vehicle {v} carries volume {volume:g} of {self.size.prod()}"))
+        return violations
+
+    def loading(self, placements, served_by, served_at):
+        '''
+        Demand and containment checks on the (vehicle, stage, customer, box, x, y, z) rows
+        '''
+        violations = []
+        customer = self.customer[np.clip(placements[:, 2], 0, len(self.customer) - 1)]
+        unknown = (placements[:, 2] >= len(self.customer)) | (customer < 0) | (placements[:, 3] >= len(self.sizes))
+        for v, t, k, i, *_ in placements[unknown]:
+            violations.append(("demand", f"vehicle {v} loads box {i} for unknown customer {k} at stage {t}"))
+        placements, customer = placements[~unknown], customer[~unknown]
+
+        # Every box is loaded in the vehicle and at the stage its customer is served
+        misplaced = (placements[:, 0] != served_by[customer]) | (placements[:, 1] != served_at[customer])
+        for v, t, k, i, *_ in placements[misplaced]:
+            violations.append(("demand", f"box {i} of customer {k} is loaded in vehicle {v} at stage {t}, the customer "
+                                         f"is not served there"))
+
+        # Number of loaded boxes of every type and customer
+        loaded = np.zeros_like(self.demand)
+        np.add.at(loaded, (placements[:, 3], customer), 1)
+        for i, c in zip(*np.nonzero(loaded != self.demand)):
+            violations.append(("demand", f"customer {self.nodes[c + 1]} gets {loaded[i, c]} boxes of type {i} "
+                                         f"of {self.demand[i, c]}"))
+
+        # Boxes inside the vehicle
+        ends = placements[:, 4:] + self.sizes[placements[:, 3]]
+        for v, _, k, i, x, y, z in placements[((placements[:, 4:] < 0) | (ends > self.size)).any(axis=1)]:
+            violations.append(("containment", f"box {i} of customer {k} at ({x}, {y}, {z}) sticks out of vehicle {v}"))
+        return violations
+
+    def multidrop(self, placements, served_at, following):
+        '''
+        Reach check, the smallest fronts L'_{kv} satisfying constraints 14, 16 and 17 are the furthest box ends of a
+        customer and of every customer served after it, the boxes of a customer have to be within reach of the front
+        of the next customer (constraint 15)
+        '''
+        violations = []
+        customer = self.customer[np.clip(placements[:, 2], 0, len(self.customer) - 1)]
+        placements, customer = placements[customer >= 0], customer[customer >= 0]
+        front = np.zeros(len(self.nodes) - 1)
+        np.maximum.at(front, customer, placements[:, 4] + self.sizes[placements[:, 3], 0])
+
+        # Fronts propagated backwards along the routes, from the last stage to the first
+        for t in range(served_at.max(initial=0), 0, -1):
+            at = np.flatnonzero((served_at == t) & (following >= 0))
+            front[at] = np.maximum(front[at], front[following[at]])
+
+        later = following[customer]
+        reached = placements[:, 4] >= front[later] - self.reach[placements[:, 3], customer] - self.tolerance
+        for v, t, k, i, x, y, z in placements[(later >= 0) & ~reached]:
+            violations.append(("multidrop", f"box {i} of customer {k} at ({x}, {y}, {z}) in vehicle {v} is out of "
+                                            f"reach at stage {t}"))
+        return violations
+
+    def packing(self, v, placements):
+        '''
+        Overlap, support and load-bearing checks of the boxes of vehicle v
+        '''
+        violations = []
+        origins = placements[:, 4:]
+        sizes = self.sizes[placements[:, 3]]
+        ends = origins + sizes
+
+        # Grid of the cells between the box boundaries along every axis, every box covers a block [lo, hi) of cells
+        edges = [np.unique(np.concatenate([[0], origins[:, axis], ends[:, axis]])) for axis in range(3)]
+        lo = np.column_stack([np.searchsorted(edges[axis], origins[:, axis]) for axis in range(3)])
+        hi = np.column_stack([np.searchsorted(edges[axis], ends[:, axis]) for axis in range(3)])
+        shape = tuple(len(edge) - 1 for edge in edges)
+
+        occupancy = self.fill(shape, lo, hi, np.ones(len(placements)))
+        for x, y, z in np.argwhere(occupancy > 1 + self.tolerance)[:1]:
+            count = int((occupancy > 1 + self.tolerance).sum())
+            violations.append(("overlap", f"vehicle {v} has {count} cells covered by more than one box, first at "
+                                          f"({edges[0][x]}, {edges[1][y]}, {edges[2][z]})"))
+
+        # Bottom faces are covered by the top faces of boxes ending at their height and delivered no earlier, only
+        # the pairs of a lifted box with the boxes ending at its height are formed
+        lifted = np.flatnonzero(origins[:, 2] > 0)
+        order = np.argsort(ends[:, 2], kind="stable")
+        start = np.searchsorted(ends[order, 2], origins[lifted, 2], "left")
+        counts = np.searchsorted(ends[order, 2], origins[lifted, 2], "right") - start
+        rows = np.repeat(np.arange(len(lifted)), counts)
+        cols = order[np.repeat(start, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)]
+        above = lifted[rows]
+        overlap = np.maximum(np.minimum(ends[above, :2], ends[cols, :2]) -
+                             np.maximum(origins[above, :2], origins[cols, :2]), 0).prod(axis=1)
+        later = placements[cols, 1] >= placements[above, 1]
+        supported = np.bincount(rows, overlap * later, minlength=len(lifted)).astype(np.int64)
+        required = sizes[lifted, 0] * sizes[lifted, 1]
+        for (_, t, k, i, x, y, z), area, face in zip(placements[lifted], supported, required):
+            if area < face:
+                violations.append(("support", f"box {i} of customer {k} at ({x}, {y}, {z}) in vehicle {v} has {area} "
+                                              f"of its bottom area {face} supported at stage {t}"))
+
+        # Pressure of the boxes above every cell against the strength of the box in it, a box presses on every cell
+        # below it within its footprint
+        columns = lo.copy()
+        columns[:, 2] = 0
+        tops = hi.copy()
+        tops[:, 2] = lo[:, 2]
+        pressure = self.fill(shape, columns, tops, self.pressure[placements[:, 3]])
+        strength = self.fill(shape, lo, hi, self.strength[placements[:, 3]])
+        crushed = pressure > strength + self.tolerance
+        if crushed.any():
+            x, y, z = np.argwhere(crushed)[0]
+            violations.append(("load_bearing", f"vehicle {v} has {int(crushed.sum())} cells pressed beyond their "
+                                               f"strength, first at ({edges[0][x]}, {edges[1][y]}, {edges[2][z]})"))
+        return violations
+
+    @staticmethod
+    def fill(shape, lo, hi, weights):
+        '''
+        Sum of the weights of the cell blocks [lo, hi) covering every cell of a grid, from a difference array with
+        the weights added at the corners of every block and a cumulative sum along every axis
+        '''
+        grid = np.zeros(tuple(size + 1 for size in shape))
+        for corner in itertools.product((0, 1), repeat=3):
+            index = tuple(np.where(upper, hi[:, axis], lo[:, axis]) for axis, upper in enumerate(corner))
+            np.add.at(grid, index, weights * (-1) ** sum(corner))
+        for axis in range(3):
+            grid = np.cumsum(grid, axis=axis)
+        return grid[:-1, :-1, :-1]